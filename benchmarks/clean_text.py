@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark for message normalization.
+
+Compares the compiled single-pass `TextNormalizer` against the previous chain of
+`re.sub` calls and prints the per-message cost of both.
+
+    python -m benchmarks.clean_text [count]
+"""
+import re
+import sys
+import timeit
+
+from model import TextNormalizer
+from .fixtures import BLACKLIST, SAMPLES, synthetic_texts
+
+
+def legacy_clean(text: str, blacklist=BLACKLIST):
+    for phrase in blacklist:
+        text = re.sub(phrase, "__name__", text, flags=re.IGNORECASE)
+
+    text = text.lower()
+
+    text = re.sub(r"https?://(?:[a-zA-Z]|[0-9]|[#-_]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+", "__url__", text)
+    text = re.sub(r"<a?:(\w{2,32}):\d{15,21}>", "", text)
+    text = re.sub(r"<@!?\d{15,21}>", "__user__", text)
+    text = re.sub(r"<@&\d{15,21}>", "__role__", text)
+    text = re.sub(r"<#\d{15,21}>", "__channel__", text)
+
+    text = re.sub(r"what's", "what is", text)
+    text = re.sub(r"\'s", "", text)
+    text = re.sub(r"\'ve", " have", text)
+    text = re.sub(r"can't", "cannot", text)
+    text = re.sub(r"i'm", "i am", text)
+    text = re.sub(r"\'re", " are", text)
+    text = re.sub(r"\'d", " would", text)
+    text = re.sub(r"\'ll", " will", text)
+    text = re.sub(r"\'", "", text)
+    text = re.sub(r'\W', ' ', text)
+    text = re.sub(r'\s+', ' ', text)
+
+    text = text.strip(' ')
+    return text if len(text.split()) > 1 else ""
+
+
+def main(count=10000):
+    # Suffix every message so clean_many cannot skip repeated texts
+    messages = [f"{text} {i}" for i, text in enumerate(synthetic_texts(count, duplicate_rate=0))]
+    normalizer = TextNormalizer(BLACKLIST)
+
+    mismatches = [m for m in SAMPLES if normalizer.clean(m) != legacy_clean(m)]
+    if mismatches:
+        print(f"Output differs from the legacy cleaner for: {mismatches}")
+
+    legacy = min(timeit.repeat(lambda: [legacy_clean(m) for m in messages], number=1, repeat=3))
+    single = min(timeit.repeat(lambda: [normalizer.clean(m) for m in messages], number=1, repeat=3))
+    batch = min(timeit.repeat(lambda: normalizer.clean_many(messages), number=1, repeat=3))
+
+    print(f"{count} messages, {len(BLACKLIST)} blacklisted phrases")
+    for name, seconds in (('legacy re.sub chain', legacy), ('TextNormalizer.clean', single), ('TextNormalizer.clean_many', batch)):
+        print(f"{name:<28}{seconds / count * 1e6:>8.2f} us/message")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy, memory and speed of compact models against the full model.
+
+Trains every model variant on the same data with `train_version`, then reports the holdout
+ROC AUC, the memory taken by loading the artifact, its size on disk and the scoring throughput.
+Uses a synthetic corpus unless training CSVs or a corpus store are given.
+
+    python -m benchmarks.compact_model [--max-features 50000] [--csv ./input/train.csv | --corpus ./input/corpus] [--output results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from model import LABELS, ToxicityModel, train_version
+from .fixtures import synthetic_corpus, synthetic_texts
+
+
+def variants(max_features):
+    return {
+        'full': {},
+        'compact': {'compact': True},
+        f'compact-frequency-{max_features}': {'compact': True, 'max_features': max_features},
+        f'compact-chi2-{max_features}': {'compact': True, 'max_features': max_features, 'feature_selection': 'chi2'},
+    }
+
+
+def measure(name, options, workdir, data, texts, repeat):
+    path = os.path.join(workdir, f'{name}.npz')
+    result = train_version(path, LABELS, 0.1, **data, **options)
+
+    tracemalloc.start()
+    model = ToxicityModel.load(path)
+    loaded_mb = tracemalloc.get_traced_memory()[0] / (1 << 20)
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.predict_proba(texts)
+        timings.append(time.perf_counter() - start)
+
+    aucs = [m['auc'] for m in result['metrics'].values()]
+    return {
+        'model': name,
+        'features': model.n_features,
+        'mean_auc': round(float(np.mean(aucs)), 4) if aucs else None,
+        'metrics': result['metrics'],
+        'train_seconds': round(result['train_time'], 2),
+        'loaded_mb': round(loaded_mb, 2),
+        'artifact_mb': round(os.path.getsize(path) / (1 << 20), 2),
+        'messages_per_sec': round(len(texts) / min(timings), 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.compact_model', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--max-features', type=int, default=1000, help='vocabulary cap of the capped variants')
+    parser.add_argument('--csv', nargs='*', help='training CSV files')
+    parser.add_argument('--corpus', help='corpus store to train on')
+    parser.add_argument('--corpus-rows', type=int, default=5000, help='rows in the synthetic training corpus')
+    parser.add_argument('--messages', type=int, default=2000, help='messages scored per timed batch')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.corpus:
+            data = {'corpus_path': args.corpus}
+        elif args.csv:
+            data = {'paths': args.csv}
+        else:
+            csv_path = os.path.join(workdir, 'train.csv')
+            synthetic_corpus(args.corpus_rows).to_csv(csv_path, index=False)
+            data = {'paths': [csv_path]}
+        texts = synthetic_texts(args.messages)
+
+        print(f"{'model':<28}{'features':>10}{'mean auc':>10}{'loaded MB':>11}{'disk MB':>9}{'msg/s':>11}")
+        for name, options in variants(args.max_features).items():
+            r = measure(name, options, workdir, data, texts, args.repeat)
+            results.append(r)
+            print(f"{r['model']:<28}{r['features']:>10}{r['mean_auc'] or 0:>10.4f}{r['loaded_mb']:>11.2f}{r['artifact_mb']:>9.2f}{r['messages_per_sec']:>11.1f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'max_features': args.max_features, 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
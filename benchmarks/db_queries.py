@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Query plans and timings of the DBUtils review queries before and after the migrations.
+
+Creates the tables of schema.sql in a scratch schema, seeds them with synthetic reviews, votes
+and reviewers, and runs the queue claim and every read query of DBUtils under EXPLAIN ANALYZE.
+The migrations are then applied to the scratch schema and the queries are timed again. The
+scratch schema is dropped at the end unless --keep is given, nothing outside of it is touched.
+
+    python -m benchmarks.db_queries [--dsn postgres://...] [--reviews 200000] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import asyncpg
+import toml
+
+from cogs.db.utils import DBUtils
+from common.migrations import apply_migrations
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / 'schema.sql'
+MIN_VOTES = 3
+
+
+class Captured(Exception):
+    pass
+
+
+class CaptureConnection:
+    """
+    Records the first statement a DBUtils method sends instead of running it.
+
+    Statements the method sends before the one to explain get the values of `replies` in order.
+    """
+
+    def __init__(self, replies=()):
+        self.statement = None
+        self.replies = list(replies)
+
+    def _capture(self, query, *args, **kwargs):
+        self.statement = (query, args)
+        raise Captured()
+
+    async def fetch(self, query, *args, **kwargs):
+        if self.replies:
+            return self.replies.pop(0)
+        self._capture(query, *args)
+
+    fetchrow = fetchval = execute = fetch
+
+    def transaction(self):
+        return self
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def queries(reviewers):
+    """
+    The queries of DBUtils with the arguments to explain them with, as (name, method, args, replies).
+
+    `replies` are the results of the statements the method sends before the explained one.
+    """
+    # Has no review in progress, reviewers 1, 11, 21, ... have one
+    user_id = reviewers // 2 + 1
+    return [
+        # Runs after the reviewer's row was locked, the review log row it inserts is rolled back
+        ('claim_review', 'claim_review', (user_id, 10 ** 12), [False]),
+        ('has_empty_queue', 'has_empty_queue', (user_id,)),
+        ('find_empty_queues', 'find_empty_queues', ()),
+        ('get_review_message', 'get_review_message', (50, user_id)),
+        ('get_active_queue_messages', 'get_active_queue_messages', (5,)),
+        ('get_total_reviews', 'get_total_reviews', ()),
+        ('get_reviews_count', 'get_reviews_count', (user_id,)),
+        ('get_remaining_reviews', 'get_remaining_reviews', (user_id,)),
+        ('get_deviance', 'get_deviance', (user_id,)),
+        ('get_deviance_messages', 'get_deviance_messages', (user_id, 'insult')),
+    ]
+
+
+async def capture(method, args, replies=()):
+    conn = CaptureConnection(replies)
+    db = DBUtils(SimpleNamespace(db=conn, config={'min_votes': MIN_VOTES}))
+    try:
+        await getattr(db, method)(*args)
+    except Captured:
+        return conn.statement
+    raise RuntimeError(f'{method} sent no query')
+
+
+async def seed(conn, reviews, reviewers):
+    """Fills the tables with `reviews` review messages, a tenth of them still in queue, and their votes."""
+    await conn.execute(SCHEMA_PATH.read_text(encoding='utf-8'))
+    await conn.execute(
+        """
+        INSERT INTO reviewers (user_id, channel_id, trusted)
+        SELECT i, 1000 + i, i % 5 = 0 FROM generate_series(1, $1) i
+        """,
+        reviewers
+    )
+    await conn.execute(
+        """
+        INSERT INTO scores (scanned_content, insult, severe_toxic, identity_hate, threat, nsfw)
+        SELECT 'synthetic message ' || i, random(), random(), random(), random(), random()
+        FROM generate_series(1, $1) i
+        """,
+        reviews
+    )
+    await conn.execute(
+        """
+        INSERT INTO review_messages (score_id, clean_content, active, in_sanitize)
+        SELECT id, scanned_content, id % 10 = 0, id % 100 = 1
+        FROM scores
+        """
+    )
+    # Every review has MIN_VOTES votes from consecutive reviewers, the first vote on a queued review is in progress
+    await conn.execute(
+        """
+        INSERT INTO review_log (review_id, user_id, message_id, insult, severe_toxic, identity_hate, threat, nsfw, active, trusted_review)
+        SELECT
+            r.id,
+            (r.id + k) % $1 + 1,
+            r.id * 10 + k,
+            (random() < 0.3)::INT, (random() < 0.1)::INT, (random() < 0.05)::INT, (random() < 0.05)::INT, (random() < 0.1)::INT,
+            r.active AND k = 0,
+            ((r.id + k) % $1 + 1) % 5 = 0
+        FROM review_messages r, generate_series(0, $2 - 1) k
+        """,
+        reviewers,
+        MIN_VOTES
+    )
+    await conn.execute('ANALYZE')
+
+
+async def explain(conn, statement, repeat):
+    query, args = statement
+    timings = []
+    for _ in range(repeat):
+        # EXPLAIN ANALYZE runs the statement, whatever it writes is rolled back so every run sees the same data
+        tr = conn.transaction()
+        await tr.start()
+        try:
+            plan = await conn.fetchval(f'EXPLAIN (ANALYZE, FORMAT JSON) {query}', *args)
+        finally:
+            await tr.rollback()
+        plan = json.loads(plan)[0] if isinstance(plan, str) else plan[0]
+        timings.append(plan['Execution Time'])
+    return statistics.median(timings), scan_types(plan['Plan'])
+
+
+def scan_types(node):
+    types = {node['Node Type']} if 'Scan' in node['Node Type'] else set()
+    for child in node.get('Plans', []):
+        types |= scan_types(child)
+    return types
+
+
+async def run_queries(conn, statements, repeat):
+    results = {}
+    for name, statement in statements:
+        try:
+            results[name] = await explain(conn, statement, repeat)
+        except (asyncpg.UndefinedColumnError, asyncpg.UndefinedTableError, asyncpg.UndefinedFunctionError):
+            # Queries relying on columns or tables added by a migration only run after it
+            results[name] = (None, set())
+    return results
+
+
+async def run(args):
+    if args.schema == 'public':
+        raise SystemExit('Refusing to seed the public schema, pick a scratch schema')
+    if args.dsn:
+        credentials = {'dsn': args.dsn}
+    else:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            credentials = toml.load(f)['database']
+    settings = {'search_path': args.schema}
+
+    admin = await asyncpg.connect(**credentials)
+    await admin.execute(f'DROP SCHEMA IF EXISTS "{args.schema}" CASCADE')
+    await admin.execute(f'CREATE SCHEMA "{args.schema}"')
+    pool = await asyncpg.create_pool(**credentials, min_size=1, max_size=2, server_settings=settings)
+    try:
+        async with pool.acquire() as conn:
+            start = time.perf_counter()
+            await seed(conn, args.reviews, args.reviewers)
+            print(f"Seeded {args.reviews} reviews with {args.reviews * MIN_VOTES} votes from {args.reviewers} reviewers in {time.perf_counter() - start:.1f} seconds")
+
+        statements = [
+            (name, await capture(method, params, *replies))
+            for name, method, params, *replies in queries(args.reviewers)
+        ]
+        async with pool.acquire() as conn:
+            before = await run_queries(conn, statements, args.repeat)
+
+        applied = await apply_migrations(pool)
+        async with pool.acquire() as conn:
+            await conn.execute('ANALYZE')
+            after = await run_queries(conn, statements, args.repeat)
+    finally:
+        await pool.close()
+        if not args.keep:
+            await admin.execute(f'DROP SCHEMA IF EXISTS "{args.schema}" CASCADE')
+        await admin.close()
+
+    results = []
+    print(f"Applied migrations {applied}")
+    print(f"{'query':<28}{'before ms':>11}{'after ms':>11}{'speedup':>9}  scans after")
+    for name, _ in statements:
+        (before_ms, before_scans), (after_ms, after_scans) = before[name], after[name]
+        if before_ms is None:
+            print(f"{name:<28}{'n/a':>11}{after_ms:>11.2f}{'':>9}  {', '.join(sorted(after_scans))}")
+        else:
+            speedup = before_ms / after_ms if after_ms else float('inf')
+            print(f"{name:<28}{before_ms:>11.2f}{after_ms:>11.2f}{speedup:>8.1f}x  {', '.join(sorted(after_scans))}")
+        results.append({
+            'query': name,
+            'before_ms': before_ms,
+            'after_ms': after_ms,
+            'before_scans': sorted(before_scans),
+            'after_scans': sorted(after_scans),
+        })
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'reviews': args.reviews, 'reviewers': args.reviewers, 'migrations': applied, 'results': results}, f, indent=2)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.db_queries', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', help='database to connect to, defaults to the database of the config file')
+    parser.add_argument('--config', default='config.toml', help='config file with the database credentials')
+    parser.add_argument('--schema', default='flagbot_benchmark', help='scratch schema to create the tables in')
+    parser.add_argument('--reviews', type=int, default=200000, help='review messages to seed')
+    parser.add_argument('--reviewers', type=int, default=50, help='reviewers to seed')
+    parser.add_argument('--repeat', type=int, default=5, help='times every query is explained, the median is reported')
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    parser.add_argument('--keep', action='store_true', help="don't drop the scratch schema at the end")
+    args = parser.parse_args(argv)
+    return asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
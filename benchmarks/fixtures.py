@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Synthetic Discord-like messages and training data for the benchmarks."""
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from model import LABELS
+from utils.records import ScanRecord
+
+BLACKLIST = ['bob', 'alice', 'some guy', 'mod team', 'server owner']
+SAMPLES = [
+    "what's up <@!248245568004947969> can't believe you're here",
+    "I'm not sure that's right, check https://example.com/some/path?x=1 <:pepe:567088336166977536>",
+    "hey <@&784984786690899968> look at <#784984545131888711> they'll love it",
+    "Bob said he'd do it but he's a clown",
+    "lol",
+    "this is a perfectly normal message about the mod team",
+    "<a:dance:788917079972511774> <a:dance:788917079972511774> spam spam spam",
+    "you're all idiots and I've had enough of this server owner",
+]
+
+NEUTRAL_WORDS = (
+    "game play server channel music stream today tomorrow friend team match update patch map build "
+    "movie song weekend work school lunch dinner coffee weather photo video link chat voice event"
+).split()
+LABEL_WORDS = {
+    'insult': "idiot clown moron loser stupid dumb".split(),
+    'severe_toxic': "garbage trash scum worthless pathetic disgusting".split(),
+    'identity_hate': "bigot slur hateful racist xenophobe prejudice".split(),
+    'threat': "hurt kill destroy attack punch beat".split(),
+    'nsfw': "lewd explicit nude porn naughty nsfw".split(),
+}
+DECORATIONS = [
+    "<@!{id}>", "<@{id}>", "<@&{id}>", "<#{id}>", "<:pepe:{id}>", "<a:dance:{id}>",
+    "https://example.com/{word}?ref={id}", "what's", "can't", "i'm", "you're", "they'll",
+]
+
+GUILD = SimpleNamespace(id=784984468251082752, name='Benchmark Server', icon_url_as=lambda **_: 'https://cdn.example.com/icon.png')
+CHANNELS = {289482554250100736 + i: SimpleNamespace(id=289482554250100736 + i, name=f'general-{i}', guild=GUILD) for i in range(4)}
+
+
+def _sentence(rng: random.Random, labels=(), length=(4, 16)):
+    words = [rng.choice(NEUTRAL_WORDS) for _ in range(rng.randint(*length))]
+    for label in labels:
+        words.insert(rng.randrange(len(words) + 1), rng.choice(LABEL_WORDS[label]))
+    return words
+
+
+def synthetic_corpus(rows=5000, seed=0):
+    """Returns a training DataFrame shaped like train.csv, label words make the labels learnable."""
+    rng = random.Random(seed)
+    records = []
+    for _ in range(rows):
+        labels = [label for label in LABELS if rng.random() < 0.08]
+        record = {'comment_text': ' '.join(_sentence(rng, labels))}
+        record.update({label: int(label in labels) for label in LABELS})
+        records.append(record)
+    return pd.DataFrame(records, columns=['comment_text'] + LABELS)
+
+
+def synthetic_texts(count, seed=0, toxic_rate=0.05, duplicate_rate=0.05):
+    """Message contents with mentions, emoji, URLs, contractions, blacklist hits and some repeats."""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        if texts and rng.random() < duplicate_rate:
+            texts.append(rng.choice(texts))
+            continue
+        if rng.random() < 0.02:
+            texts.append(rng.choice(SAMPLES))
+            continue
+        labels = [rng.choice(LABELS)] if rng.random() < toxic_rate else []
+        words = _sentence(rng, labels, (1, 30))
+        for _ in range(rng.randint(0, 3)):
+            decoration = rng.choice(DECORATIONS).format(id=rng.randrange(10 ** 17, 10 ** 18), word=rng.choice(NEUTRAL_WORDS))
+            words.insert(rng.randrange(len(words) + 1), decoration)
+        if rng.random() < 0.1:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(BLACKLIST))
+        texts.append(' '.join(words))
+    return texts
+
+
+def synthetic_messages(count, seed=0, **kwargs):
+    """Scan records as the Scanner buffers them, spread over the channels in `CHANNELS`."""
+    rng = np.random.RandomState(seed)
+    messages = []
+    for i, content in enumerate(synthetic_texts(count, seed, **kwargs)):
+        author_id = 248245568004947969 + rng.randint(50)
+        messages.append(ScanRecord(
+            800000000000000000 + i,
+            list(CHANNELS)[rng.randint(len(CHANNELS))],
+            GUILD.id,
+            author_id,
+            f'user{author_id % 1000}#0001',
+            'https://cdn.example.com/avatar.png',
+            content
+        ))
+    return messages
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput and latency benchmark of the scoring pipeline.
+
+Trains a model on a synthetic corpus, then times every stage of a scan separately
+(cleaning, vectorizing, scoring and flag selection) at several batch sizes. Results are
+printed as a table and can be written as JSON, and compared against the JSON of an earlier
+run to catch regressions.
+
+    python -m benchmarks [--batch-sizes 100,500,2000] [--output results.json] [--baseline old.json]
+"""
+import argparse
+import json
+import logging
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from types import SimpleNamespace
+
+from model import LABELS, TextNormalizer, ToxicityModel
+from utils.metrics import Histogram
+from .fixtures import BLACKLIST, CHANNELS, GUILD, synthetic_corpus, synthetic_messages
+
+STAGES = ['clean', 'vectorize', 'score', 'select']
+CONFIG = {
+    'flag_threshold': 0.5,
+    'non_flagged_addition_chance': 0.002,
+    'blacklist': BLACKLIST,
+    'reaction_emojis': [f'<:{label}:788917079972511774>' for label in LABELS],
+}
+
+
+class ScanHarness:
+    """Just enough of the NLP cog's state for its selection code to run outside of the bot."""
+
+    def __init__(self, config=CONFIG):
+        self.bot = SimpleNamespace(
+            config=config,
+            logger=logging.getLogger('benchmarks'),
+            get_guild={GUILD.id: GUILD}.get,
+            get_channel=CHANNELS.get
+        )
+        self.cols_target = list(LABELS)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / 1024
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_stages(model, normalizer):
+    # Imported here so the fixtures stay usable without discord.py installed
+    from cogs.nlp import NLP
+    harness = ScanHarness()
+
+    # Every stage reads the outputs of the stages before it from the batch state
+    def clean(state):
+        state['clean_texts'] = normalizer.clean_many([m.content for m in state['messages']])
+
+    def vectorize(state):
+        state['X'] = model.vectorizer.transform(state['clean_texts'])
+
+    def score(state):
+        state['scores'] = model.score_features(state['X'])
+
+    def select(state):
+        NLP.select_messages(harness, state['messages'], state['clean_texts'], state['scores'], [])
+
+    return {'clean': clean, 'vectorize': vectorize, 'score': score, 'select': select}
+
+
+def run_batch_size(stages, messages, batch_size, repeat):
+    timings = {stage: Histogram(repeat) for stage in STAGES}
+    for i in range(repeat):
+        offset = (i * batch_size) % max(1, len(messages) - batch_size)
+        state = {'messages': messages[offset:offset + batch_size]}
+        for stage in STAGES:
+            start = time.perf_counter()
+            stages[stage](state)
+            timings[stage].observe(time.perf_counter() - start)
+
+    # Allocations are traced in a separate pass, tracing slows every stage down
+    allocations = {}
+    state = {'messages': messages[:batch_size]}
+    for stage in STAGES:
+        tracemalloc.start()
+        stages[stage](state)
+        allocations[stage] = tracemalloc.get_traced_memory()[1] / (1 << 20)
+        tracemalloc.stop()
+
+    results = []
+    for stage in STAGES:
+        s = timings[stage].summary()
+        results.append({
+            'stage': stage,
+            'batch_size': batch_size,
+            'messages_per_sec': round(batch_size / s['mean'], 1) if s['mean'] else None,
+            'p50_ms': round(s['p50'] * 1000, 3),
+            'p95_ms': round(s['p95'] * 1000, 3),
+            'p99_ms': round(s['p99'] * 1000, 3),
+            'peak_alloc_mb': round(allocations[stage], 2),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        })
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns the stages whose throughput dropped by more than `tolerance` compared to `baseline`."""
+    previous = {(r['stage'], r['batch_size']): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        old = previous.get((r['stage'], r['batch_size']))
+        if old is None or not old['messages_per_sec'] or not r['messages_per_sec']:
+            continue
+        change = r['messages_per_sec'] / old['messages_per_sec'] - 1
+        print(f"{r['stage']:<10}{r['batch_size']:>7}  {old['messages_per_sec']:>12.1f} -> {r['messages_per_sec']:>12.1f} msg/s ({change:+.1%})")
+        if change < -tolerance:
+            regressions.append(r)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--batch-sizes', default='100,500,2000', help='comma separated batch sizes')
+    parser.add_argument('--repeat', type=int, default=20, help='batches timed per batch size')
+    parser.add_argument('--corpus-rows', type=int, default=5000, help='rows in the synthetic training corpus')
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed throughput drop against the baseline')
+    args = parser.parse_args(argv)
+    batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+
+    start = time.perf_counter()
+    corpus = synthetic_corpus(args.corpus_rows)
+    model = ToxicityModel.train(corpus.comment_text, corpus[LABELS].to_numpy(dtype=float), LABELS, 'benchmark')
+    print(f"Trained on {len(corpus)} synthetic rows ({model.n_features} features) in {time.perf_counter() - start:.2f} seconds")
+
+    normalizer = TextNormalizer(BLACKLIST)
+    stages = build_stages(model, normalizer)
+    messages = synthetic_messages(max(batch_sizes) * 4)
+
+    results = []
+    print(f"{'stage':<10}{'batch':>7}{'msg/s':>14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'alloc MB':>10}{'rss MB':>9}")
+    for batch_size in batch_sizes:
+        for r in run_batch_size(stages, messages, batch_size, args.repeat):
+            results.append(r)
+            print(
+                f"{r['stage']:<10}{r['batch_size']:>7}{r['messages_per_sec']:>14.1f}{r['p50_ms']:>10.2f}"
+                f"{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['peak_alloc_mb']:>10.2f}{r['peak_rss_mb']:>9.1f}"
+            )
+
+    report = {
+        'revision': git_revision(),
+        'date': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'corpus_rows': len(corpus),
+        'features': model.n_features,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"Compared to {baseline.get('revision')} ({baseline.get('date')}):")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} stages are more than {args.tolerance:.0%} slower than the baseline")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,6 +16,10 @@ import aiohttp
 import discord
 from discord.ext import commands
 
+from common.migrations import apply_migrations
+from common.queries import queries
+from utils.pool import InstrumentedPool
+
 
 class FlagBot(commands.Bot):
     def __init__(self, *args, config=None, **kwargs):
@@ -45,7 +49,12 @@ class FlagBot(commands.Bot):
             self.logger.critical("Cannot connect to db, no credentials!")
             await self.logout()
 
-        self.db = await asyncpg.create_pool(**credentials)
+        # Connection waits and checkout times are recorded per call site, query timings per statement, see the db_stats command
+        pool = await asyncpg.create_pool(**credentials, **queries.pool_options())
+        self.db = InstrumentedPool(pool, credentials.get('max_size', 10))
+        if await apply_migrations(self.db):
+            # Statements were prepared against the old schema
+            await pool.expire_connections()
         self.db_available.set()
 
     async def on_ready(self):
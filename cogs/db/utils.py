@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import json
 from datetime import datetime, timedelta
 
 import discord
 import toml
 from discord.ext import commands
 
+from common.queries import queries
+from utils.pool import Borrowed, UnitOfWork, acquire
+
 
 class Rollback(Exception):
     pass
@@ -16,504 +20,378 @@ class DBUtils(commands.Cog):
         super().__init__()
         self.bot = bot
 
+    # ===================== #
+    # ==== CONNECTIONS ==== #
+    # ===================== #
+
+    def connection(self, conn, site: str):
+        """The connection of the caller's unit of work, or one from the pool checked out on behalf of `site`."""
+        if conn is not None:
+            return Borrowed(conn)
+        return acquire(self.bot.db, site)
+
+    def unit_of_work(self, site: str):
+        """
+        Opens one connection and transaction to pass as `conn` to several methods.
+
+            async with db.unit_of_work('on_raw_reaction_add') as conn:
+                review = await db.get_review_message(message_id, user_id, conn=conn)
+                ...
+        """
+        return UnitOfWork(self.bot.db, site)
+
+    @commands.is_owner()
+    @commands.command("db_stats")
+    async def db_stats_command(self, ctx: commands.Context):
+        pool = self.bot.db.format() if hasattr(self.bot.db, 'format') else "The database pool isn't instrumented"
+        await ctx.send(
+            f"**Connection pool:**\n```\n{pool}\n```\n"
+            f"**Queries:**\n```\n{queries.format()}\n```"
+        )
+
     # ===================== #
     # ======= CACHE ======= #
     # ===================== #
-    async def load_scan_channels(self):
-        async with self.bot.db.acquire() as conn:
-            record = await conn.fetch("SELECT channel_id FROM scan_channels WHERE active")
+    async def load_scan_channels(self, conn=None):
+        async with self.connection(conn, 'load_scan_channels') as conn:
+            record = await queries.fetch(conn, 'load_scan_channels')
             return [x['channel_id'] for x in record]
 
-    async def load_reviewer_channels(self):
-        async with self.bot.db.acquire() as conn:
-            record = await conn.fetch("SELECT user_id,channel_id FROM reviewers WHERE active")
+    async def load_reviewer_channels(self, conn=None):
+        async with self.connection(conn, 'load_reviewer_channels') as conn:
+            record = await queries.fetch(conn, 'load_reviewer_channels')
             return [dict(x) for x in record]
 
     # ====================== #
     # ======= CHECKS ======= #
     # ====================== #
 
-    async def has_empty_queue(self, user_id: int):
-        async with self.bot.db.acquire() as conn:
-            record = await conn.fetchrow(
-                """
-                SELECT COUNT(*) FROM review_log WHERE user_id = $1 
-                """,
-                user_id
-            )
+    async def has_empty_queue(self, user_id: int, conn=None):
+        async with self.connection(conn, 'has_empty_queue') as conn:
+            record = await queries.fetchrow(conn, 'has_empty_queue', user_id)
             return record['count'] != 0
 
     # ======================== #
     # ======= REVIEWER ======= #
     # ======================== #
 
-    async def add_reviewer(self, user_id: int, channel_id: int):
-        async with self.bot.db.acquire() as conn:
+    async def add_reviewer(self, user_id: int, channel_id: int, conn=None):
+        async with self.connection(conn, 'add_reviewer') as conn:
             async with conn.transaction():
-                await conn.fetch(
-                    """
-                    INSERT INTO reviewers (user_id, channel_id)
-                    VALUES ($1, $2)
-                    """,
-                    user_id,
-                    channel_id
-                )
+                await queries.execute(conn, 'add_reviewer', user_id, channel_id)
 
-    async def remove_reviewer(self, user_id: int):
-        async with self.bot.db.acquire() as conn:
+    async def remove_reviewer(self, user_id: int, conn=None):
+        async with self.connection(conn, 'remove_reviewer') as conn:
             async with conn.transaction():
-                await conn.fetch(
-                    """
-                    UPDATE reviewers
-                    SET active = FALSE
-                    WHERE user_id = $1
-                    """,
-                    user_id
-                )
+                await queries.execute(conn, 'remove_reviewer', user_id)
 
     # ===================== #
     # ======= SCORE ======= #
     # ===================== #
-    async def get_score(self, score_id: int):
-        async with self.bot.db.acquire() as conn:
-            record = await conn.fetchrow(
-                """
-                    SELECT insult, severe_toxic, identity_hate, threat, nsfw
-                    FROM scores
-                    WHERE id = $1
-                    """,
-                score_id
-            )
+    async def get_score(self, score_id: int, conn=None):
+        async with self.connection(conn, 'get_score') as conn:
+            record = await queries.fetchrow(conn, 'get_score', score_id)
             return record
 
-    async def add_score(self, scanned_content: str, scores: dict):
-        async with self.bot.db.acquire() as conn:
+    async def add_score(self, scanned_content: str, scores: dict, conn=None):
+        async with self.connection(conn, 'add_score') as conn:
             async with conn.transaction():
-                record = await conn.fetchrow(
-                    """
-                    INSERT INTO scores (scanned_content, insult, severe_toxic, identity_hate, threat, nsfw)
-                    VALUES ($1, $2::REAL, $3::REAL, $4::REAL, $5::REAL, $6::REAL)
-                    RETURNING id
-                    """,
-                    scanned_content,
-                    scores['insult'],
-                    scores['severe_toxic'],
-                    scores['identity_hate'],
-                    scores['threat'],
-                    scores['nsfw']
-                )
-                return record['id']
+                return (await self.insert_scores(conn, [scanned_content], [scores]))[0]
+
+    @staticmethod
+    async def allocate_ids(conn, table: str, count: int):
+        """Reserves `count` ids from the serial of `table`, so rows inserted in bulk can be referenced in order."""
+        records = await queries.fetch(conn, 'allocate_ids', table, count)
+        return [r['id'] for r in records]
+
+    async def insert_scores(self, conn, contents, scores):
+        """Inserts one scores row per content with a single statement, returns their ids in order."""
+        if len(contents) == 0:
+            return []
+        ids = await self.allocate_ids(conn, 'scores', len(contents))
+        await queries.execute(
+            conn,
+            'insert_scores',
+            ids,
+            list(contents),
+            [s['insult'] for s in scores],
+            [s['severe_toxic'] for s in scores],
+            [s['identity_hate'] for s in scores],
+            [s['threat'] for s in scores],
+            [s['nsfw'] for s in scores]
+        )
+        return ids
 
     # ====================== #
     # === REVIEW MESSAGE === #
     # ====================== #
 
-    async def add_review_message(self, scanned_content: str, scores: dict):
-        score_id = await self.add_score(scanned_content, scores)
-        async with self.bot.db.acquire() as conn:
-            async with conn.transaction():
-                record = await conn.fetchrow(
-                    """
-                    INSERT INTO review_messages (score_id, clean_content)
-                    VALUES ($1, $2)
-                    RETURNING *
-                    """,
-                    score_id,
-                    scanned_content
-                )
-                return record['id']
-
-    async def get_review_message(self, message_id, user_id):
-        async with self.bot.db.acquire() as conn:
-            record = await conn.fetchrow(
-                """
-                    SELECT review_id, clean_content
-                    FROM review_log INNER JOIN review_messages ON id = review_id
-                    WHERE message_id = $1 AND user_id = $2 AND review_log.active
-                    """,
-                message_id, user_id
-            )
+    async def add_review_message(self, scanned_content: str, scores: dict, conn=None):
+        return (await self.add_review_messages([(scanned_content, scores)], conn=conn))[0]
+
+    async def add_review_messages(self, reviews, conn=None):
+        """Inserts (clean content, scores) pairs for review in one transaction, returns the review ids in order."""
+        return await self.add_scan_results([], reviews, conn=conn)
+
+    async def get_review_message(self, message_id, user_id, conn=None):
+        async with self.connection(conn, 'get_review_message') as conn:
+            record = await queries.fetchrow(conn, 'get_review_message', message_id, user_id)
             return record
 
-    async def edit_review_message(self, review_id, clean_content: str):
-        async with self.bot.db.acquire() as conn:
+    async def edit_review_message(self, review_id, clean_content: str, conn=None):
+        async with self.connection(conn, 'edit_review_message') as conn:
             async with conn.transaction():
-                await conn.fetch(
-                    """
-                    UPDATE review_messages
-                    SET clean_content = $2, in_sanitize = FALSE
-                    WHERE id = $1
-                    """,
-                    review_id,
-                    clean_content
-                )
-                await conn.fetch(
-                    """
-                    DELETE FROM review_log
-                    WHERE review_id = $1
-                    """,
-                    review_id
-                )
+                await queries.execute(conn, 'edit_review_message', review_id, clean_content)
+                await queries.execute(conn, 'remove_review_log', review_id)
     
-    async def delete_active_review_message(self, user_id):
-        async with self.bot.db.acquire() as conn:
-            await conn.fetch(
-                """
-                    DELETE FROM review_log
-                    WHERE user_id = $1 AND active
-                    """,
-                user_id
-            )
+    async def delete_active_review_message(self, user_id, conn=None):
+        async with self.connection(conn, 'delete_active_review_message') as conn:
+            await queries.execute(conn, 'delete_active_review_message', user_id)
             
 
     # ====================== #
     # ==== REVIEW QUEUE ==== #
     # ====================== #
 
-    async def find_empty_queues(self):
-        async with self.bot.db.acquire() as conn:
-            record = await conn.fetch(
-                """
-                SELECT user_id, channel_id
-                FROM reviewers r
-                WHERE NOT EXISTS(
-                    SELECT *
-                    FROM review_log
-                    WHERE user_id = r.user_id AND active
-                );
-                """
-            )
+    async def find_empty_queues(self, conn=None):
+        async with self.connection(conn, 'find_empty_queues') as conn:
+            record = await queries.fetch(conn, 'find_empty_queues')
             return record
 
-    async def pop_review_queue(self, user_id: int):
-        async with self.bot.db.acquire() as conn:
-            record = await conn.fetchrow(
-                """
-                SELECT *
-                FROM review_messages r
-                WHERE in_sanitize = FALSE 
-                AND active 
-                AND NOT EXISTS(
-                    SELECT *
-                    FROM review_log
-                    WHERE user_id = $1 AND review_id = r.id AND active = FALSE
-                )
-                AND NOT r.id IN (
-                    SELECT review_id
-                    FROM review_log
-                    GROUP BY review_id HAVING COUNT(*) >= $2
+    async def claim_review(self, user_id: int, message_id: int = None, conn=None):
+        """
+        Assigns the oldest review the reviewer hasn't seen and that has less than `min_votes` reviewers to them.
+
+        The review is locked with SKIP LOCKED and its review log row is inserted by the same statement, so
+        concurrent claims never hand out one review more often than it needs votes. Reviewers that already
+        have an active review don't get another one. Returns the review or None.
+        """
+        async with self.connection(conn, 'claim_review') as conn:
+            async with conn.transaction():
+                # Claims of the same reviewer are serialized on their row. It is the only reviewer row a claim locks,
+                # completing a vote locks its reviewers' rows in user_id order first, see update_review_stats
+                trusted = await queries.fetchval(conn, 'lock_reviewer', user_id)
+                if trusted is None:
+                    return None
+                record = await queries.fetchrow(
+                    conn,
+                    'claim_review',
+                    user_id,
+                    self.bot.config.get('min_votes'),
+                    message_id,
+                    trusted
                 )
-                ORDER BY r.id ASC 
-                """,
-                user_id,
-                self.bot.config.get('min_votes')
-            )
-            return record
+                return record
 
-    async def get_active_queue_messages(self, review_id: int):
-        async with self.bot.db.acquire() as conn:
-            record = await conn.fetch(
-                """
-                SELECT message_id,review_log.user_id,channel_id
-                FROM review_log INNER JOIN reviewers ON review_log.user_id = reviewers.user_id
-                WHERE review_id = $1 AND review_log.active = TRUE
-                """,
-                review_id
-            )
+    async def release_review(self, review_id: int, user_id: int, conn=None):
+        """Gives back a claimed review, e.g. when its message couldn't be sent."""
+        async with self.connection(conn, 'release_review') as conn:
+            await queries.execute(conn, 'release_review', review_id, user_id)
+
+    async def get_active_queue_messages(self, review_id: int, conn=None):
+        async with self.connection(conn, 'get_active_queue_messages') as conn:
+            record = await queries.fetch(conn, 'get_active_queue_messages', review_id)
             return record
 
     # ====================== #
     # ===== REVIEW LOG ===== #
     # ====================== #
 
-    async def add_review_log(self, review_id: int, user_id: int, message_id: int):
-        async with self.bot.db.acquire() as conn:
-            async with conn.transaction():
-                await conn.fetch(
-                    """
-                    INSERT INTO review_log (review_id, user_id, message_id, trusted_review)
-                    SELECT $1, $2, $3, trusted 
-                    FROM reviewers 
-                    WHERE user_id = $2
-                    """,
-                    review_id,
-                    user_id,
-                    message_id
-                )
+    async def set_review_log_message(self, review_id: int, user_id: int, message_id: int, conn=None):
+        async with self.connection(conn, 'set_review_log_message') as conn:
+            await queries.execute(conn, 'set_review_log_message', review_id, user_id, message_id)
 
-    async def remove_review_log(self, review_id: int):
-        async with self.bot.db.acquire() as conn:
+    async def remove_review_log(self, review_id: int, conn=None):
+        async with self.connection(conn, 'remove_review_log') as conn:
             async with conn.transaction():
-                await conn.fetch(
-                    """
-                    DELETE FROM review_log
-                    WHERE review_id = $1
-                    """,
-                    review_id
-                )
+                await queries.execute(conn, 'remove_review_log', review_id)
 
     # ============================= #
     # ===== REVIEW SUBMISSION ===== #
     # ============================= #
 
-    async def submit_review(self, review_id: int, user_id: int, scores: dict):
-        async with self.bot.db.acquire() as conn:
-            async with conn.transaction():
-                record = await conn.fetch(
-                    """
-                    UPDATE review_log
-                    SET insult = $3::SMALLINT, severe_toxic = $4::SMALLINT, identity_hate = $5::SMALLINT, threat = $6::SMALLINT, nsfw = $7::SMALLINT, active = FALSE
-                    WHERE review_id = $1 and user_id = $2
-                    RETURNING *
-                    """,
-                    review_id,
-                    user_id,
-                    scores['insult'],
-                    scores['severe_toxic'],
-                    scores['identity_hate'],
-                    scores['threat'],
-                    scores['nsfw'],
-                )
-
-    async def check_complete_review(self, review_id: int):
-        async with self.bot.db.acquire() as conn:
-            record = await conn.fetchval(
-                """
-                    SELECT COUNT(*)
-                    FROM review_log
-                    WHERE review_id = $1 AND active = FALSE
-                    """,
-                review_id
+    async def submit_vote(self, review_id: int, user_id: int, scores: dict, conn=None):
+        """
+        Records a reviewer's vote and completes the review once it has `min_votes` votes.
+
+        Everything happens in one call of the `submit_vote` database function, concurrent final votes
+        can't complete a review twice. Returns the review's content and consensus when this vote
+        completed it, None otherwise.
+        """
+        trusted_config = self.bot.config.get('trusted_reviewer')
+        async with self.connection(conn, 'submit_vote') as conn:
+            record = await queries.fetchrow(
+                conn,
+                'submit_vote',
+                review_id,
+                user_id,
+                scores['insult'],
+                scores['severe_toxic'],
+                scores['identity_hate'],
+                scores['threat'],
+                scores['nsfw'],
+                self.bot.config.get('min_votes'),
+                trusted_config['min_reviews'],
+                trusted_config['max_deviance']
             )
-            if record >= self.bot.config.get('min_votes'):
-                record = await conn.fetch(
-                    """
-                    WITH reviews_table AS (
-                        SELECT * 
-                        FROM review_log INNER JOIN review_messages ON id = review_id 
-                        WHERE review_id = $1 
-                    ), decision_table AS (
-                        SELECT 
-                            review_id,
-                            CASE WHEN AVG(insult) > 2/3::float THEN 1 ELSE 0 END insult,
-                            CASE WHEN AVG(severe_toxic) > 2/3::float THEN 1 ELSE 0 END severe_toxic,
-                            CASE WHEN AVG(identity_hate) > 2/3::float THEN 1 ELSE 0 END identity_hate,
-                            CASE WHEN AVG(threat) > 2/3::float THEN 1 ELSE 0 END threat,
-                            CASE WHEN AVG(nsfw) > 2/3::float THEN 1 ELSE 0 END nsfw
-                        FROM (
-                                SELECT * FROM reviews_table
-                                UNION 
-                                SELECT * 
-                                FROM reviews_table
-                                WHERE trusted_review
-                            ) votes
-                        GROUP BY review_id
-                    )
-                    SELECT clean_content, decision_table.*
-                    FROM decision_table 
-                    INNER JOIN review_messages ON review_id = id
-                    WHERE review_id = $1
-                    """,
-                    review_id
-                )
-                new_scores = {
-                    'insult': 0,
-                    'severe_toxic': 0,
-                    'identity_hate': 0,
-                    'threat': 0,
-                    'nsfw': 0
-                }
-                for r in record:
-                    for k, v in new_scores.items():
-                        new_scores[k] += r[k]
-                await self.complete_review(review_id)
-                return {'message': record[0]['clean_content'], 'score': new_scores}
-            return None
-
-    async def complete_review(self, review_id: int):
-        async with self.bot.db.acquire() as conn:
-            async with conn.transaction():
-                await conn.fetchval(
-                    """
-                    UPDATE review_log
-                    SET active = FALSE
-                    WHERE review_id = $1
-                    """,
-                    review_id
-                )
-                await conn.fetchval(
-                    """
-                    UPDATE review_messages
-                    SET active = FALSE
-                    WHERE id = $1
-                    """,
-                    review_id
-                )
+            if record is None:
+                return None
+            return {
+                'message': record['clean_content'],
+                'score': {k: record[k] for k in ('insult', 'severe_toxic', 'identity_hate', 'threat', 'nsfw')}
+            }
 
     # ====================== #
     # ====== SANITIZE ====== #
     # ====================== #
 
-    async def set_sanitize(self, review_id: int):
-        async with self.bot.db.acquire() as conn:
+    async def set_sanitize(self, review_id: int, conn=None):
+        async with self.connection(conn, 'set_sanitize') as conn:
             async with conn.transaction():
-                await conn.fetch(
-                    """
-                    UPDATE review_messages
-                    SET in_sanitize = TRUE
-                    WHERE id = $1
-                    """,
-                    review_id
-                )
-        record = await self.get_active_queue_messages(review_id)
-        await self.remove_review_log(review_id)
-        return record
+                # Holding the review's row lock keeps a final vote from completing it meanwhile
+                review = await queries.fetchval(conn, 'set_sanitize', review_id)
+                if review is None:
+                    return []
+                record = await queries.fetch(conn, 'get_active_queue_messages', review_id)
+                await queries.execute(conn, 'remove_review_log', review_id)
+                return record
 
     # ===================== #
     # ======= STATS ======= #
     # ===================== #
 
-    async def get_total_reviews(self):
-        async with self.bot.db.acquire() as conn:
-            record = await conn.fetchval("SELECT COUNT(*) FROM review_messages WHERE active = FALSE AND in_sanitize = FALSE")
+    async def get_total_reviews(self, conn=None):
+        async with self.connection(conn, 'get_total_reviews') as conn:
+            record = await queries.fetchval(conn, 'get_total_reviews')
             return record
 
-    async def get_reviews_count(self, user_id):
-        async with self.bot.db.acquire() as conn:
-            record = await conn.fetchval("SELECT COUNT(*) FROM review_log WHERE active = FALSE AND user_id = $1", user_id)
+    async def get_reviews_count(self, user_id, conn=None):
+        async with self.connection(conn, 'get_reviews_count') as conn:
+            record = await queries.fetchval(conn, 'get_reviews_count', user_id)
             return record
 
-    async def get_deviance(self, user_id):
-        async with self.bot.db.acquire() as conn:
-            record = await conn.fetchrow(
-                """
-                WITH reviews_table AS (
-                    SELECT * 
-                    FROM review_log INNER JOIN review_messages ON id = review_id 
-                    WHERE review_log.active = FALSE 
-                    AND review_messages.active = FALSE 
-                    AND in_sanitize = FALSE 
-                    AND EXISTS (
-                        SELECT 1
-                        FROM review_log
-                        WHERE review_messages.id = review_id 
-                        AND user_id = $1
-                        AND active = FALSE
-                    )
-                ), result_table AS (
-                    SELECT 
-                        review_id,
-                        CASE WHEN AVG(insult) > 2/3::float THEN 1 ELSE 0 END insult,
-                        CASE WHEN AVG(severe_toxic) > 2/3::float THEN 1 ELSE 0 END severe_toxic,
-                        CASE WHEN AVG(identity_hate) > 2/3::float THEN 1 ELSE 0 END identity_hate,
-                        CASE WHEN AVG(threat) > 2/3::float THEN 1 ELSE 0 END threat,
-                        CASE WHEN AVG(nsfw) > 2/3::float THEN 1 ELSE 0 END nsfw
-                    FROM reviews_table
-                    GROUP BY review_id
-                ), user_table AS (
-                    SELECT *
-                    FROM reviews_table
-                    WHERE user_id = $1
-                )
-                SELECT
-                    ROUND(AVG(CASE WHEN result_table.insult = user_table.insult THEN 0 ELSE 1 END), 3) AS insult,
-                    ROUND(AVG(CASE WHEN result_table.severe_toxic = user_table.severe_toxic THEN 0 ELSE 1 END), 3) AS severe_toxic,
-                    ROUND(AVG(CASE WHEN result_table.identity_hate = user_table.identity_hate THEN 0 ELSE 1 END), 3) AS identity_hate,
-                    ROUND(AVG(CASE WHEN result_table.threat = user_table.threat THEN 0 ELSE 1 END), 3) AS threat,
-                    ROUND(AVG(CASE WHEN result_table.nsfw = user_table.nsfw THEN 0 ELSE 1 END), 3) AS nsfw
-                FROM result_table INNER JOIN user_table USING(review_id)
-                """,
-                user_id)
-            return int(sum(record.values()) * 1000), dict(record)
-
-    async def get_remaining_reviews(self, user_id: int):
-        async with self.bot.db.acquire() as conn:
-            record = await conn.fetchval(
-                """
-                SELECT COUNT(*)
-                FROM review_messages r
-                WHERE in_sanitize = FALSE 
-                AND active 
-                AND NOT EXISTS(
-                    SELECT *
-                    FROM review_log
-                    WHERE user_id = $1 AND review_id = r.id AND active = FALSE
-                )
-                AND NOT r.id IN (
-                    SELECT review_id
-                    FROM review_log
-                    GROUP BY review_id HAVING COUNT(*) >= $2
-                )
-                """,
-                user_id,
-                self.bot.config.get('min_votes')
-            )
+    async def get_deviance(self, user_id, conn=None):
+        async with self.connection(conn, 'get_deviance') as conn:
+            record = await queries.fetchrow(conn, 'get_deviance', user_id)
+            if record is None:
+                return 0, {}
+            record = dict(record)
+            return record.pop('total'), record
+
+    async def get_remaining_reviews(self, user_id: int, conn=None):
+        async with self.connection(conn, 'get_remaining_reviews') as conn:
+            record = await queries.fetchval(conn, 'get_remaining_reviews', user_id, self.bot.config.get('min_votes'))
             return record
     
-    async def get_deviance_messages(self, user_id, field):
-        async with self.bot.db.acquire() as conn:
-            record = await conn.fetch(
-                f"""
-                WITH reviews_table AS (
-                    SELECT * 
-                    FROM review_log INNER JOIN review_messages ON id = review_id 
-                    WHERE review_log.active = FALSE 
-                    AND review_messages.active = FALSE 
-                    AND in_sanitize = FALSE 
-                    AND EXISTS (
-                        SELECT 1
-                        FROM review_log
-                        WHERE review_messages.id = review_id 
-                        AND active = FALSE
-                    )
-                ), result_table AS (
-                    SELECT 
-                        review_id,
-                        CASE WHEN AVG({field}) > 2/3::float THEN 1 ELSE 0 END {field}
-                    FROM reviews_table
-                    GROUP BY review_id
-                )
-                SELECT clean_content, reviews_table.{field} AS submitted
-                FROM result_table INNER JOIN reviews_table USING (review_id)
-                WHERE result_table.{field} != reviews_table.{field} 
-                AND user_id = $1
-                ORDER BY review_id
-                """, 
-                user_id
-            )
+    async def get_deviance_messages(self, user_id, field, conn=None):
+        async with self.connection(conn, 'get_deviance_messages') as conn:
+            record = await queries.fetch(conn, 'get_deviance_messages', user_id, field)
             return record
 
-    
+
+    # ====================== #
+    # ======= MODELS ======= #
+    # ====================== #
+
+    async def add_model(self, data_hash: str, path: str, row_count: int, train_time: float, metrics: dict, conn=None):
+        async with self.connection(conn, 'add_model') as conn:
+            async with conn.transaction():
+                record = await queries.fetchval(conn, 'add_model', data_hash, path, row_count, train_time, json.dumps(metrics))
+                return record
+
+    async def activate_model(self, version: int, conn=None):
+        async with self.connection(conn, 'activate_model') as conn:
+            async with conn.transaction():
+                await queries.execute(conn, 'activate_model', version)
+
+    async def get_model(self, version: int, conn=None):
+        async with self.connection(conn, 'get_model') as conn:
+            record = await queries.fetchrow(conn, 'get_model', version)
+            return record
+
+    async def get_active_model(self, conn=None):
+        async with self.connection(conn, 'get_active_model') as conn:
+            record = await queries.fetchrow(conn, 'get_active_model')
+            return record
+
+    async def get_previous_model(self, conn=None):
+        async with self.connection(conn, 'get_previous_model') as conn:
+            record = await queries.fetchrow(conn, 'get_previous_model')
+            return record
+
+    async def get_models(self, limit: int = 10, conn=None):
+        async with self.connection(conn, 'get_models') as conn:
+            record = await queries.fetch(conn, 'get_models', limit)
+            return record
+
+    # ====================== #
+    # ====== BACKFILL ====== #
+    # ====================== #
+
+    async def get_backfill_checkpoint(self, channel_id: int, conn=None):
+        async with self.connection(conn, 'get_backfill_checkpoint') as conn:
+            record = await queries.fetchrow(conn, 'get_backfill_checkpoint', channel_id)
+            return record
+
+    async def set_backfill_checkpoint(self, channel_id: int, last_message_id: int, scanned: int, done: bool = False, conn=None):
+        async with self.connection(conn, 'set_backfill_checkpoint') as conn:
+            async with conn.transaction():
+                await queries.execute(conn, 'set_backfill_checkpoint', channel_id, last_message_id, scanned, done)
+
     # ======================= #
     # ===== INFRACTIONS ===== #
     # ======================= #
 
-    async def add_infractions(self, infractions):
-        infs = []
-        for inf in infractions:
-            infs.append((
-                None, 
-                inf['message'].author.id, 
-                inf['message'].guild.id, 
-                inf['message'].channel.id, 
-                inf['message'].id, 
-                await self.add_score(inf['message'].content, inf['score']), 
-                None
-            ))
-
-        async with self.bot.db.acquire() as conn:
+    async def add_infractions(self, infractions, conn=None):
+        await self.add_scan_results(infractions, [], conn=conn)
+
+    async def add_scan_results(self, infractions, reviews, conn=None):
+        """
+        Persists the results of a scan in one transaction.
+
+        Parameters
+        ----------
+        infractions : list of dict
+            Flags with the scanned `message` record and its `score`.
+        reviews : list of tuple
+            (clean content, scores) pairs to add to the review queue.
+
+        Returns the ids of the new review messages in order.
+        """
+        async with self.connection(conn, 'add_scan_results') as conn:
             async with conn.transaction():
-                record = await conn.fetch(
-                    """
-                    INSERT INTO infractions (user_id, server_id, channel_id, message_id, score_id)
-                    (SELECT 
-                        i.user_id, i.server_id, i.channel_id, i.message_id, i.score_id
-                    FROM
-                        unnest($1::infractions[]) as i
-                    )
-                    """,
-                    infs
+                # Scores of the infractions and the reviews go in with a single insert
+                score_ids = await self.insert_scores(
+                    conn,
+                    [inf['message'].content for inf in infractions] + [content for content, _ in reviews],
+                    [inf['score'] for inf in infractions] + [scores for _, scores in reviews]
+                )
+
+                if infractions:
+                    infs = []
+                    for inf, score_id in zip(infractions, score_ids):
+                        infs.append((
+                            None, 
+                            inf['message'].author_id, 
+                            inf['message'].guild_id, 
+                            inf['message'].channel_id, 
+                            inf['message'].id, 
+                            score_id, 
+                            None
+                        ))
+                    await queries.execute(conn, 'insert_infractions', infs)
+
+                if not reviews:
+                    return []
+                review_ids = await self.allocate_ids(conn, 'review_messages', len(reviews))
+                await queries.execute(
+                    conn,
+                    'insert_review_messages',
+                    review_ids,
+                    score_ids[len(infractions):],
+                    [content for content, _ in reviews]
                 )
+                return review_ids
 
 def setup(bot):
     bot.add_cog(DBUtils(bot))
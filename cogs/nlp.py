@@ -1,13 +1,17 @@
+import asyncio
+import json
+import multiprocessing
 import os
-import random
-import re
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from functools import partial
 
 import discord
-import pandas as pd
+import numpy as np
 from discord.ext import commands
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import LogisticRegression
+
+from inference import InferenceClient
+from model import CorpusStore, OnlineModel, ScoreCache, TextNormalizer, ToxicityModel, iter_training_data, train_version
 
 
 class NLP(commands.Cog):
@@ -15,80 +19,288 @@ class NLP(commands.Cog):
         super().__init__()
         self.bot = bot
         self.cols_target = ['insult','severe_toxic','identity_hate','threat','nsfw']
-    
-    def compute_messages(self, test_messages):
-        self.bot.logger.info([x.content for x in test_messages])
-        self.bot.logger.info(f"Starting evaluation on {len(test_messages)} messages...")
+        self.model = None
+        self.model_version = None
+        self.normalizer = TextNormalizer(self.bot.config.get('blacklist', []))
+        cache_config = self.bot.config.get('score_cache', {})
+        self.cache = ScoreCache(
+            cache_config.get('size', 50000),
+            self.bot.redis if cache_config.get('redis') else None,
+            cache_config.get('ttl', 86400)
+        )
+        # Scoring happens in the `python -m inference` process when it is enabled
+        self.inference = None
+        if self.bot.config.get('inference', {}).get('remote'):
+            self.inference = InferenceClient(self.bot.redis, self.bot.config['inference'].get('timeout', 30))
+        # Training data lives in the memory mapped corpus store once it was converted from the CSVs
+        corpus_path = self.bot.config.get('corpus_path', './input/corpus')
+        self.corpus = None
+        if CorpusStore.exists(corpus_path):
+            self.corpus = CorpusStore(
+                corpus_path,
+                self.cols_target,
+                flush_rows=self.bot.config.get('corpus_flush_rows', 500),
+                flush_interval=self.bot.config.get('corpus_flush_interval', 600)
+            )
+        self.pending_rows = []
+        self.rows_since_train = 0
+        self.label_times = {}
+        self.learn_lock = asyncio.Lock()
+        self.train_lock = asyncio.Lock()
+        # Retraining runs in its own process so it never competes with scanning for the GIL,
+        # spawned rather than forked since the bot process runs threads
+        self.train_pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+        self.loader = asyncio.create_task(self.load_model())
+
+    def cog_unload(self):
+        self.loader.cancel()
+        self.train_pool.shutdown(wait=False)
+
+    async def load_model(self):
+        """Loads or trains the first model, retrying every `model_load_retry` seconds until it succeeds."""
+        while True:
+            try:
+                await self._load_model()
+                return
+            except Exception:
+                # The scanner stops taking messages off the scan stream while no model is loaded
+                self.bot.logger.exception("Failed to load a model, retrying later")
+            await asyncio.sleep(self.bot.config.get('model_load_retry', 600))
+
+    async def _load_model(self):
+        # Online learning keeps its model in the bot even with a remote inference server, updates reach the server through the saved file
+        if self.bot.config.get('learning_mode') == 'online':
+            self.model = await asyncio.get_event_loop().run_in_executor(None, self.prepare_online_model)
+            self.bot.logger.info(f"Loaded model {self.model.version} (trained {self.model.trained_at})")
+            return
+
+        await self.bot.db_available.wait()
+        conn = self.bot.get_db()
+        record = await conn.get_active_model()
+        if record is None or not os.path.exists(record['path']):
+            self.bot.logger.info("No active model found, training a new version...")
+            await self.retrain()
+            return
+        await self.swap_model(record)
+        # The counter would start over on every restart otherwise, and a bot restarting often would never retrain
+        self.rows_since_train = await self.count_new_rows(record)
+        self.bot.logger.info(f"{self.rows_since_train} reviews were added since model version {record['version']} was trained")
+        if self.rows_since_train >= self.bot.config.get('retrain_after_rows', 500):
+            asyncio.create_task(self.retrain_in_background())
+
+    async def count_new_rows(self, record):
+        """Rows of the training data the model of `record` wasn't trained on."""
+        loop = asyncio.get_event_loop()
+        if self.corpus is not None:
+            total = len(self.corpus) + await loop.run_in_executor(None, self.corpus.journal_len)
+        else:
+            total = await loop.run_in_executor(None, lambda: sum(len(chunk) for chunk in iter_training_data()))
+        # The registry holds the rows the model was fitted on, the holdout was kept aside from the total
+        trained = round(record['row_count'] / (1 - self.bot.config.get('holdout_fraction', 0.1)))
+        return max(0, total - trained)
+
+    async def swap_model(self, record):
+        if self.inference is not None:
+            # The inference server picks up the newly activated version by itself
+            self.model_version = record['version']
+            return
+        model = await asyncio.get_event_loop().run_in_executor(None, ToxicityModel.load, record['path'])
+        # Scans in flight keep the model they started with, the next batch picks up the new one
+        self.model = model
+        self.model_version = record['version']
+        self.bot.logger.info(f"Loaded model version {record['version']} ({model.version}, trained {model.trained_at})")
+
+    async def retrain(self):
+        """Trains a new model version in the background, registers it and swaps it in."""
+        if self.train_lock.locked():
+            return None
+        async with self.train_lock:
+            self.rows_since_train = 0
+            model_dir = self.bot.config.get('model_dir', './input/models')
+            path = os.path.join(model_dir, f"model-{datetime.now().strftime('%Y%m%d%H%M%S')}.npz")
+
+            self.bot.logger.info("Training new model version...")
+            if self.corpus is not None:
+                # Reviews still in the corpus journal are trained on too
+                await asyncio.get_event_loop().run_in_executor(None, self.corpus.flush)
+            result = await asyncio.get_event_loop().run_in_executor(
+                self.train_pool,
+                partial(
+                    train_version,
+                    path,
+                    self.cols_target,
+                    self.bot.config.get('holdout_fraction', 0.1),
+                    self.bot.config.get('training_workers', 1),
+                    corpus_path=self.corpus.path if self.corpus is not None else None,
+                    compact=self.bot.config.get('compact_model', False),
+                    max_features=self.bot.config.get('max_features'),
+                    feature_selection=self.bot.config.get('feature_selection', 'frequency')
+                )
+            )
+            self.label_times = result.pop('label_times')
+
+            conn = self.bot.get_db()
+            version = await conn.add_model(**result)
+            await conn.activate_model(version)
+            self.bot.logger.info(f"Trained model version {version} on {result['row_count']} rows in {result['train_time']} seconds: {result['metrics']}")
+            self.bot.logger.info(f"Per label training time: {self.label_times}")
+            await self.swap_model(await conn.get_model(version))
+            return version
+
+    async def retrain_in_background(self):
+        try:
+            await self.retrain()
+        except Exception:
+            # The next attempt comes once another `retrain_after_rows` reviews were completed
+            self.bot.logger.exception("Failed to train a new model version")
+
+    async def rollback(self, version: int = None):
+        """Activates `version`, or the version trained before the active one."""
+        conn = self.bot.get_db()
+        record = await conn.get_model(version) if version is not None else await conn.get_previous_model()
+        if record is None or not os.path.exists(record['path']):
+            return None
+        await conn.activate_model(record['version'])
+        await self.swap_model(record)
+        return record['version']
+
+    @commands.is_owner()
+    @commands.command("retrain")
+    async def retrain_command(self, ctx: commands.Context):
+        if self.train_lock.locked():
+            await ctx.send("A model is already being trained.")
+            return
+        await ctx.send("Training a new model version in the background...")
+        version = await self.retrain()
+        times = ', '.join(f"{label} {seconds:.1f}s" for label, seconds in self.label_times.items())
+        await ctx.send(f"Now using model version {version}. Training time per label: {times}")
+
+    @commands.is_owner()
+    @commands.command("rollback_model")
+    async def rollback_command(self, ctx: commands.Context, version: int = None):
+        version = await self.rollback(version)
+        if version is None:
+            await ctx.send("No model version to roll back to.")
+            return
+        await ctx.send(f"Rolled back to model version {version}.")
+
+    @commands.is_owner()
+    @commands.command("models")
+    async def models_command(self, ctx: commands.Context):
+        conn = self.bot.get_db()
+        lines = []
+        for m in await conn.get_models():
+            metrics = json.loads(m['metrics']) if m['metrics'] else {}
+            auc = ' '.join(f"{k}={v['auc']}" for k, v in metrics.items())
+            active = ' **(active)**' if m['active'] else ''
+            lines.append(f"`v{m['version']}`{active} {m['date_created']:%Y-%m-%d %H:%M} rows={m['row_count']} time={m['train_time']:.1f}s auc: {auc}")
+        await ctx.send('\n'.join(lines) or "No models trained yet.")
+
+    def prepare_online_model(self):
+        path = self.bot.config.get('online_model_path', './input/online_model.joblib')
+        if os.path.exists(path):
+            return OnlineModel.load(path)
+
+        # Bootstrap the online model with a single streamed pass over the existing corpus
+        start = datetime.now()
+        model = OnlineModel(self.cols_target)
+        if self.corpus is not None:
+            chunks = self.corpus.iter_chunks()
+        else:
+            # Labels missing from the CSV, e.g. nsfw in the original train.csv, are NaN and skipped by partial_fit
+            chunks = ((c.comment_text.fillna(''), c.reindex(columns=self.cols_target)) for c in iter_training_data())
+        for texts, labels in chunks:
+            model.partial_fit(texts, labels)
+        model.save(path)
+        self.bot.logger.info(f"Bootstrapping online model on {model.rows_seen} rows took {(datetime.now()-start).total_seconds()} seconds!")
+        return model
+
+    async def learn(self, row: dict={'message': str, 'score': dict}):
+        """Queues a completed review and folds the queue into the online model once it is large enough."""
+        if not isinstance(self.model, OnlineModel):
+            # Batch mode retrains in the background once enough new reviews were collected
+            self.rows_since_train += 1
+            if self.rows_since_train >= self.bot.config.get('retrain_after_rows', 500):
+                asyncio.create_task(self.retrain_in_background())
+            return
+
+        self.pending_rows.append(row)
+        if len(self.pending_rows) < self.bot.config.get('online_batch_size', 10):
+            return
+
+        async with self.learn_lock:
+            rows, self.pending_rows = self.pending_rows, []
+            if len(rows) == 0:
+                return
+            await asyncio.get_event_loop().run_in_executor(None, self.fold_rows, rows)
+
+    def fold_rows(self, rows):
+        start = datetime.now()
+        texts = [r['message'] for r in rows]
+        labels = {label: [r['score'][label] for r in rows] for label in self.cols_target}
+        model = self.model.updated(texts, labels)
+        model.save(self.bot.config.get('online_model_path', './input/online_model.joblib'))
+        # Swap only once the updated model is complete, scans in flight keep using the old one
+        self.model = model
+        self.bot.logger.info(f"Folded {len(rows)} reviews into model {model.version} in {(datetime.now()-start).total_seconds()} seconds!")
+
+    @property
+    def ready(self):
+        return self.inference is not None or self.model is not None
+
+    async def scan_messages(self, test_messages):
+        """Scores a batch of messages, either locally on the executor or on the inference server."""
+        loop = asyncio.get_event_loop()
         logs = []
         begin = datetime.now()
+        clean_texts = await loop.run_in_executor(None, self.prepare_messages, test_messages, logs)
+
         start = datetime.now()
-        train_df = pd.read_csv('./input/train.csv')
-        if os.path.exists("./input/new_train.csv"):
-            train_df = pd.concat([pd.read_csv('./input/new_train.csv'),train_df], axis=0, ignore_index=True)
-        
-        missing_labels = train_df.columns[train_df.isna().any()].tolist()
-        X = train_df.comment_text
-        logs.append(f"1. Loading data took {(datetime.now()-start).total_seconds()} seconds!")
-        self.bot.logger.info(logs[-1])
-        
-        start = datetime.now()
-        data = {'comment_text': [self.clean_text(x.content) for x in test_messages ]}
-        test_df = pd.DataFrame(data=data)
-        
-        
-        logs.append(f"2. Cleaning data took {(datetime.now()-start).total_seconds()} seconds!")
+        if self.inference is None:
+            # Only texts the cache hasn't seen for this model version reach the model
+            model = self.model
+            version = model.version
+            scores = await self.cache.score(version, clean_texts, partial(loop.run_in_executor, None, model.predict_proba))
+        else:
+            scores, version = await self.inference.score(clean_texts)
+        logs.append(f"2. Scoring with model {version} took {(datetime.now()-start).total_seconds()} seconds!")
         self.bot.logger.info(logs[-1])
+
+        result = await loop.run_in_executor(None, self.select_messages, test_messages, clean_texts, scores, logs)
+        self.bot.logger.info(f"Took {(datetime.now()-begin).total_seconds()} seconds!")
+        return result
+
+    def prepare_messages(self, test_messages, logs):
+        self.bot.logger.info([x.content for x in test_messages])
+        self.bot.logger.info(f"Starting evaluation on {len(test_messages)} messages...")
+
         start = datetime.now()
-        vect = TfidfVectorizer(ngram_range=(1,2), stop_words='english', min_df=2, smooth_idf=1, sublinear_tf=1)
-        message_contents = test_df.comment_text
-        train_X = vect.fit_transform(X)
-        test_X = vect.transform(message_contents)
-        logs.append(f"3. Converting to TF-IDF took {(datetime.now()-start).total_seconds()} seconds!")
+        # Every message is normalized exactly once, the result is carried along for dedupe and the review queue
+        self.update_blacklist()
+        clean_texts = self.clean_many([x.content for x in test_messages])
+        logs.append(f"1. Cleaning data took {(datetime.now()-start).total_seconds()} seconds!")
         self.bot.logger.info(logs[-1])
+        return clean_texts
+
+    def select_messages(self, test_messages, clean_texts, scores, logs):
         start = datetime.now()
-        logreg = LogisticRegression(C=12.0, solver='liblinear')
-        results = dict()
-        for i in range(len(test_df)):
-            results[i] = {}
-        for label in self.cols_target:
-            label_start = datetime.now()
-            self.bot.logger.info('... Processing {}'.format(label))
-            label_train_X = train_X
-            label_train_df = train_df
-
-            if label in missing_labels:
-                label_train_df = train_df.dropna(subset=[label])
-                label_train_X = vect.transform(label_train_df.comment_text)
-
-            y = label_train_df[label]
-            # train the model using X_dtm & y
-            logreg.fit(label_train_X, y)
-            # compute the predicted probabilities for X_test_dtm
-            test_y_prob = logreg.predict_proba(test_X)[:,1]
-            for i,x in enumerate(test_y_prob):
-                results[i][label] = x
-            logs.append(f"-`Processing {label} took {(datetime.now()-label_start).total_seconds()} seconds!`")
-            self.bot.logger.info(logs[-1])
-        
-        logs.insert(-len(self.cols_target),f"4. Building and testing model took {(datetime.now()-start).total_seconds()} seconds!")
-        self.bot.logger.info(logs[-len(self.cols_target)])
-        
-        start = datetime.now()
-        flagged_messages = []
-        random_non_flagged_messages = []
-        for k,v in results.items():
-            if self.clean_text(test_messages[k].content) == "":
-                continue
-            if any([value > self.bot.config.get('flag_threshold') for key,value in v.items()]):
-                flagged_messages.append({'message':test_messages[k],'score':v})
-            elif (random.random() <= self.bot.config.get('non_flagged_addition_chance')):
-                random_non_flagged_messages.append({'message':test_messages[k],'score':v})
+        # Threshold the whole (n_messages x n_labels) score matrix at once
+        scanned = np.array([text != "" for text in clean_texts], dtype=bool)
+        flagged = scanned & (scores > self.bot.config.get('flag_threshold')).any(axis=1)
+        sampled = scanned & ~flagged & (np.random.random(len(clean_texts)) <= self.bot.config.get('non_flagged_addition_chance'))
+
+        flagged_messages = [
+            {'message': test_messages[k], 'clean_content': clean_texts[k], 'score': dict(zip(self.cols_target, scores[k].tolist()))}
+            for k in np.flatnonzero(flagged)
+        ]
+        random_non_flagged_messages = [
+            {'message': test_messages[k], 'clean_content': clean_texts[k], 'score': dict(zip(self.cols_target, scores[k].tolist()))}
+            for k in np.flatnonzero(sampled)
+        ]
 
         self.bot.logger.info(f"Flagged {len(flagged_messages)} messages.")
-        logs.append(f"5. Transforming data took {(datetime.now()-start).total_seconds()} seconds!")
+        logs.append(f"3. Transforming data took {(datetime.now()-start).total_seconds()} seconds!")
         self.bot.logger.info(logs[-1])
-        self.bot.logger.info(f"Took {(datetime.now()-begin).total_seconds()} seconds!")
-        embeds = []
         
         if len(flagged_messages) == 0: return [], random_non_flagged_messages,logs
         for flagged_message in flagged_messages:
@@ -107,50 +319,34 @@ class NLP(commands.Cog):
                 color=0xff0000
             )
 
-            embed.set_author(name=f'{str(message.guild)} / #{str(message.channel)}', icon_url=message.guild.icon_url_as(format='png'))
-            embed.set_footer(text=f'{str(message.author)} ({message.author.id})', icon_url=message.author.avatar_url_as(format='png'))
+            guild = self.bot.get_guild(message.guild_id)
+            embed.set_author(
+                name=f'{str(guild)} / #{str(self.bot.get_channel(message.channel_id))}',
+                icon_url=guild.icon_url_as(format='png') if guild is not None else discord.Embed.Empty
+            )
+            embed.set_footer(text=f'{message.author_name} ({message.author_id})', icon_url=message.avatar_url)
 
             embed.add_field(name='Scores', value=' '.join(score_values))
             embed.add_field(name='\uFEFF', value=f'[Jump to message]({message.jump_url})') #  \uFEFF = ZERO WIDTH NO-BREAK SPACE
             flagged_message['embed'] = embed
 
         review_messages = (flagged_messages + random_non_flagged_messages)
-        unique_messages = []
+        unique_messages = set()
         unique_review_messages = []
-        for i,r in enumerate(review_messages):
-            if self.clean_text(r['message'].content) not in unique_messages:
-                unique_messages.append(self.clean_text(r['message'].content))
+        for r in review_messages:
+            if r['clean_content'] not in unique_messages:
+                unique_messages.add(r['clean_content'])
                 unique_review_messages.append(r)
         return flagged_messages, unique_review_messages, logs
         
+    def update_blacklist(self):
+        self.normalizer.set_blacklist(self.bot.config.get('blacklist', []))
+
     def clean_text(self, text: str):
-        
-        for phrase in self.bot.config['blacklist']:
-            text = re.sub(phrase, "__name__", text, flags=re.IGNORECASE)
-            
-        text = text.lower()
-       
-        text = re.sub(r"https?://(?:[a-zA-Z]|[0-9]|[#-_]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+", "__url__", text) # URLs
-        text = re.sub(r"<a?:(\w{2,32}):\d{15,21}>", "", text) # Clear discord emoji
-        text = re.sub(r"<@!?\d{15,21}>", "__user__", text) # User mentions
-        text = re.sub(r"<@&\d{15,21}>", "__role__", text) # Role mentions
-        text = re.sub(r"<#\d{15,21}>", "__channel__", text) # Channel mentions
-        
-        text = re.sub(r"what's", "what is", text)
-        text = re.sub(r"\'s", "", text)
-        text = re.sub(r"\'ve", " have", text)
-        text = re.sub(r"can't", "cannot", text)
-        text = re.sub(r"i'm", "i am", text)
-        text = re.sub(r"\'re", " are", text)
-        text = re.sub(r"\'d", " would", text)
-        text = re.sub(r"\'ll", " will", text)
-        text = re.sub(r"\'", "", text)
-        text = re.sub('\W', ' ', text)
-        text = re.sub('\s+', ' ', text)
-        
-        text = text.strip(' ')
-        text = text if len(text.split()) > 1 else "" # If text only includes one word, return empty str
-        
-        return text
+        return self.normalizer.clean(text)
+
+    def clean_many(self, texts):
+        return self.normalizer.clean_many(texts)
+
 def setup(bot):
     bot.add_cog(NLP(bot))
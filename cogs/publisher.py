@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+from collections import OrderedDict
+
+import discord
+from discord.ext import commands
+
+# Discord accepts at most this many embeds per message, with this many characters in total
+MAX_EMBEDS = 10
+MAX_EMBED_CHARS = 6000
+
+
+class FlagPublisher(commands.Cog):
+    """
+    Posts flagged messages to the flag channel through a webhook.
+
+    Flags are queued by `publish` and sent by a background task, up to ten embeds per
+    message. Flags with the same cleaned content that arrive before the first of them was
+    sent are collapsed into one embed with an occurrence count. Rate limits are handled by
+    discord.py's webhook adapter, which waits on the rate limit headers and retries 429s.
+    """
+
+    def __init__(self, bot):
+        super().__init__()
+        self.bot = bot
+        # Cleaned content -> {'embed', 'count', 'first_seen'}, in the order flags were first seen
+        self.pending = OrderedDict()
+        self.new_flag = asyncio.Event()
+        self.webhook = None
+
+        self.sent_messages = 0
+        self.sent_embeds = 0
+        self.collapsed = 0
+
+        self.drainer = asyncio.create_task(self.run_drainer())
+
+    def cog_unload(self):
+        self.drainer.cancel()
+
+    def publish(self, flags):
+        now = time.monotonic()
+        for flag in flags:
+            key = flag.get('clean_content') or flag['message'].content
+            entry = self.pending.get(key)
+            if entry is not None:
+                entry['count'] += 1
+                self.collapsed += 1
+                continue
+            self.pending[key] = {'embed': flag['embed'], 'count': 1, 'first_seen': now}
+        self.new_flag.set()
+
+    async def get_webhook(self):
+        if self.webhook is None:
+            channel_id = self.bot.config.get('flag_channel')
+            channel = self.bot.get_channel(channel_id) or await self.bot.fetch_channel(channel_id)
+            webhooks = await channel.webhooks()
+            self.webhook = webhooks[0] if webhooks else await channel.create_webhook(name='FlagBot')
+        return self.webhook
+
+    def take_embeds(self):
+        taken = []
+        embeds = []
+        size = 0
+        while self.pending and len(embeds) < MAX_EMBEDS:
+            key, entry = next(iter(self.pending.items()))
+            # The queued embed stays as it is in case the flag has to be sent again
+            embed = entry['embed'].copy()
+            if entry['count'] > 1:
+                embed.add_field(name='Occurrences', value=f"Flagged {entry['count']} times", inline=False)
+            # The text of all embeds in a message counts towards one limit
+            if embeds and size + len(embed) > MAX_EMBED_CHARS:
+                break
+            del self.pending[key]
+            taken.append((key, entry))
+            embeds.append(embed)
+            size += len(embed)
+        return taken, embeds
+
+    def requeue(self, taken):
+        """Puts flags that couldn't be sent back at the front, merged with copies that arrived meanwhile."""
+        for key, entry in reversed(taken):
+            newer = self.pending.pop(key, None)
+            if newer is not None:
+                entry['count'] += newer['count']
+            self.pending[key] = entry
+            self.pending.move_to_end(key, last=False)
+
+    async def run_drainer(self):
+        """Sends a message once ten flags are waiting or the oldest one waited `flag_collapse_window_ms`."""
+        await self.bot.wait_until_ready()
+        while True:
+            self.new_flag.clear()
+            if not self.pending:
+                await self.new_flag.wait()
+                continue
+
+            window = self.bot.config.get('flag_collapse_window_ms', 10000) / 1000
+            oldest = next(iter(self.pending.values()))['first_seen']
+            remaining = oldest + window - time.monotonic()
+            if len(self.pending) < MAX_EMBEDS and remaining > 0:
+                try:
+                    await asyncio.wait_for(self.new_flag.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            taken, embeds = self.take_embeds()
+            try:
+                webhook = await self.get_webhook()
+                await webhook.send(embeds=embeds, wait=False)
+            except Exception as e:
+                # Discord rejecting the embeds won't change on a retry, anything else might
+                if isinstance(e, discord.HTTPException) and e.status == 400:
+                    self.bot.logger.exception(f"Discord rejected {len(embeds)} flags, dropping them")
+                else:
+                    self.bot.logger.exception(f"Failed to send {len(embeds)} flags, retrying")
+                    self.requeue(taken)
+                # The webhook may have been deleted, look it up again next time
+                self.webhook = None
+                await asyncio.sleep(5)
+                continue
+            self.sent_messages += 1
+            self.sent_embeds += len(embeds)
+
+    def format(self):
+        return (
+            f"{len(self.pending)} waiting, {self.sent_embeds} flags sent in {self.sent_messages} messages, "
+            f"{self.collapsed} duplicates collapsed"
+        )
+
+
+def setup(bot):
+    bot.add_cog(FlagPublisher(bot))
@@ -27,7 +27,6 @@ class ReviewQueue(commands.Cog):
         self.bot: "FlagBot" = bot
         self.review_queue = []
         self.in_review = []
-        self.review_lock = asyncio.Lock()
         self.messages = []
         self.cols_target = ['insult', 'severe_toxic', 'identity_hate', 'threat', 'nsfw']
 
@@ -74,8 +73,9 @@ class ReviewQueue(commands.Cog):
         if str(reaction) == emojis[-4]:
             self.bot.logger.info("Sending review.")
             conn = self.bot.get_db()
-            async with self.review_lock:
-                review = await conn.get_review_message(message.id, member.id)
+            # The vote and claiming the reviewer's next review share one connection and transaction
+            async with conn.unit_of_work('on_raw_reaction_add') as tx:
+                review = await conn.get_review_message(message.id, member.id, conn=tx)
                 if review is None:
                     return
                 reactions = message.reactions
@@ -85,90 +85,106 @@ class ReviewQueue(commands.Cog):
                         i = emojis.index(str(r))
                         scores[self.cols_target[i]] = r.count - 1
                 asyncio.create_task(self.remove_reactions(message))
-                await conn.submit_review(review['review_id'], member.id, scores)
-                await self.change_message(message, member)
-                complete_review = await conn.check_complete_review(review['review_id'])
-                if complete_review:
-                    asyncio.create_task(self.add_train_row(complete_review))
+                # Recording the vote and completing the review is atomic, no lock needed
+                complete_review = await conn.submit_vote(review['review_id'], member.id, scores, conn=tx)
+                next_review, next_scores = await self.claim_next_review(member.id, message.id, conn=tx)
+            await self.show_review(message, next_review, next_scores)
+            if complete_review:
+                asyncio.create_task(self.add_train_row(complete_review))
 
         # Send to santization queue
         elif str(reaction) == emojis[-3]:
             self.bot.logger.info("Sending to santization queue")
 
-            async with self.review_lock:
-                conn = self.bot.get_db()
-                review = await conn.get_review_message(message.id, member.id)
-                asyncio.create_task(self.remove_reactions(message))
-                if review is None:
-                    return
-                msgs_to_edit = await conn.set_sanitize(review['review_id'])
-                for m in msgs_to_edit:
-                    msg = await self.bot.get_channel(m['channel_id']).fetch_message(m['message_id'])
-                    member = self.bot.get_user(m['user_id']) or await self.bot.fetch_user(m['user_id'])
-                    await self.change_message(msg, member)
-
-                sanitize_cog = self.bot.get_cog('SanitizeQueue')
-                if sanitize_cog is None:
-                    self.bot.logger.info("The cog \"SanitizeQueue\" is not loaded")
-                    return
-                asyncio.create_task(sanitize_cog.add_to_sanitize_queue(review, msgs_to_edit))
+            conn = self.bot.get_db()
+            review = await conn.get_review_message(message.id, member.id)
+            asyncio.create_task(self.remove_reactions(message))
+            if review is None:
+                return
+            msgs_to_edit = await conn.set_sanitize(review['review_id'])
+            if not msgs_to_edit:
+                # The review was completed in the meantime
+                return
+            for m in msgs_to_edit:
+                msg = await self.bot.get_channel(m['channel_id']).fetch_message(m['message_id'])
+                member = self.bot.get_user(m['user_id']) or await self.bot.fetch_user(m['user_id'])
+                await self.change_message(msg, member)
+
+            sanitize_cog = self.bot.get_cog('SanitizeQueue')
+            if sanitize_cog is None:
+                self.bot.logger.info("The cog \"SanitizeQueue\" is not loaded")
+                return
+            asyncio.create_task(sanitize_cog.add_to_sanitize_queue(review, msgs_to_edit))
 
     async def change_message(self, message, member):
         conn = self.bot.get_db()
+        async with conn.unit_of_work('change_message') as tx:
+            review_message, scores = await self.claim_next_review(member.id, message.id, conn=tx)
+        await self.show_review(message, review_message, scores)
+
+    async def claim_next_review(self, user_id, message_id, conn=None):
+        db = self.bot.get_db()
+        review_message = await db.claim_review(user_id, message_id, conn=conn)
+        if not review_message:
+            return None, None
+        return review_message, await db.get_score(review_message['score_id'], conn=conn)
+
+    async def show_review(self, message, review_message, scores):
         webhook = (await message.channel.webhooks())[0]
-        review_message = await conn.pop_review_queue(member.id)
         if not review_message:
             await webhook.delete_message(message.id)
             return
-        scores = await conn.get_score(review_message['score_id'])
         embed = self.create_review_embed(review_message['clean_content'], scores)
-        await conn.add_review_log(review_message['id'], member.id, message.id)
         await webhook.edit_message(message.id, embed=embed)
 
         stats_cog = self.bot.get_cog('Stats')
         if stats_cog is None:
             self.bot.logger.info("The cog \"Stats\" is not loaded")
             return
-        start = datetime.now()
         asyncio.create_task(stats_cog.create_stats())
-    
+
     async def remove_reactions(self, message):
         for r in message.reactions:
             data = {'method': 'delete_reactions', 'channel': message.channel.id, 'message': message.id, 'emoji': str(r.emoji).strip('<>')}
             await self.bot.redis.rpush('flagbot:queue', json.dumps(data))
         
     async def add_train_row(self, row: dict={'message': str, 'score': dict}):
-        row = ([row['message']] + [x[1] for x in row['score'].items()])
-        is_new_file = not os.path.exists("./input/new_train.csv")
-
-        with open(r'./input/new_train.csv', 'a') as f:
-            writer = csv.writer(f)
-            if is_new_file:
-                writer.writerow(['comment_text'] + self.cols_target)
-            writer.writerow(row)
+        nlp_cog = self.bot.get_cog('NLP')
+        if nlp_cog is not None and nlp_cog.corpus is not None:
+            await asyncio.get_event_loop().run_in_executor(None, nlp_cog.corpus.append_rows, [row])
+        else:
+            csv_row = ([row['message']] + [x[1] for x in row['score'].items()])
+            is_new_file = not os.path.exists("./input/new_train.csv")
+
+            with open(r'./input/new_train.csv', 'a') as f:
+                writer = csv.writer(f)
+                if is_new_file:
+                    writer.writerow(['comment_text'] + self.cols_target)
+                writer.writerow(csv_row)
+
+        # Fold the new row into the live model when running in online learning mode
+        if nlp_cog is None:
+            self.bot.logger.info("The cog \"NLP\" is not loaded")
+            return
+        await nlp_cog.learn(row)
 
     async def create_new_review(self, review: dict = {'message': str, 'score': {'insult': int, 'severe_toxic': int, 'identity_hate': int, 'threat': int}}):
-        message = review['message']
-        scores = review['score']
-
-        conn = self.bot.get_db()
-
-        await conn.add_review_message(message, scores)
-
-        await self.fill_empty_queues()
+        # The message of a single review is already clean
+        await self.add_reviews_bulk([dict(review, clean_content=review['message'])])
 
     async def fill_empty_queues(self):
         conn = self.bot.get_db()
-        async with self.review_lock:
-            reviewers = await conn.find_empty_queues()
+        reviewers = await conn.find_empty_queues()
 
-            if len(reviewers) == 0:
-                return
+        if len(reviewers) == 0:
+            return
 
-            for reviewer in reviewers:
-                review_message = await conn.pop_review_queue(reviewer['user_id'])
-                if not review_message:
-                    continue
+        for reviewer in reviewers:
+            # Claims are atomic, a concurrent fill can't give the reviewer a second review
+            review_message = await conn.claim_review(reviewer['user_id'])
+            if not review_message:
+                continue
+            try:
                 channel = self.bot.get_channel(reviewer['channel_id']) or await self.bot.fetch_channel(reviewer['channel_id'])
                 webhook = (await channel.webhooks())[0]
 
@@ -177,10 +193,14 @@ class ReviewQueue(commands.Cog):
                 embed = self.create_review_embed(review_message['clean_content'], scores)
 
                 sent_message = await channel.fetch_message((await webhook.send(embed=embed, avatar_url=self.bot.user.avatar_url, wait=True)).id)
-
-                await conn.add_review_log(review_message['id'], reviewer['user_id'], sent_message.id)
-                for emoji in self.bot.config.get('reaction_emojis')[:-2]:
-                    await sent_message.add_reaction(emoji)
+            except discord.HTTPException:
+                self.bot.logger.exception(f"Failed to send review {review_message['id']} to {reviewer['user_id']}")
+                await conn.release_review(review_message['id'], reviewer['user_id'])
+                continue
+
+            await conn.set_review_log_message(review_message['id'], reviewer['user_id'], sent_message.id)
+            for emoji in self.bot.config.get('reaction_emojis')[:-2]:
+                await sent_message.add_reaction(emoji)
                     
     
     async def refresh_queue(self, user_id):
@@ -203,13 +223,34 @@ class ReviewQueue(commands.Cog):
         return embed
 
     async def add_reviews_to_queue(self, new_reviews):
+        await self.add_reviews_bulk(new_reviews)
+
+    async def add_reviews_bulk(self, new_reviews):
+        """
+        Adds messages to the review queue with a single insert and a single queue fill.
+
+        Reviews hold either the scanned message or its `clean_content`, and a `score` dict.
+        """
+        if len(new_reviews) == 0:
+            return
         nlp_cog = self.bot.get_cog('NLP')
         if nlp_cog is None:
             self.bot.logger.info("The cog \"NLP\" is not loaded")
             return
+
+        # Scanned messages were already normalized by the model pass, the rest is cleaned in one go
+        raw = [r for r in new_reviews if 'clean_content' not in r]
+        if raw:
+            clean_texts = nlp_cog.clean_many([r['message'].content if type(r['message']) is not str else r['message'] for r in raw])
+            for r, clean_text in zip(raw, clean_texts):
+                r['clean_content'] = clean_text
         for r in new_reviews:
-            r['message'] = nlp_cog.clean_text(r['message'].content if type(r['message']) is not str else r['message'])
-            await self.create_new_review(r)
+            r['message'] = r['clean_content']
+
+        conn = self.bot.get_db()
+        await conn.add_review_messages([(r['clean_content'], r['score']) for r in new_reviews])
+
+        await self.fill_empty_queues()
 
 
 def setup(bot):
@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import time
+from collections import Counter, OrderedDict, deque
 from datetime import datetime, timedelta
 
 import discord
 from discord.ext import commands
 from utils.checks import in_scan_channel
+from utils.metrics import Histogram
+from utils.pipeline import Pipeline
+from utils.records import ScanRecord
+from utils.stream import ScanStream
 
 class Rollback(Exception):
     pass
@@ -14,11 +20,39 @@ class Scanner(commands.Cog):
     def __init__(self, bot):
         super().__init__()
         self.bot = bot
-        self.messages = []
-        self.manual_check = False
+        # Incoming messages go to a Redis Stream first, the reader moves this process' share into the local buffer
+        self.stream = ScanStream(self.bot.redis, **self.bot.config.get('scan_stream', {}))
+        # Unscored messages per channel as compact records, batches take from every channel in turn
+        self.buffers = OrderedDict()
+        self.buffered = 0
+        # Progress of the running backfills per channel
+        self.backfills = {}
         self.message_lock = asyncio.Lock()
-        self.compute_lock = asyncio.Lock()
-            
+        self.new_message = asyncio.Event()
+
+        self.queue_depth = Histogram()
+        self.batch_sizes = Histogram()
+        self.time_to_score = Histogram(size=10000)
+        self.flush_reasons = Counter()
+
+        # Batches flow collect -> score -> persist -> publish -> review, so slow Discord calls for one batch don't hold up scoring the next
+        settings = self.bot.config.get('pipeline', {})
+        queue_size = settings.get('queue_size', 2)
+        self.pipeline = Pipeline(self.bot.logger)
+        self.pipeline.add_stage('score', self.score_stage, settings.get('score_workers', 1), queue_size)
+        self.pipeline.add_stage('persist', self.persist_stage, settings.get('persist_workers', 2), queue_size)
+        self.pipeline.add_stage('publish', self.publish_stage, settings.get('publish_workers', 1), queue_size)
+        self.pipeline.add_stage('review', self.review_stage, settings.get('review_workers', 1), queue_size)
+        self.pipeline.start()
+
+        self.reader = asyncio.create_task(self.run_reader())
+        self.scheduler = asyncio.create_task(self.run_scheduler())
+
+    def cog_unload(self):
+        self.reader.cancel()
+        self.scheduler.cancel()
+        self.pipeline.stop()
+
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
         # Ignore prefix
@@ -29,82 +63,336 @@ class Scanner(commands.Cog):
         # Ignore message not in scan channels
         if not in_scan_channel(self, message.channel.id): return
         
+        # Add messages to processing queue
+        await self.stream.add([ScanRecord.from_message(message)])
+
+    def add_messages(self, records):
+        for record in records:
+            self.buffers.setdefault(record.channel_id, deque()).append(record)
+        self.buffered += len(records)
+        self.new_message.set()
+
+    async def run_reader(self):
+        """Moves stream entries into the local buffer, starting with the ones a previous run left unacknowledged."""
+        while True:
+            try:
+                await self.stream.create_group()
+                records = await self.stream.read_pending() + await self.stream.reclaim()
+                break
+            except Exception:
+                self.bot.logger.exception("Failed to recover pending messages from the scan stream")
+                await asyncio.sleep(5)
         async with self.message_lock:
-            # Add messages to processing queue
-            self.messages += [message]
-            if len(self.messages) % 100 == 0 or len(self.messages) == 1:
-                self.bot.logger.info(f"Added message {len(self.messages)}/{self.bot.config.get('min_scanned')}")
-                
-        await self.process_messages()
+            self.add_messages(records)
+        if records:
+            self.bot.logger.info(f"Recovered {len(records)} unscored messages from the scan stream")
+
+        last_reclaim = time.monotonic()
+        while True:
+            min_scanned = self.bot.config.get('min_scanned')
+            nlp_cog = self.bot.get_cog('NLP')
+            # Leave entries in the stream for other consumers while enough is buffered here, or nothing can be scored
+            if self.buffered >= 2 * min_scanned or (self.buffered >= min_scanned and (nlp_cog is None or not nlp_cog.ready)):
+                await asyncio.sleep(1)
+                continue
+            try:
+                records = await self.stream.read(min_scanned, timeout_ms=1000)
+                if time.monotonic() - last_reclaim >= self.stream.claim_idle_ms / 1000:
+                    records += await self.stream.reclaim()
+                    last_reclaim = time.monotonic()
+            except Exception:
+                self.bot.logger.exception("Failed to read from the scan stream")
+                await asyncio.sleep(5)
+                continue
+            if not records:
+                continue
+            async with self.message_lock:
+                before = self.buffered
+                self.add_messages(records)
+                if before // 100 != self.buffered // 100 or before == 0:
+                    self.bot.logger.info(f"Added message {self.buffered}/{min_scanned}")
+
+    def take_batch(self, size: int = None):
+        """Takes up to `size` messages, one channel at a time in round robin so a busy channel can't starve quiet ones."""
+        batch = []
+        size = size or self.buffered
+        while len(batch) < size and self.buffers:
+            for channel_id in list(self.buffers):
+                queue = self.buffers[channel_id]
+                batch.append(queue.popleft())
+                if not queue:
+                    del self.buffers[channel_id]
+                if len(batch) >= size:
+                    break
+        # Start with a different channel next time
+        if self.buffers:
+            self.buffers.move_to_end(next(iter(self.buffers)))
+        self.buffered -= len(batch)
+        return batch
+
+    def oldest_message(self):
+        if not self.buffers:
+            return None
+        return min(queue[0].enqueued for queue in self.buffers.values())
+
+    async def run_scheduler(self):
+        """Flushes the buffer once it holds a full batch or its oldest message waited `max_scan_delay_ms`."""
+        await self.bot.wait_until_ready()
+        while True:
+            self.new_message.clear()
+            max_delay = self.bot.config.get('max_scan_delay_ms', 60000) / 1000
+            oldest = self.oldest_message()
+
+            if self.buffered >= self.bot.config.get('min_scanned'):
+                reason = 'size'
+            elif oldest is not None and time.monotonic() - oldest >= max_delay:
+                reason = 'delay'
+            else:
+                timeout = None if oldest is None else oldest + max_delay - time.monotonic()
+                try:
+                    await asyncio.wait_for(self.new_message.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Keep buffering while the model is still loading
+            nlp_cog = self.bot.get_cog('NLP')
+            if nlp_cog is None or not nlp_cog.ready:
+                await asyncio.sleep(1)
+                continue
+
+            self.flush_reasons[reason] += 1
+            await self.process_messages()
 
     @commands.is_owner()
     @commands.command("extract_messages")
     async def extract_messages_command(self, ctx: commands.Context, channel_id: str='', count: int=500):
-        channel = self.bot.get_channel(int(channel_id))
-        reply = await ctx.send(f'1. Fetching {count} messages...')
-        start = datetime.now()
-        messages = await channel.history(limit=count).flatten()
-        await reply.edit(content=f"{reply.content} Done ({(datetime.now()-start).total_seconds()} seconds)\n2. Waiting in model queue...")
+        """Backfills the last `count` messages of one or more comma separated channels, resuming unfinished backfills."""
+        channels = [self.bot.get_channel(int(c)) for c in channel_id.split(',') if c.strip()]
+        if not channels or None in channels:
+            await ctx.send("Unknown channel.")
+            return
+        nlp_cog = self.bot.get_cog('NLP')
+        if nlp_cog is None or not nlp_cog.ready:
+            await ctx.send("Model is still loading, try again later.")
+            return
+        busy = [c for c in channels if c.id in self.backfills]
+        if busy:
+            await ctx.send(f"Already backfilling {', '.join(f'<#{c.id}>' for c in busy)}.")
+            return
+
+        title = f"Backfilling {count} messages from {', '.join(f'<#{c.id}>' for c in channels)}..."
+        reply = await ctx.send(title)
         start = datetime.now()
-        self.manual_check = True
+        progress = {c.id: {'scanned': 0, 'flagged': 0, 'done': False} for c in channels}
+        self.backfills.update(progress)
+        reporter = asyncio.create_task(self.report_backfill(reply, title, progress, start))
+        # Channels are backfilled concurrently, a limited number at a time
+        semaphore = asyncio.Semaphore(self.bot.config.get('backfill_channels', 3))
+
+        async def run(channel):
+            async with semaphore:
+                try:
+                    await self.backfill_channel(channel, count, progress[channel.id])
+                except Exception:
+                    # The checkpoint stays at the last scanned chunk, running the command again resumes from there
+                    self.bot.logger.exception(f"Backfill of {channel.id} stopped")
+                    progress[channel.id]['stopped'] = True
+
+        try:
+            await asyncio.gather(*[run(c) for c in channels])
+        finally:
+            reporter.cancel()
+            for c in channels:
+                self.backfills.pop(c.id, None)
+        await reply.edit(content=self.format_backfill(title, progress, start))
+
+    def format_backfill(self, title, progress, start):
+        lines = [title]
+        for channel_id, p in progress.items():
+            state = 'done' if p['done'] else 'stopped' if p.get('stopped') else 'running'
+            lines.append(f"<#{channel_id}>: {p['scanned']} scanned, {p['flagged']} flagged ({state})")
+        lines.append(f"{(datetime.now()-start).total_seconds():.1f} seconds")
+        return '\n'.join(lines)
+
+    async def report_backfill(self, reply: discord.Message, title: str, progress, start):
+        while True:
+            await asyncio.sleep(5)
+            await reply.edit(content=self.format_backfill(title, progress, start))
+
+    async def backfill_channel(self, channel, count: int, progress: dict):
+        """
+        Scans the history of `channel` page by page, checkpointing the oldest scanned message.
+
+        The next chunk is fetched from Discord while the previous one is being scored and
+        persisted. An unfinished backfill of the channel continues where it stopped.
+        """
+        conn = self.bot.get_db()
+        chunk_size = self.bot.config.get('backfill_chunk_size', 500)
+        checkpoint = await conn.get_backfill_checkpoint(channel.id)
+        before, scanned = None, 0
+        if checkpoint is not None and not checkpoint['done']:
+            before, scanned = discord.Object(id=checkpoint['last_message_id']), checkpoint['scanned']
+            self.bot.logger.info(f"Resuming backfill of {channel.id} after {scanned} messages")
+        progress['scanned'] = scanned
+        if scanned >= count:
+            progress['done'] = True
+            return
+
+        chunks = asyncio.Queue(maxsize=2)
+
+        async def fetch():
+            chunk = []
+            try:
+                async for message in channel.history(limit=count - scanned, before=before):
+                    chunk.append(ScanRecord.from_message(message))
+                    if len(chunk) >= chunk_size:
+                        await chunks.put(chunk)
+                        chunk = []
+                if chunk:
+                    await chunks.put(chunk)
+            finally:
+                await chunks.put(None)
+
+        async def checkpoint(chunk, job):
+            nonlocal before, scanned
+            # Chunks are awaited in the order they were submitted, so the checkpoint never skips an unfinished one
+            job = await job
+            if job is None:
+                raise RuntimeError(f"A chunk of {len(chunk)} messages wasn't scored")
+            scanned += len(chunk)
+            before = discord.Object(id=chunk[-1].id)
+            progress['scanned'] = scanned
+            progress['flagged'] += len(job['flags'])
+            await conn.set_backfill_checkpoint(channel.id, before.id, scanned)
+
+        fetcher = asyncio.create_task(fetch())
+        in_flight = deque()
+        try:
+            while True:
+                chunk = await chunks.get()
+                if chunk is None:
+                    break
+                in_flight.append((chunk, await self.pipeline.submit({'records': chunk})))
+                while in_flight and (in_flight[0][1].done() or len(in_flight) > 2):
+                    await checkpoint(*in_flight.popleft())
+            while in_flight:
+                await checkpoint(*in_flight.popleft())
+            # Surface errors from fetching the history
+            await fetcher
+        finally:
+            fetcher.cancel()
+
+        if before is not None:
+            await conn.set_backfill_checkpoint(channel.id, before.id, scanned, True)
+        progress['done'] = True
+
+    @commands.is_owner()
+    @commands.command("scan_stats")
+    async def scan_stats_command(self, ctx: commands.Context):
+        nlp_cog = self.bot.get_cog('NLP')
+        publisher_cog = self.bot.get_cog('FlagPublisher')
+        channels = ', '.join(f"<#{c}>: {len(q)}" for c, q in self.buffers.items())
+        stream = await self.stream.stats()
+        backfills = ', '.join(f"<#{c}>: {p['scanned']} scanned" for c, p in self.backfills.items())
+        await ctx.send(
+            f"**Queue depth:** {self.buffered} ({channels or 'empty'})\n"
+            f"**Scan stream:** {stream['length']} entries, {stream['pending']} unacknowledged\n"
+            f"**Queue depth at flush:** {self.queue_depth.format(unit='')}\n"
+            f"**Batch size:** {self.batch_sizes.format(unit='')}\n"
+            f"**Time to score:** {self.time_to_score.format()}\n"
+            f"**Flushes:** {', '.join(f'{k}={v}' for k, v in self.flush_reasons.items()) or 'none'}\n"
+            f"**Backfills:** {backfills or 'none'}\n"
+            f"**Score cache:** {nlp_cog.cache.format() if nlp_cog is not None else 'NLP cog not loaded'}\n"
+            f"**Flag publisher:** {publisher_cog.format() if publisher_cog is not None else 'FlagPublisher cog not loaded'}\n"
+            f"**Pipeline:**\n{self.pipeline.format()}"
+        )
+
+    async def process_messages(self):
+        """Takes a batch from the buffer and submits it to the pipeline, waiting while the score stage is backed up."""
         async with self.message_lock:
-            # Add messages to processing queue
-            self.messages += messages
-            self.bot.logger.info(f"Added messages {len(self.messages)}/{self.bot.config.get('min_scanned')}")
-        
-        await self.process_messages(reply, start)
-            
-    async def process_messages(self, reply: discord.Message=None, start: datetime=None):
-        
-        async with self.compute_lock:
-            # Load model cog
-            nlp_cog = self.bot.get_cog('NLP')
-            if nlp_cog is None:
-                self.bot.logger.info("The cog \"NLP\" is not loaded")
-                return
-            # If enough messages were collected then start processing
-            async with self.message_lock:
-                if len(self.messages) < self.bot.config.get('min_scanned') or (self.manual_check and reply is None): 
-                    if reply is not None: await reply.edit(content=f"{reply.content} Done ({(datetime.now()-start).total_seconds()} seconds)\n3. Not enough messages to scan {len(self.messages)}/{self.bot.config.get('min_scanned')}")
-                    return
-                test_messages = self.messages.copy()
-                test_messages = [x for x in test_messages if x.author.id not in self.bot.config.get('ignored_users')]
-                self.messages = []
-            if reply is not None: await reply.edit(content=f"{reply.content} Done ({(datetime.now()-start).total_seconds()} seconds)\n3. Running model on {len(test_messages)} messages...")
-            start = datetime.now()
-            # Run model
-            flags,new_reviews,logs = await asyncio.get_event_loop().run_in_executor(None, nlp_cog.compute_messages, test_messages)
-            if reply is not None: 
-                
-                content = f"{reply.content} Done ({(datetime.now()-start).total_seconds()} seconds)"
-                for l in logs:
-                    content += f"\n\t{l}"
-                content += f"\n>Flagged {len(flags)} messages and selected {len(new_reviews)} messages for the review queue."
-                content += f"\n4. Sending flagged messages to <#{self.bot.config.get('flag_channel')}>..."
-                await reply.edit(content=content)
-            
-            start = datetime.now()
-            if len(flags) > 0:    
-                # Send flagged messages
-                conn = self.bot.get_db()
-                await conn.add_infractions(flags)
-                for flag in flags:
-                    await self.bot.get_channel(self.bot.config.get('flag_channel')).send(embed=flag['embed'])
-                    
-            if reply is not None: await reply.edit(content=f"{reply.content} Done ({(datetime.now()-start).total_seconds()} seconds)\n5. Sending review messages to <#{self.bot.config.get('review_channel')}> or review queue...")
-            start = datetime.now()
-            # Load review queue cog
-            review_queue_cog = self.bot.get_cog('ReviewQueue')
-            if review_queue_cog is None:
-                self.bot.logger.info("The cog \"ReviewQueue\" is not loaded")
+            if self.buffered == 0:
                 return
-            
-            # Add flagged messages to review queue
-            await review_queue_cog.add_reviews_to_queue(new_reviews)
-            
-            if reply is not None: 
-                await reply.edit(content=f"{reply.content} Done ({(datetime.now()-start).total_seconds()} seconds)")
-                self.manual_check = False
+            self.queue_depth.observe(self.buffered)
+            batch = self.take_batch(self.bot.config.get('min_scanned'))
+            self.batch_sizes.observe(len(batch))
+        # Batches that fail to score or persist go back to the buffer, their stream entries stay unacknowledged meanwhile
+        await self.pipeline.submit({'records': batch, 'requeue': True})
+
+    async def requeue(self, job):
+        """Puts the records of a failed batch back at the front of their channels' buffers."""
+        if not job.get('requeue'):
+            return
+        records = job['records']
+        async with self.message_lock:
+            for record in reversed(records):
+                self.buffers.setdefault(record.channel_id, deque()).appendleft(record)
+            self.buffered += len(records)
+
+    async def score_stage(self, job):
+        nlp_cog = self.bot.get_cog('NLP')
+        if nlp_cog is None:
+            self.bot.logger.info("The cog \"NLP\" is not loaded")
+            await self.requeue(job)
+            return None
+        records = job['records']
+        test_messages = [x for x in records if x.author_id not in self.bot.config.get('ignored_users')]
+        # Run model
+        try:
+            job['flags'], job['new_reviews'], _ = await nlp_cog.scan_messages(test_messages)
+        except asyncio.TimeoutError:
+            # Put the batch back so it is scored once the inference server is reachable again
+            self.bot.logger.warning(f"Timed out scoring {len(records)} messages, requeueing them.")
+            await self.requeue(job)
+            return None
+        except Exception:
+            self.bot.logger.exception(f"Failed to score {len(records)} messages, requeueing them.")
+            await self.requeue(job)
+            return None
+        scored = time.monotonic()
+        for record in records:
+            self.time_to_score.observe(scored - record.enqueued)
+        return job
+
+    async def persist_stage(self, job):
+        if len(job['flags']) > 0 or len(job['new_reviews']) > 0:
+            conn = self.bot.get_db()
+            # Scores, infractions and review messages of the batch are written in one transaction
+            try:
+                await conn.add_scan_results(
+                    job['flags'],
+                    [(r['clean_content'], r['score']) for r in job['new_reviews']]
+                )
+            except Exception:
+                if not job.get('requeue'):
+                    raise
+                self.bot.logger.exception(f"Failed to persist the results of {len(job['records'])} messages, requeueing them.")
+                await self.requeue(job)
+                return None
+        return job
+
+    async def publish_stage(self, job):
+        # Send flagged messages
+        publisher_cog = self.bot.get_cog('FlagPublisher')
+        if publisher_cog is None:
+            self.bot.logger.info("The cog \"FlagPublisher\" is not loaded")
+            return job
+        publisher_cog.publish(job['flags'])
+        return job
+
+    async def review_stage(self, job):
+        # Load review queue cog
+        review_queue_cog = self.bot.get_cog('ReviewQueue')
+        if review_queue_cog is None:
+            self.bot.logger.info("The cog \"ReviewQueue\" is not loaded")
+        else:
+            # The batch's review messages were persisted with its scores, hand them out to reviewers
+            if len(job['new_reviews']) > 0:
+                await review_queue_cog.fill_empty_queues()
+        # Everything the batch produced is persisted, it doesn't need to be scanned again after a restart
+        await self.stream.ack(job['records'])
+        return job
+
 def setup(bot):
     bot.add_cog(Scanner(bot))
 
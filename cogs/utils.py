@@ -6,6 +6,7 @@ from datetime import datetime, timedelta
 import discord
 from discord.ext import commands
 from utils.checks import check_granted_server, is_reviewer
+from utils.pool import acquire
 from asyncpg.exceptions import UniqueViolationError
 
 
@@ -30,7 +31,7 @@ class Utils(commands.Cog):
             if not channel:
                 await ctx.send("Channel not found!")
                 continue
-            async with self.bot.db.acquire() as conn:
+            async with acquire(self.bot.db, 'import_channels') as conn:
                 async with conn.transaction():
                     try:
                         await conn.fetch(
@@ -53,7 +54,7 @@ class Utils(commands.Cog):
         if not channel:
             await ctx.send("Channel not found!")
             return
-        async with self.bot.db.acquire() as conn:
+        async with acquire(self.bot.db, 'add_channel') as conn:
             async with conn.transaction():
                 try:
                     await conn.fetch(
@@ -112,6 +113,7 @@ class Utils(commands.Cog):
         with open('config.toml', 'r', encoding='utf-8') as f:
             data = toml.load(f)
         self.bot.config = data
+        self.update_blacklist()
         await ctx.send(f"Reloaded config.")
         await self.bot.load_cache()
     
@@ -134,8 +136,19 @@ class Utils(commands.Cog):
         self.bot.config = data
         with open('config.toml', 'w') as f:
             toml.dump(data, f)
+        self.update_blacklist()
         await ctx.send(f"Added `{phrase}` to the blacklist.")
         await self.bot.load_cache()
+
+    def update_blacklist(self):
+        # Rebuild the compiled blacklist of the text normalizer
+        nlp_cog = self.bot.get_cog('NLP')
+        if nlp_cog is None:
+            self.bot.logger.info("The cog \"NLP\" is not loaded")
+            return
+        nlp_cog.update_blacklist()
+
+
 def setup(bot):
     bot.add_cog(Utils(bot))
 
@@ -1,3 +1,4 @@
 # -*- coding: utf-8 -*-
 
 from .logging import setup_logging
+from .migrations import apply_migrations
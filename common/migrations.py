@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import re
+from pathlib import Path
+
+from utils.pool import acquire
+
+
+log = logging.getLogger(__name__)
+
+#: Directory holding the numbered migration files, e.g. ``0001_hot_path_indexes.sql``.
+MIGRATIONS_PATH = Path(__file__).resolve().parent.parent / 'migrations'
+
+# Key of the advisory lock held while migrating, the bot, the worker and the inference server may start together
+LOCK_KEY = 0x666c6167626f74
+
+MIGRATION_FILE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+
+def load_migrations(path=MIGRATIONS_PATH):
+    """
+    Reads the migrations in a directory.
+
+    Parameters
+    ----------
+    path : Path
+        The directory to read, defaults to the ``migrations`` directory of the repository.
+
+    Returns
+    -------
+    list of tuple
+        (version, name, sql) for every migration, ordered by version.
+    """
+
+    migrations = []
+    for file in Path(path).glob('*.sql'):
+        match = MIGRATION_FILE.match(file.name)
+        if match is None:
+            log.warning('Ignoring migration with an invalid name: %s', file.name)
+            continue
+        migrations.append((int(match.group(1)), match.group(2), file.read_text(encoding='utf-8')))
+
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f'Duplicate migration versions in {path}')
+    return migrations
+
+
+async def apply_migrations(pool, path=MIGRATIONS_PATH):
+    """
+    Applies the migrations that haven't been applied to the database yet.
+
+    ``schema.sql`` only creates the tables of a new database, every later schema change is a migration so
+    existing databases receive it too.
+
+    Every migration runs in its own transaction together with its row in ``schema_migrations``, so a failing
+    migration leaves the schema at the previous version. Processes starting at the same time wait on an advisory
+    lock, only the first one applies anything.
+
+    Parameters
+    ----------
+    pool : asyncpg.pool.Pool
+        The pool to take a connection from.
+    path : Path
+        The directory to read the migrations from.
+
+    Returns
+    -------
+    list of int
+        The versions that were applied.
+    """
+
+    migrations = load_migrations(path)
+    applied = []
+
+    async with acquire(pool, 'apply_migrations') as conn:
+        await conn.execute('SELECT pg_advisory_lock($1)', LOCK_KEY)
+        try:
+            await conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    date_applied TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+                """
+            )
+            done = {r['version'] for r in await conn.fetch('SELECT version FROM schema_migrations')}
+
+            for version, name, sql in migrations:
+                if version in done:
+                    continue
+                log.info('Applying migration %04d_%s', version, name)
+                async with conn.transaction():
+                    await conn.execute(sql)
+                    await conn.execute('INSERT INTO schema_migrations (version, name) VALUES ($1, $2)', version, name)
+                applied.append(version)
+        finally:
+            await conn.execute('SELECT pg_advisory_unlock($1)', LOCK_KEY)
+
+    return applied
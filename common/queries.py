@@ -0,0 +1,503 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+
+import asyncpg
+
+from utils.metrics import Histogram
+
+
+log = logging.getLogger(__name__)
+
+
+class Query:
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+        self.timings = Histogram()
+        self.errors = 0
+
+
+class QueryConnection(asyncpg.connection.Connection):
+    """Connection holding the statements of the registry it prepared, by name."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = {}
+
+
+class QueryRegistry:
+    """
+    Named SQL statements, prepared once per connection and timed on every call.
+
+    Pools created with `pool_options` prepare every statement when they open a connection. Statements
+    that can't be prepared yet, e.g. because a migration hasn't created their table, are prepared on
+    first use instead. Connections of other pools run the statements as plain queries, timed all the same.
+    """
+
+    def __init__(self):
+        self.queries = {}
+
+    def register(self, name: str, sql: str):
+        if name in self.queries:
+            raise ValueError(f'Query {name} is already registered')
+        self.queries[name] = Query(name, sql)
+        return name
+
+    def pool_options(self):
+        """Keyword arguments for `asyncpg.create_pool`."""
+        return {'connection_class': QueryConnection, 'init': self.prepare_all}
+
+    async def prepare_all(self, conn):
+        for query in self.queries.values():
+            try:
+                conn.statements[query.name] = await conn.prepare(query.sql)
+            except asyncpg.PostgresError as e:
+                log.debug('Preparing %s on first use: %s', query.name, e)
+
+    async def _run(self, conn, method: str, name: str, args):
+        query = self.queries[name]
+        statements = getattr(conn, 'statements', None)
+        start = time.perf_counter()
+        try:
+            if statements is None:
+                return await getattr(conn, method)(query.sql, *args)
+            statement = statements.get(name)
+            if statement is None:
+                statement = statements[name] = await conn.prepare(query.sql)
+            try:
+                return await getattr(statement, method)(*args)
+            except asyncpg.InvalidCachedStatementError:
+                # The schema changed under the statement, e.g. a migration applied by another process
+                del statements[name]
+                # An aborted transaction can't prepare it again, the caller's unit of work has to be retried
+                if conn.is_in_transaction():
+                    raise
+                statement = statements[name] = await conn.prepare(query.sql)
+                return await getattr(statement, method)(*args)
+        except Exception:
+            query.errors += 1
+            raise
+        finally:
+            query.timings.observe(time.perf_counter() - start)
+
+    async def fetch(self, conn, name: str, *args):
+        return await self._run(conn, 'fetch', name, args)
+
+    async def fetchrow(self, conn, name: str, *args):
+        return await self._run(conn, 'fetchrow', name, args)
+
+    async def fetchval(self, conn, name: str, *args):
+        return await self._run(conn, 'fetchval', name, args)
+
+    async def execute(self, conn, name: str, *args):
+        # Prepared statements have no execute, their rows are simply dropped
+        await self._run(conn, 'fetch', name, args)
+
+    def format(self, limit: int = 15):
+        """Counts and latencies of the queries that took the most time in total."""
+        queries = sorted(self.queries.values(), key=lambda q: q.timings.total, reverse=True)
+        lines = []
+        for query in queries[:limit]:
+            if query.timings.count == 0:
+                break
+            s = query.timings.summary()
+            lines.append(
+                f"{query.name}: n={s['count']} errors={query.errors} mean={s['mean'] * 1000:.1f}ms "
+                f"p95={s['p95'] * 1000:.1f}ms p99={s['p99'] * 1000:.1f}ms"
+            )
+        return '\n'.join(lines) or 'No queries run yet'
+
+
+queries = QueryRegistry()
+register = queries.register
+
+
+# ===================== #
+# ======= CACHE ======= #
+# ===================== #
+
+register('load_scan_channels', "SELECT channel_id FROM scan_channels WHERE active")
+
+register('load_reviewer_channels', "SELECT user_id,channel_id FROM reviewers WHERE active")
+
+# ====================== #
+# ======= CHECKS ======= #
+# ====================== #
+
+register('has_empty_queue', "SELECT COUNT(*) FROM review_log WHERE user_id = $1")
+
+# ======================== #
+# ======= REVIEWER ======= #
+# ======================== #
+
+register(
+    'add_reviewer',
+    """
+    INSERT INTO reviewers (user_id, channel_id)
+    VALUES ($1, $2)
+    """
+)
+
+register(
+    'remove_reviewer',
+    """
+    UPDATE reviewers
+    SET active = FALSE
+    WHERE user_id = $1
+    """
+)
+
+# ===================== #
+# ======= SCORE ======= #
+# ===================== #
+
+register(
+    'get_score',
+    """
+    SELECT insult, severe_toxic, identity_hate, threat, nsfw
+    FROM scores
+    WHERE id = $1
+    """
+)
+
+register('allocate_ids', "SELECT nextval(pg_get_serial_sequence($1, 'id')) AS id FROM generate_series(1, $2)")
+
+register(
+    'insert_scores',
+    """
+    INSERT INTO scores (id, scanned_content, insult, severe_toxic, identity_hate, threat, nsfw)
+    (SELECT * FROM unnest($1::INTEGER[], $2::TEXT[], $3::REAL[], $4::REAL[], $5::REAL[], $6::REAL[], $7::REAL[]))
+    """
+)
+
+# ====================== #
+# === REVIEW MESSAGE === #
+# ====================== #
+
+register(
+    'get_review_message',
+    """
+    SELECT review_id, clean_content
+    FROM review_log INNER JOIN review_messages ON id = review_id
+    WHERE message_id = $1 AND user_id = $2 AND review_log.active
+    """
+)
+
+register(
+    'edit_review_message',
+    """
+    UPDATE review_messages
+    SET clean_content = $2, in_sanitize = FALSE
+    WHERE id = $1
+    """
+)
+
+register(
+    'delete_active_review_message',
+    """
+    DELETE FROM review_log
+    WHERE user_id = $1 AND active
+    """
+)
+
+register(
+    'insert_review_messages',
+    """
+    INSERT INTO review_messages (id, score_id, clean_content)
+    (SELECT * FROM unnest($1::INTEGER[], $2::BIGINT[], $3::TEXT[]))
+    """
+)
+
+# ====================== #
+# ==== REVIEW QUEUE ==== #
+# ====================== #
+
+register(
+    'find_empty_queues',
+    """
+    SELECT user_id, channel_id
+    FROM reviewers r
+    WHERE NOT EXISTS(
+        SELECT *
+        FROM review_log
+        WHERE user_id = r.user_id AND active
+    )
+    """
+)
+
+register('lock_reviewer', "SELECT trusted FROM reviewers WHERE user_id = $1 FOR UPDATE")
+
+register(
+    'claim_review',
+    """
+    WITH review AS (
+        SELECT id, score_id, clean_content
+        FROM review_messages r
+        WHERE active
+        AND in_sanitize = FALSE
+        AND assigned < $2
+        AND NOT EXISTS(
+            SELECT 1
+            FROM review_log
+            WHERE review_id = r.id AND user_id = $1
+        )
+        AND NOT EXISTS(
+            SELECT 1
+            FROM review_log
+            WHERE user_id = $1 AND active
+        )
+        ORDER BY id ASC
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    ), log AS (
+        INSERT INTO review_log (review_id, user_id, message_id, trusted_review)
+        SELECT id, $1, $3, $4
+        FROM review
+        RETURNING review_id
+    )
+    SELECT review.*
+    FROM review INNER JOIN log ON review_id = id
+    """
+)
+
+register(
+    'release_review',
+    """
+    DELETE FROM review_log
+    WHERE review_id = $1 AND user_id = $2 AND active
+    """
+)
+
+register(
+    'get_active_queue_messages',
+    """
+    SELECT message_id,review_log.user_id,channel_id
+    FROM review_log INNER JOIN reviewers ON review_log.user_id = reviewers.user_id
+    WHERE review_id = $1 AND review_log.active = TRUE
+    """
+)
+
+# ====================== #
+# ===== REVIEW LOG ===== #
+# ====================== #
+
+register(
+    'set_review_log_message',
+    """
+    UPDATE review_log
+    SET message_id = $3
+    WHERE review_id = $1 AND user_id = $2
+    """
+)
+
+register(
+    'remove_review_log',
+    """
+    DELETE FROM review_log
+    WHERE review_id = $1
+    """
+)
+
+# ============================= #
+# ===== REVIEW SUBMISSION ===== #
+# ============================= #
+
+register(
+    'submit_vote',
+    """
+    SELECT *
+    FROM submit_vote($1, $2, $3::SMALLINT, $4::SMALLINT, $5::SMALLINT, $6::SMALLINT, $7::SMALLINT, $8, $9, $10)
+    """
+)
+
+# ====================== #
+# ====== SANITIZE ====== #
+# ====================== #
+
+register(
+    'set_sanitize',
+    """
+    UPDATE review_messages
+    SET in_sanitize = TRUE
+    WHERE id = $1 AND active
+    RETURNING id
+    """
+)
+
+# ===================== #
+# ======= STATS ======= #
+# ===================== #
+
+register('get_total_reviews', "SELECT COUNT(*) FROM review_messages WHERE active = FALSE AND in_sanitize = FALSE")
+
+register('get_reviews_count', "SELECT COUNT(*) FROM review_log WHERE active = FALSE AND user_id = $1")
+
+register(
+    'get_deviance',
+    """
+    SELECT insult, severe_toxic, identity_hate, threat, nsfw, total
+    FROM reviewer_deviance
+    WHERE user_id = $1
+    """
+)
+
+register(
+    'get_remaining_reviews',
+    """
+    SELECT COUNT(*)
+    FROM review_messages r
+    WHERE in_sanitize = FALSE
+    AND active
+    AND assigned < $2
+    AND NOT EXISTS(
+        SELECT *
+        FROM review_log
+        WHERE user_id = $1 AND review_id = r.id AND active = FALSE
+    )
+    """
+)
+
+# The label is a parameter, a CASE picks its column from the vote and the consensus
+register(
+    'get_deviance_messages',
+    """
+    SELECT clean_content, submitted
+    FROM (
+        SELECT
+            review_id,
+            clean_content,
+            CASE $2::TEXT
+                WHEN 'insult' THEN l.insult
+                WHEN 'severe_toxic' THEN l.severe_toxic
+                WHEN 'identity_hate' THEN l.identity_hate
+                WHEN 'threat' THEN l.threat
+                WHEN 'nsfw' THEN l.nsfw
+            END AS submitted,
+            CASE $2::TEXT
+                WHEN 'insult' THEN c.insult
+                WHEN 'severe_toxic' THEN c.severe_toxic
+                WHEN 'identity_hate' THEN c.identity_hate
+                WHEN 'threat' THEN c.threat
+                WHEN 'nsfw' THEN c.nsfw
+            END AS decision
+        FROM review_log l
+        INNER JOIN review_consensus c USING (review_id)
+        INNER JOIN review_messages r ON r.id = review_id
+        WHERE l.user_id = $1
+        AND l.active = FALSE
+        AND r.in_sanitize = FALSE
+    ) votes
+    WHERE decision != submitted
+    ORDER BY review_id
+    """
+)
+
+register(
+    'get_total_remaining_reviews',
+    """
+    SELECT COUNT(*)
+    FROM review_messages r
+    WHERE in_sanitize = FALSE
+    AND active
+    """
+)
+
+register(
+    'get_stats',
+    """
+    WITH free_review_table AS (
+        SELECT id
+        FROM review_messages
+        WHERE active
+        AND NOT in_sanitize
+        AND assigned < $1
+    ), queue_table AS (
+        SELECT
+            user_id,
+            COUNT(*) FILTER (WHERE active) AS active_count,
+            COUNT(*) FILTER (WHERE review_id IN (SELECT id FROM free_review_table)) AS inactive_count
+        FROM review_log
+        WHERE active OR review_id IN (SELECT id FROM free_review_table)
+        GROUP BY user_id
+    )
+    SELECT
+        reviewer_deviance.*,
+        (SELECT COUNT(*) FROM free_review_table) + COALESCE(active_count, 0) - COALESCE(inactive_count, 0) AS remaining
+    FROM reviewers
+    INNER JOIN reviewer_deviance USING (user_id)
+    LEFT JOIN queue_table USING (user_id)
+    ORDER BY reviewers.date_created ASC
+    """
+)
+
+# ====================== #
+# ======= MODELS ======= #
+# ====================== #
+
+register(
+    'add_model',
+    """
+    INSERT INTO models (data_hash, path, row_count, train_time, metrics)
+    VALUES ($1, $2, $3, $4::REAL, $5::JSONB)
+    RETURNING version
+    """
+)
+
+register(
+    'activate_model',
+    """
+    UPDATE models
+    SET active = (version = $1)
+    WHERE active OR version = $1
+    """
+)
+
+register('get_model', "SELECT * FROM models WHERE version = $1")
+
+register('get_active_model', "SELECT * FROM models WHERE active")
+
+register(
+    'get_previous_model',
+    """
+    SELECT *
+    FROM models
+    WHERE version < (SELECT version FROM models WHERE active)
+    ORDER BY version DESC
+    """
+)
+
+register('get_models', "SELECT * FROM models ORDER BY version DESC LIMIT $1")
+
+# ====================== #
+# ====== BACKFILL ====== #
+# ====================== #
+
+register('get_backfill_checkpoint', "SELECT * FROM backfill_checkpoints WHERE channel_id = $1")
+
+register(
+    'set_backfill_checkpoint',
+    """
+    INSERT INTO backfill_checkpoints (channel_id, last_message_id, scanned, done)
+    VALUES ($1, $2, $3, $4)
+    ON CONFLICT (channel_id) DO UPDATE
+    SET last_message_id = $2, scanned = $3, done = $4, date_updated = CURRENT_TIMESTAMP
+    """
+)
+
+# ======================= #
+# ===== INFRACTIONS ===== #
+# ======================= #
+
+register(
+    'insert_infractions',
+    """
+    INSERT INTO infractions (user_id, server_id, channel_id, message_id, score_id)
+    (SELECT
+        i.user_id, i.server_id, i.channel_id, i.message_id, i.score_id
+    FROM
+        unnest($1::infractions[]) as i
+    )
+    """
+)
@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+
+from .client import InferenceClient
+from .server import InferenceServer
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+from . import InferenceServer
+from common import setup_logging
+
+
+with setup_logging():
+    InferenceServer.with_config().run()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import time
+import uuid
+
+import numpy as np
+
+from model import LABELS
+
+REQUEST_QUEUE = 'flagbot:inference'
+
+
+class InferenceClient:
+    """Sends scoring requests to the inference server over Redis and waits for the reply."""
+
+    def __init__(self, redis, timeout=30):
+        self.redis = redis
+        self.timeout = timeout
+
+    async def score(self, texts):
+        """Returns the (n_texts x n_labels) score array and the version of the model that produced it."""
+        if len(texts) == 0:
+            return np.zeros((0, len(LABELS))), None
+
+        request_id = uuid.uuid4().hex
+        request = {
+            'id': request_id,
+            'texts': list(texts),
+            # Requests nobody waits for anymore are dropped by the server
+            'deadline': time.time() + self.timeout
+        }
+        await self.redis.rpush(REQUEST_QUEUE, json.dumps(request))
+
+        reply = await self.redis.blpop(f'{REQUEST_QUEUE}:{request_id}', timeout=self.timeout)
+        if reply is None:
+            raise asyncio.TimeoutError(f'No reply from the inference server within {self.timeout} seconds')
+
+        data = json.loads(reply[1])
+        if 'error' in data:
+            raise RuntimeError(data['error'])
+        return np.array(data['scores'], dtype=float).reshape(len(request['texts']), -1), data['version']
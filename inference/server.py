@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+from functools import partial
+
+import aioredis
+import asyncpg
+import toml
+
+from common.migrations import apply_migrations
+from model import OnlineModel, ScoreCache, ToxicityModel
+from .client import REQUEST_QUEUE
+
+log = logging.getLogger(__name__)
+
+
+class InferenceServer:
+    """
+    Standalone scoring process shared by every bot process.
+
+    Requests arriving within `batch_window_ms` of each other are scored together
+    with a single model call, then the scores are split up again per request.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.settings = config.get('inference', {})
+
+        self.redis = None
+        self.db = None
+
+        self.model = None
+        self.model_key = None
+        self.cache = None
+
+        self.loop = asyncio.get_event_loop()
+
+    @classmethod
+    def with_config(cls):
+        """Create a server instance with a Config."""
+
+        with open('config.toml', 'r', encoding='utf-8') as fp:
+            data = toml.load(fp)
+
+        return cls(data)
+
+    @property
+    def online(self):
+        return self.config.get('learning_mode') == 'online'
+
+    async def start(self):
+        self.redis = await aioredis.create_redis_pool(**self.config['redis'])
+        cache_config = self.config.get('score_cache', {})
+        self.cache = ScoreCache(
+            cache_config.get('size', 50000),
+            self.redis if cache_config.get('redis') else None,
+            cache_config.get('ttl', 86400)
+        )
+        if not self.online:
+            self.db = await asyncpg.create_pool(**self.config['database'])
+            # The models table comes from a migration, the inference server may start before the bot
+            await apply_migrations(self.db)
+
+        while self.model is None:
+            await self.reload_model()
+            if self.model is None:
+                log.warning('No model available yet, retrying in 10 seconds ..')
+                await asyncio.sleep(10)
+
+        self.loop.create_task(self._watch_model())
+        await self.serve()
+
+    def run(self):
+        loop = self.loop
+
+        loop.create_task(self.start())
+
+        try:
+            loop.add_signal_handler(signal.SIGINT, loop.stop)
+            loop.add_signal_handler(signal.SIGTERM, loop.stop)
+        except RuntimeError:  # Windows
+            pass
+
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            loop.stop()
+
+    async def reload_model(self):
+        # Online models are replaced on disk after every update, batch models are switched through the registry
+        if self.online:
+            path = self.config.get('online_model_path', './input/online_model.joblib')
+            if not os.path.exists(path):
+                return
+            key, loader = os.path.getmtime(path), OnlineModel.load
+        else:
+            async with self.db.acquire() as conn:
+                record = await conn.fetchrow("SELECT version, path FROM models WHERE active")
+            if record is None:
+                return
+            key, path, loader = record['version'], record['path'], ToxicityModel.load
+
+        if key == self.model_key:
+            return
+
+        self.model = await self.loop.run_in_executor(None, loader, path)
+        self.model_key = key
+        log.info(f'Loaded model {self.model.version} from {path}.')
+
+    async def _watch_model(self):
+        while not self.loop.is_closed():
+            await asyncio.sleep(self.settings.get('model_poll_interval', 30))
+            try:
+                await self.reload_model()
+            except Exception:
+                log.exception('Failed to reload model, retrying later ..')
+
+    @staticmethod
+    def parse_request(data):
+        try:
+            request = json.loads(data)
+            if isinstance(request['id'], str) and isinstance(request['texts'], list):
+                return request
+        except (ValueError, TypeError, KeyError):
+            pass
+        log.warning(f'Dropping malformed request {data[:200]!r}')
+        return None
+
+    async def next_batch(self):
+        """Waits for a request, then keeps collecting requests until the batch window closes or the batch is full."""
+        window = self.settings.get('batch_window_ms', 25) / 1000
+        max_batch = self.settings.get('max_batch', 2000)
+
+        requests = []
+        while not requests:
+            _, data = await self.redis.blpop(REQUEST_QUEUE)
+            request = self.parse_request(data)
+            if request is not None:
+                requests.append(request)
+        size = len(requests[0]['texts'])
+
+        deadline = self.loop.time() + window
+        while size < max_batch:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                break
+            data = await self.redis.lpop(REQUEST_QUEUE)
+            if data is None:
+                await asyncio.sleep(min(remaining, 0.005))
+                continue
+            request = self.parse_request(data)
+            if request is not None:
+                requests.append(request)
+                size += len(request['texts'])
+
+        now = time.time()
+        return [r for r in requests if r.get('deadline', now) >= now]
+
+    async def reply(self, request, reply):
+        reply_key = f"{REQUEST_QUEUE}:{request['id']}"
+        await self.redis.rpush(reply_key, json.dumps(reply))
+        await self.redis.expire(reply_key, 60)
+
+    async def serve(self):
+        while self.loop.is_running():
+            requests = []
+            try:
+                requests = await self.next_batch()
+                await self.score_batch(requests)
+            except Exception:
+                log.exception(f'Failed to serve a batch of {len(requests)} requests, continuing ..')
+                # Fail the waiting clients right away instead of letting them time out
+                try:
+                    for r in requests:
+                        await self.reply(r, {'error': 'Scoring failed on the inference server'})
+                except Exception:
+                    log.exception('Failed to send error replies ..')
+                    await asyncio.sleep(1)
+
+    async def score_batch(self, requests):
+        texts = [t for r in requests for t in r['texts']]
+        if len(texts) == 0:
+            return
+
+        model = self.model
+        start = time.perf_counter()
+        scores = await self.cache.score(model.version, texts, partial(self.loop.run_in_executor, None, model.predict_proba))
+        log.info(f'Scored {len(texts)} texts from {len(requests)} requests in {time.perf_counter() - start:.3f} seconds, cache: {self.cache.format()}.')
+
+        offset = 0
+        for r in requests:
+            await self.reply(r, {'version': model.version, 'scores': scores[offset:offset + len(r['texts'])].tolist()})
+            offset += len(r['texts'])
@@ -0,0 +1,19 @@
+-- Lookups by review_id are already served by the UNIQUE(review_id, user_id) index of review_log
+
+-- Queue state of a reviewer: has_empty_queue, find_empty_queues, delete_active_review_message, get_reviews_count
+CREATE INDEX IF NOT EXISTS review_log_user_id_active_idx
+    ON review_log (user_id, active);
+
+-- Reactions resolve their review from the Discord message: get_review_message
+CREATE INDEX IF NOT EXISTS review_log_message_id_user_id_active_idx
+    ON review_log (message_id, user_id)
+    WHERE active;
+
+-- Reviews waiting for votes in queue order: pop_review_queue, get_remaining_reviews
+CREATE INDEX IF NOT EXISTS review_messages_queue_idx
+    ON review_messages (id)
+    WHERE active AND NOT in_sanitize;
+
+-- Completed reviews: get_total_reviews and the deviance queries
+CREATE INDEX IF NOT EXISTS review_messages_active_in_sanitize_idx
+    ON review_messages (active, in_sanitize);
@@ -0,0 +1,27 @@
+-- Number of review_log rows of a review, reviews are handed out until it reaches min_votes
+ALTER TABLE review_messages ADD COLUMN IF NOT EXISTS assigned INTEGER NOT NULL DEFAULT 0;
+
+UPDATE review_messages r
+SET assigned = c.count
+FROM (
+    SELECT review_id, COUNT(*)
+    FROM review_log
+    GROUP BY review_id
+) c
+WHERE r.id = c.review_id;
+
+CREATE OR REPLACE FUNCTION count_assigned_reviews() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE review_messages SET assigned = assigned + 1 WHERE id = NEW.review_id;
+        RETURN NEW;
+    END IF;
+    UPDATE review_messages SET assigned = assigned - 1 WHERE id = OLD.review_id;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS review_log_assigned ON review_log;
+CREATE TRIGGER review_log_assigned
+    AFTER INSERT OR DELETE ON review_log
+    FOR EACH ROW EXECUTE PROCEDURE count_assigned_reviews();
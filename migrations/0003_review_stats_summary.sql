@@ -0,0 +1,79 @@
+-- Consensus of every completed review, written once when the review is completed
+CREATE TABLE IF NOT EXISTS review_consensus (
+    -- Review ID
+    review_id BIGINT PRIMARY KEY REFERENCES review_messages ON DELETE CASCADE,
+
+    -- Decided labels
+    insult SMALLINT NOT NULL,
+    severe_toxic SMALLINT NOT NULL,
+    identity_hate SMALLINT NOT NULL,
+    threat SMALLINT NOT NULL,
+    nsfw SMALLINT NOT NULL,
+
+    -- Date completed
+    date_created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Completed reviews and disagreements with the consensus per label of every reviewer
+CREATE TABLE IF NOT EXISTS reviewer_stats (
+    -- User's Discord ID
+    user_id BIGINT PRIMARY KEY REFERENCES reviewers ON DELETE CASCADE,
+
+    -- Completed reviews
+    completed INTEGER NOT NULL DEFAULT 0,
+
+    -- Votes that differ from the consensus
+    insult INTEGER NOT NULL DEFAULT 0,
+    severe_toxic INTEGER NOT NULL DEFAULT 0,
+    identity_hate INTEGER NOT NULL DEFAULT 0,
+    threat INTEGER NOT NULL DEFAULT 0,
+    nsfw INTEGER NOT NULL DEFAULT 0,
+
+    -- Date of the last completed review
+    date_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Share of disagreeing votes per label and their sum in thousandths, for every reviewer
+CREATE OR REPLACE VIEW reviewer_deviance AS
+SELECT *, ((insult + severe_toxic + identity_hate + threat + nsfw) * 1000)::SMALLINT AS total
+FROM (
+    SELECT
+        user_id,
+        COALESCE(s.completed, 0) AS completed,
+        COALESCE(ROUND(s.insult::NUMERIC / NULLIF(s.completed, 0), 3), 0) AS insult,
+        COALESCE(ROUND(s.severe_toxic::NUMERIC / NULLIF(s.completed, 0), 3), 0) AS severe_toxic,
+        COALESCE(ROUND(s.identity_hate::NUMERIC / NULLIF(s.completed, 0), 3), 0) AS identity_hate,
+        COALESCE(ROUND(s.threat::NUMERIC / NULLIF(s.completed, 0), 3), 0) AS threat,
+        COALESCE(ROUND(s.nsfw::NUMERIC / NULLIF(s.completed, 0), 3), 0) AS nsfw
+    FROM reviewers LEFT JOIN reviewer_stats s USING (user_id)
+) d;
+
+-- Backfill from the reviews completed so far
+INSERT INTO review_consensus (review_id, insult, severe_toxic, identity_hate, threat, nsfw)
+SELECT 
+    review_id,
+    CASE WHEN AVG(insult) > 2/3::float THEN 1 ELSE 0 END insult,
+    CASE WHEN AVG(severe_toxic) > 2/3::float THEN 1 ELSE 0 END severe_toxic,
+    CASE WHEN AVG(identity_hate) > 2/3::float THEN 1 ELSE 0 END identity_hate,
+    CASE WHEN AVG(threat) > 2/3::float THEN 1 ELSE 0 END threat,
+    CASE WHEN AVG(nsfw) > 2/3::float THEN 1 ELSE 0 END nsfw
+FROM review_log INNER JOIN review_messages ON id = review_id 
+WHERE review_log.active = FALSE 
+AND review_messages.active = FALSE 
+AND in_sanitize = FALSE 
+GROUP BY review_id
+ON CONFLICT (review_id) DO NOTHING;
+
+INSERT INTO reviewer_stats (user_id, completed, insult, severe_toxic, identity_hate, threat, nsfw)
+SELECT
+    l.user_id,
+    COUNT(*),
+    SUM(CASE WHEN c.insult = l.insult THEN 0 ELSE 1 END),
+    SUM(CASE WHEN c.severe_toxic = l.severe_toxic THEN 0 ELSE 1 END),
+    SUM(CASE WHEN c.identity_hate = l.identity_hate THEN 0 ELSE 1 END),
+    SUM(CASE WHEN c.threat = l.threat THEN 0 ELSE 1 END),
+    SUM(CASE WHEN c.nsfw = l.nsfw THEN 0 ELSE 1 END)
+FROM review_consensus c INNER JOIN review_log l USING (review_id)
+WHERE l.user_id IS NOT NULL
+GROUP BY l.user_id
+ON CONFLICT (user_id) DO NOTHING;
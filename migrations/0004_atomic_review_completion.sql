@@ -0,0 +1,100 @@
+-- Stores the consensus of a completed review and adds its votes to the stats of its reviewers
+CREATE OR REPLACE FUNCTION update_review_stats(p_review_id BIGINT, p_min_reviews INTEGER, p_max_deviance INTEGER)
+RETURNS VOID AS $$
+    WITH consensus AS (
+        INSERT INTO review_consensus (review_id, insult, severe_toxic, identity_hate, threat, nsfw)
+        SELECT 
+            review_id,
+            CASE WHEN AVG(insult) > 2/3::float THEN 1 ELSE 0 END insult,
+            CASE WHEN AVG(severe_toxic) > 2/3::float THEN 1 ELSE 0 END severe_toxic,
+            CASE WHEN AVG(identity_hate) > 2/3::float THEN 1 ELSE 0 END identity_hate,
+            CASE WHEN AVG(threat) > 2/3::float THEN 1 ELSE 0 END threat,
+            CASE WHEN AVG(nsfw) > 2/3::float THEN 1 ELSE 0 END nsfw
+        FROM review_log
+        WHERE review_id = p_review_id
+        GROUP BY review_id
+        ON CONFLICT (review_id) DO NOTHING
+        RETURNING *
+    )
+    INSERT INTO reviewer_stats AS s (user_id, completed, insult, severe_toxic, identity_hate, threat, nsfw)
+    SELECT
+        l.user_id,
+        1,
+        CASE WHEN c.insult = l.insult THEN 0 ELSE 1 END,
+        CASE WHEN c.severe_toxic = l.severe_toxic THEN 0 ELSE 1 END,
+        CASE WHEN c.identity_hate = l.identity_hate THEN 0 ELSE 1 END,
+        CASE WHEN c.threat = l.threat THEN 0 ELSE 1 END,
+        CASE WHEN c.nsfw = l.nsfw THEN 0 ELSE 1 END
+    FROM consensus c INNER JOIN review_log l USING (review_id)
+    WHERE l.user_id IS NOT NULL
+    ON CONFLICT (user_id) DO UPDATE SET
+        completed = s.completed + EXCLUDED.completed,
+        insult = s.insult + EXCLUDED.insult,
+        severe_toxic = s.severe_toxic + EXCLUDED.severe_toxic,
+        identity_hate = s.identity_hate + EXCLUDED.identity_hate,
+        threat = s.threat + EXCLUDED.threat,
+        nsfw = s.nsfw + EXCLUDED.nsfw,
+        date_updated = CURRENT_TIMESTAMP;
+
+    -- Only the reviewers of this review have new stats
+    UPDATE reviewers
+    SET trusted = (d.completed > p_min_reviews AND d.total < p_max_deviance)
+    FROM reviewer_deviance d
+    WHERE reviewers.user_id = d.user_id
+    AND reviewers.user_id IN (SELECT user_id FROM review_log WHERE review_id = p_review_id);
+$$ LANGUAGE sql;
+
+-- Records a reviewer's vote and completes the review once it has p_min_votes votes.
+-- Returns the content and consensus of the review when this vote completed it, no row otherwise.
+CREATE OR REPLACE FUNCTION submit_vote(
+    p_review_id BIGINT,
+    p_user_id BIGINT,
+    p_insult SMALLINT,
+    p_severe_toxic SMALLINT,
+    p_identity_hate SMALLINT,
+    p_threat SMALLINT,
+    p_nsfw SMALLINT,
+    p_min_votes INTEGER,
+    p_min_reviews INTEGER,
+    p_max_deviance INTEGER
+)
+RETURNS TABLE (
+    clean_content TEXT,
+    insult SMALLINT,
+    severe_toxic SMALLINT,
+    identity_hate SMALLINT,
+    threat SMALLINT,
+    nsfw SMALLINT
+) AS $$
+#variable_conflict use_column
+DECLARE
+    votes INTEGER;
+BEGIN
+    UPDATE review_log
+    SET insult = p_insult, severe_toxic = p_severe_toxic, identity_hate = p_identity_hate, threat = p_threat, nsfw = p_nsfw, active = FALSE
+    WHERE review_id = p_review_id AND user_id = p_user_id AND active;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    -- Concurrent final votes wait for each other here, the first one completes the review
+    PERFORM 1 FROM review_messages WHERE id = p_review_id AND active FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    SELECT COUNT(*) INTO votes FROM review_log WHERE review_id = p_review_id AND active = FALSE;
+    IF votes < p_min_votes THEN
+        RETURN;
+    END IF;
+
+    UPDATE review_log SET active = FALSE WHERE review_id = p_review_id;
+    UPDATE review_messages SET active = FALSE WHERE id = p_review_id;
+    PERFORM update_review_stats(p_review_id, p_min_reviews, p_max_deviance);
+
+    RETURN QUERY
+        SELECT r.clean_content, c.insult, c.severe_toxic, c.identity_hate, c.threat, c.nsfw
+        FROM review_consensus c INNER JOIN review_messages r ON r.id = c.review_id
+        WHERE c.review_id = p_review_id;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,26 @@
+-- Registry of trained models, retrain adds versions and the inference server loads the active one
+CREATE TABLE IF NOT EXISTS models (
+    -- Model version
+    version SERIAL PRIMARY KEY,
+
+    -- Hash of the training data the model was built from
+    data_hash TEXT NOT NULL,
+
+    -- Path of the saved model artifact
+    path TEXT NOT NULL,
+
+    -- Number of rows the model was trained on
+    row_count INTEGER NOT NULL,
+
+    -- Seconds spent training
+    train_time REAL NOT NULL,
+
+    -- Per label holdout metrics
+    metrics JSONB,
+
+    -- Whether this version is the one used for scanning
+    active BOOLEAN DEFAULT false,
+
+    -- Date trained
+    date_created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
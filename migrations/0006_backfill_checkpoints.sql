@@ -0,0 +1,17 @@
+-- Progress of the backfill command per channel, so an interrupted backfill resumes where it stopped
+CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+    -- Discord channel ID
+    channel_id BIGINT PRIMARY KEY,
+
+    -- Oldest message ID scanned so far, the backfill continues with older messages
+    last_message_id BIGINT NOT NULL,
+
+    -- Number of messages scanned so far
+    scanned INTEGER NOT NULL DEFAULT 0,
+
+    -- Whether the backfill reached its message count or the start of the channel
+    done BOOLEAN DEFAULT false,
+
+    -- Date of the last checkpoint
+    date_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
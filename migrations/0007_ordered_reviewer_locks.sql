@@ -0,0 +1,53 @@
+-- Stores the consensus of a completed review and adds its votes to the stats of its reviewers
+CREATE OR REPLACE FUNCTION update_review_stats(p_review_id BIGINT, p_min_reviews INTEGER, p_max_deviance INTEGER)
+RETURNS VOID AS $$
+    -- Reviewer rows are locked in user_id order before their stats change. Claims lock a single reviewer
+    -- row and votes only lock reviewers through this function, so concurrent completions can't deadlock
+    SELECT 1
+    FROM reviewers
+    WHERE user_id IN (SELECT user_id FROM review_log WHERE review_id = p_review_id)
+    ORDER BY user_id
+    FOR UPDATE;
+
+    WITH consensus AS (
+        INSERT INTO review_consensus (review_id, insult, severe_toxic, identity_hate, threat, nsfw)
+        SELECT 
+            review_id,
+            CASE WHEN AVG(insult) > 2/3::float THEN 1 ELSE 0 END insult,
+            CASE WHEN AVG(severe_toxic) > 2/3::float THEN 1 ELSE 0 END severe_toxic,
+            CASE WHEN AVG(identity_hate) > 2/3::float THEN 1 ELSE 0 END identity_hate,
+            CASE WHEN AVG(threat) > 2/3::float THEN 1 ELSE 0 END threat,
+            CASE WHEN AVG(nsfw) > 2/3::float THEN 1 ELSE 0 END nsfw
+        FROM review_log
+        WHERE review_id = p_review_id
+        GROUP BY review_id
+        ON CONFLICT (review_id) DO NOTHING
+        RETURNING *
+    )
+    INSERT INTO reviewer_stats AS s (user_id, completed, insult, severe_toxic, identity_hate, threat, nsfw)
+    SELECT
+        l.user_id,
+        1,
+        CASE WHEN c.insult = l.insult THEN 0 ELSE 1 END,
+        CASE WHEN c.severe_toxic = l.severe_toxic THEN 0 ELSE 1 END,
+        CASE WHEN c.identity_hate = l.identity_hate THEN 0 ELSE 1 END,
+        CASE WHEN c.threat = l.threat THEN 0 ELSE 1 END,
+        CASE WHEN c.nsfw = l.nsfw THEN 0 ELSE 1 END
+    FROM consensus c INNER JOIN review_log l USING (review_id)
+    WHERE l.user_id IS NOT NULL
+    ON CONFLICT (user_id) DO UPDATE SET
+        completed = s.completed + EXCLUDED.completed,
+        insult = s.insult + EXCLUDED.insult,
+        severe_toxic = s.severe_toxic + EXCLUDED.severe_toxic,
+        identity_hate = s.identity_hate + EXCLUDED.identity_hate,
+        threat = s.threat + EXCLUDED.threat,
+        nsfw = s.nsfw + EXCLUDED.nsfw,
+        date_updated = CURRENT_TIMESTAMP;
+
+    -- Only the reviewers of this review have new stats
+    UPDATE reviewers
+    SET trusted = (d.completed > p_min_reviews AND d.total < p_max_deviance)
+    FROM reviewer_deviance d
+    WHERE reviewers.user_id = d.user_id
+    AND reviewers.user_id IN (SELECT user_id FROM review_log WHERE review_id = p_review_id);
+$$ LANGUAGE sql;
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+from .artifact import LABELS, ToxicityModel, iter_training_data, load_training_data, training_data_hash
+from .cache import ScoreCache
+from .corpus import CorpusStore
+from .online import OnlineModel
+from .text import TextNormalizer
+from .training import evaluate, train_version
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from joblib.externals.loky import get_reusable_executor
+from scipy.special import expit as sigmoid
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_selection import chi2
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import normalize
+
+from .vocab import HashedVocabulary, term_hashes
+
+log = logging.getLogger(__name__)
+
+
+LABELS = ['insult', 'severe_toxic', 'identity_hate', 'threat', 'nsfw']
+TRAIN_FILES = ['./input/new_train.csv', './input/train.csv']
+
+# Vectorizer settings shared by training and by the vectorizer rebuilt from a saved artifact
+VECTORIZER_PARAMS = dict(ngram_range=(1, 2), stop_words='english', smooth_idf=True, sublinear_tf=True)
+
+
+def training_data_hash(paths=TRAIN_FILES):
+    """Returns a sha256 digest over the contents of every existing training file."""
+    sha = hashlib.sha256()
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        sha.update(path.encode('utf-8'))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+def load_training_data(paths=TRAIN_FILES):
+    frames = [pd.read_csv(path) for path in paths if os.path.exists(path)]
+    return pd.concat(frames, axis=0, ignore_index=True)
+
+
+def iter_training_data(paths=TRAIN_FILES, chunksize=10000):
+    """Yields the training data in chunks so it never has to be held in memory at once."""
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        yield from pd.read_csv(path, chunksize=chunksize)
+
+
+def _chi2_scores(X, targets):
+    """Returns the highest chi-squared statistic of every feature against any of the labels."""
+    scores = np.zeros(X.shape[1])
+    for y in targets.T:
+        mask = ~np.isnan(y)
+        if len(np.unique(y[mask])) < 2:
+            continue
+        scores = np.fmax(scores, np.nan_to_num(chi2(X[mask], y[mask].astype(int))[0]))
+    return scores
+
+
+def _fit_label(X, y):
+    start = datetime.now()
+    # Rows without a value for this label (e.g. older training data) are left out
+    mask = ~np.isnan(y)
+    if not mask.all():
+        X, y = X[mask], y[mask]
+
+    logreg = LogisticRegression(C=12.0, solver='liblinear')
+    logreg.fit(X, y.astype(int))
+    return logreg.coef_[0], logreg.intercept_[0], (datetime.now() - start).total_seconds()
+
+
+class ToxicityModel:
+    """
+    Inference-only form of the TF-IDF + logistic regression classifier.
+
+    Only the fitted vocabulary, idf weights and per-label coefficients are kept. The
+    coefficients of all labels are stacked into one (n_features x n_labels) matrix, so
+    scoring a batch is a sparse transform followed by a single sparse-dense product.
+
+    A compact model keeps 64 bit hashes of its terms instead of the terms themselves and
+    scores with float32 weights, see `HashedVocabulary`.
+    """
+
+    def __init__(self, terms, idf, coef, intercept, labels=LABELS, data_hash=None, trained_at=None):
+        self.terms = terms
+        self.idf = idf
+        self.labels = list(labels)
+        self.data_hash = data_hash
+        self.trained_at = trained_at or datetime.now()
+        self.label_times = {}
+
+        self.compact = terms.dtype == np.uint64
+        if self.compact:
+            # Scores stay float32 end to end, a float64 intercept would upcast the whole score matrix
+            self.weights = np.ascontiguousarray(coef.T, dtype=np.float32)
+            self.intercept = np.asarray(intercept, dtype=np.float32)
+            self.vectorizer = HashedVocabulary(terms, idf, **VECTORIZER_PARAMS)
+        else:
+            self.weights = np.ascontiguousarray(coef.T)
+            self.intercept = intercept
+            self.vectorizer = TfidfVectorizer(vocabulary={t: i for i, t in enumerate(terms)}, **VECTORIZER_PARAMS)
+            self.vectorizer.idf_ = idf
+
+    @property
+    def version(self):
+        # Compact and full models trained on the same data score differently, keep their cache entries apart
+        version = (self.data_hash or 'unknown')[:12]
+        return f'{version}-c{len(self.terms)}' if self.compact else version
+
+    @property
+    def coef(self):
+        return self.weights.T
+
+    @property
+    def n_features(self):
+        return len(self.terms)
+
+    @classmethod
+    def train(cls, texts, targets, labels=LABELS, data_hash=None, n_jobs=1, compact=False, max_features=None, feature_selection='frequency'):
+        """
+        Fits the vectorizer and one classifier per label.
+
+        `texts` may be any iterable, it is only read once. `targets` is an (n_texts x n_labels)
+        float array with NaN for missing labels.
+
+        With `n_jobs` > 1 the labels are fitted in a pool of worker processes. The TF-IDF matrix
+        is memory mapped into the workers by joblib instead of being copied into each of them.
+
+        `max_features` caps the vocabulary, keeping either the most frequent terms or, with
+        `feature_selection='chi2'`, the terms most associated with any of the labels.
+        With `compact` the model is returned in its compact form.
+        """
+        by_frequency = feature_selection == 'frequency'
+        vect = TfidfVectorizer(min_df=2, max_features=max_features if by_frequency else None, **VECTORIZER_PARAMS)
+        train_X = vect.fit_transform(texts)
+        terms, idf = vect.get_feature_names_out().astype(str), vect.idf_
+
+        if max_features is not None and not by_frequency and max_features < len(terms):
+            keep = np.sort(np.argsort(-_chi2_scores(train_X, targets))[:max_features])
+            terms, idf = terms[keep], idf[keep]
+            # Rows are normalized over the kept terms only, like the vectorizer will at inference
+            train_X = normalize(train_X[:, keep])
+
+        targets = [np.ascontiguousarray(targets[:, i], dtype=float) for i in range(len(labels))]
+        if n_jobs == 1:
+            fits = [_fit_label(train_X, y) for y in targets]
+        else:
+            with Parallel(n_jobs=n_jobs, mmap_mode='r') as parallel:
+                fits = parallel(delayed(_fit_label)(train_X, y) for y in targets)
+            # Retrains are rare, don't keep idle workers (and their copy of the interpreter) around
+            get_reusable_executor().shutdown(wait=True)
+
+        model = cls(
+            term_hashes(terms) if compact else terms,
+            idf,
+            np.stack([coef for coef, _, _ in fits]),
+            np.array([intercept for _, intercept, _ in fits]),
+            labels,
+            data_hash
+        )
+        model.label_times = {label: seconds for label, (_, _, seconds) in zip(labels, fits)}
+        for label, seconds in model.label_times.items():
+            log.info(f"Training {label} took {seconds} seconds!")
+        return model
+
+    def predict_proba(self, texts):
+        """Returns an (n_texts x n_labels) array of probabilities, columns ordered as `labels`."""
+        return self.score_features(self.vectorizer.transform(texts))
+
+    def score_features(self, X):
+        """Scores rows that were already vectorized with `vectorizer`."""
+        return sigmoid(X @ self.weights + self.intercept)
+
+    def save(self, path: str):
+        meta = {
+            'labels': self.labels,
+            'data_hash': self.data_hash,
+            'trained_at': self.trained_at.isoformat(),
+        }
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Write to a temporary file first so a crash never leaves a half written artifact behind
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                terms=self.terms,
+                idf=self.idf,
+                coef=self.coef,
+                intercept=self.intercept,
+                meta=np.array(json.dumps(meta))
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            return cls(
+                data['terms'],
+                data['idf'],
+                data['coef'],
+                data['intercept'],
+                meta['labels'],
+                meta['data_hash'],
+                datetime.fromisoformat(meta['trained_at'])
+            )
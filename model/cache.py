@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from .artifact import LABELS
+
+REDIS_PREFIX = 'flagbot:score:'
+
+
+class ScoreCache:
+    """
+    Bounded LRU of label scores keyed by a hash of the model version and the cleaned text.
+
+    When a Redis connection is given, entries are also written to Redis with a TTL so every
+    process scoring with the same model version shares them.
+    """
+
+    def __init__(self, size=50000, redis=None, ttl=86400, n_labels=len(LABELS)):
+        self.size = size
+        self.redis = redis
+        self.ttl = ttl
+        self.n_labels = n_labels
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(version, text: str):
+        return hashlib.blake2b(f'{version}\0{text}'.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _remember(self, key, scores):
+        self.entries[key] = scores
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    async def get_many(self, version, texts):
+        """Returns the cache key of every text and a dict of the keys that were found."""
+        keys = [self.key(version, t) for t in texts]
+        found = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                found[key] = self.entries[key]
+            else:
+                missing.append(key)
+
+        if self.redis is not None and missing:
+            values = await self.redis.mget(*[f'{REDIS_PREFIX}{k}' for k in missing])
+            for key, value in zip(missing, values):
+                if value is None:
+                    continue
+                found[key] = np.frombuffer(value, dtype=np.float32)
+                self._remember(key, found[key])
+                self.redis_hits += 1
+
+        hits = sum(1 for k in keys if k in found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return keys, found
+
+    async def put_many(self, keys, scores):
+        scores = np.asarray(scores, dtype=np.float32)
+        for key, row in zip(keys, scores):
+            self._remember(key, row)
+
+        if self.redis is not None and len(keys) > 0:
+            tr = self.redis.pipeline()
+            for key, row in zip(keys, scores):
+                tr.setex(f'{REDIS_PREFIX}{key}', self.ttl, row.tobytes())
+            await tr.execute()
+
+    async def score(self, version, texts, scorer):
+        """
+        Returns the (n_texts x n_labels) scores of `texts`, only passing cache misses to `scorer`.
+
+        Parameters
+        ----------
+        version : str
+            Version of the model `scorer` uses, scores of other versions are never returned.
+        texts : list of str
+            Cleaned message contents.
+        scorer : coroutine function
+            Called with the list of unique texts that missed the cache, returns their score array.
+        """
+        keys, found = await self.get_many(version, texts)
+
+        misses = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                misses.setdefault(key, text)
+        if misses:
+            scores = await scorer(list(misses.values()))
+            await self.put_many(list(misses.keys()), scores)
+            found.update(zip(misses.keys(), np.asarray(scores, dtype=np.float32)))
+
+        if len(keys) == 0:
+            return np.zeros((0, self.n_labels), dtype=np.float32)
+        return np.stack([found[k] for k in keys])
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def format(self):
+        s = self.stats()
+        return f"{s['entries']} entries, hit rate {s['hit_rate']:.1%} ({s['hits']} hits of which {s['redis_hits']} from redis, {s['misses']} misses)"
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+import numpy as np
+
+from .artifact import LABELS, TRAIN_FILES, iter_training_data
+
+MANIFEST = 'manifest.json'
+# Rows appended one by one are collected here until they are written as a segment
+JOURNAL = 'journal.jsonl'
+
+
+class Segment:
+    """
+    One immutable, memory mapped slice of the corpus.
+
+    Texts are stored utf-8 encoded back to back in `text.bin`, `offsets.npy` holds the
+    n + 1 byte offsets delimiting them. Labels are stored as an (n x n_labels) uint8 matrix
+    next to a boolean matrix telling which labels are actually present for a row.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+        self.labels = np.load(os.path.join(path, 'labels.npy'), mmap_mode='r')
+        self.mask = np.load(os.path.join(path, 'mask.npy'), mmap_mode='r')
+        # Empty files can't be memory mapped
+        text_path = os.path.join(path, 'text.bin')
+        if os.path.getsize(text_path) > 0:
+            self.text = np.memmap(text_path, dtype=np.uint8, mode='r')
+        else:
+            self.text = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def text_at(self, i: int):
+        return self.text[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def texts(self, start=0, stop=None):
+        stop = len(self) if stop is None else stop
+        for i in range(start, stop):
+            yield self.text_at(i)
+
+    def targets(self, start=0, stop=None):
+        """Returns the labels of rows `start:stop` as floats, NaN where a label is missing."""
+        targets = np.asarray(self.labels[start:stop], dtype=float)
+        targets[~np.asarray(self.mask[start:stop])] = np.nan
+        return targets
+
+    @staticmethod
+    def write(path: str, texts, targets):
+        """Writes a new segment to `path`, `targets` is an (n x n_labels) float array with NaN for missing labels."""
+        targets = np.asarray(targets, dtype=float).reshape(len(texts), -1)
+        encoded = [t.encode('utf-8') for t in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+
+        mask = ~np.isnan(targets)
+        os.makedirs(path)
+        with open(os.path.join(path, 'text.bin'), 'wb') as f:
+            for b in encoded:
+                f.write(b)
+        np.save(os.path.join(path, 'offsets.npy'), offsets)
+        np.save(os.path.join(path, 'labels.npy'), np.where(mask, targets, 0).astype(np.uint8))
+        np.save(os.path.join(path, 'mask.npy'), mask)
+
+
+class CorpusStore:
+    """
+    Append-only training corpus stored as columnar binary segments.
+
+    The manifest lists the segments in order and is only ever replaced atomically, so readers
+    (e.g. the training process) always see a consistent set of segments. Bulk appends become new
+    segments right away. Completed reviews arrive one at a time and are journaled first, they are
+    written as one segment once `flush_rows` of them are waiting or the oldest waited `flush_interval`
+    seconds. Once there are more than `max_segments`, the small segments at the end are merged. Merged
+    segments stay on disk for `retain_seconds`, for readers that loaded the manifest before the merge.
+    """
+
+    def __init__(self, path: str, labels=LABELS, max_segments=32, flush_rows=500, flush_interval=600, retain_seconds=86400):
+        self.path = path
+        self.labels = list(labels)
+        self.max_segments = max_segments
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.retain_seconds = retain_seconds
+        self.segments = []
+        # Merged segments no longer in the manifest by name, with the time they were merged
+        self.retired = {}
+        self.next_id = 0
+        # Journaled rows, counted when the journal is first written to by this process
+        self.journaled = None
+        self.journaled_since = None
+        self.lock = threading.Lock()
+        self.reload()
+
+    @staticmethod
+    def exists(path: str):
+        return os.path.exists(os.path.join(path, MANIFEST))
+
+    def reload(self):
+        manifest_path = os.path.join(self.path, MANIFEST)
+        if not os.path.exists(manifest_path):
+            self.segments = []
+            return
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['labels'] != self.labels:
+            raise ValueError(f"Corpus at {self.path} has labels {manifest['labels']}, expected {self.labels}")
+        self.next_id = manifest['next_id']
+        self.retired = manifest.get('retired', {})
+        self.segments = [Segment(os.path.join(self.path, name)) for name in manifest['segments']]
+
+    def _write_manifest(self, names):
+        manifest = {'labels': self.labels, 'segments': names, 'next_id': self.next_id, 'retired': self.retired}
+        tmp_path = os.path.join(self.path, f'{MANIFEST}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(self.path, MANIFEST))
+
+    def _new_segment(self, texts, targets):
+        name = f'{self.next_id:06d}'
+        self.next_id += 1
+        Segment.write(os.path.join(self.path, name), texts, targets)
+        return name
+
+    def __len__(self):
+        return sum(len(s) for s in self.segments)
+
+    def append(self, texts, targets):
+        """
+        Appends rows as a new segment.
+
+        Parameters
+        ----------
+        texts : list of str
+            Message contents.
+        targets : array-like
+            (n_texts x n_labels) label values, columns ordered as `labels`, NaN where a label is missing.
+        """
+        with self.lock:
+            self._recover()
+            self._append(texts, targets)
+
+    def _append(self, texts, targets, name=None):
+        os.makedirs(self.path, exist_ok=True)
+        if name is None:
+            name = self._new_segment(texts, targets)
+        self._write_manifest([os.path.basename(s.path) for s in self.segments] + [name])
+        self.reload()
+        if len(self.segments) > self.max_segments:
+            self._compact(self._tail_start())
+        else:
+            self._collect(time.time())
+
+    def _tail_start(self):
+        """
+        Start of the segments to merge: at least the last two, plus every segment before them that
+        isn't larger than everything after it. Rows are rewritten about log(n) times this way.
+        """
+        start = len(self.segments) - 2
+        total = sum(len(s) for s in self.segments[start:])
+        while start > 1 and len(self.segments[start - 1]) <= total:
+            start -= 1
+            total += len(self.segments[start])
+        return max(start, 1)
+
+    def append_rows(self, rows):
+        """Journals completed reviews, each a dict with a `message` and a `score` mapping labels to values."""
+        with self.lock:
+            self._recover()
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, JOURNAL), 'a', encoding='utf-8') as f:
+                for r in rows:
+                    f.write(json.dumps({'message': r['message'], 'score': r['score']}) + '\n')
+            if self.journaled == 0:
+                self.journaled_since = time.monotonic()
+            self.journaled += len(rows)
+            if self.journaled >= self.flush_rows or time.monotonic() - self.journaled_since >= self.flush_interval:
+                self._flush()
+
+    def journal_len(self):
+        """Number of rows waiting in the journal."""
+        with self.lock:
+            self._recover()
+            return self.journaled
+
+    def flush(self):
+        """Writes the journaled rows as a segment, e.g. before training on the corpus."""
+        with self.lock:
+            self._recover()
+            if self.journaled:
+                self._flush()
+
+    def _flush(self):
+        # The journal is renamed after the segment it becomes, new rows go to a fresh journal
+        name = f'{self.next_id:06d}'
+        self.next_id += 1
+        rotated = os.path.join(self.path, f'{JOURNAL}.{name}')
+        os.replace(os.path.join(self.path, JOURNAL), rotated)
+        self.journaled, self.journaled_since = 0, None
+        self._flush_journal(rotated, name)
+
+    def _flush_journal(self, rotated, name):
+        with open(rotated, 'r', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        if rows:
+            targets = [[r['score'].get(label, np.nan) for label in self.labels] for r in rows]
+            Segment.write(os.path.join(self.path, name), [r['message'] for r in rows], np.array(targets, dtype=float))
+            self._append(None, None, name)
+        os.remove(rotated)
+
+    def _recover(self):
+        """Finishes flushes a previous process was interrupted in and counts the journaled rows."""
+        if self.journaled is not None:
+            return
+        listed = {os.path.basename(s.path) for s in self.segments}
+        prefix = f'{JOURNAL}.'
+        for file in sorted(os.listdir(self.path)) if os.path.exists(self.path) else []:
+            if not file.startswith(prefix):
+                continue
+            name = file[len(prefix):]
+            rotated = os.path.join(self.path, file)
+            if name in listed:
+                # The segment made it into the manifest, only removing the journal was left
+                os.remove(rotated)
+                continue
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+            self.next_id = max(self.next_id, int(name) + 1)
+            self._flush_journal(rotated, name)
+
+        journal = os.path.join(self.path, JOURNAL)
+        self.journaled = 0
+        if os.path.exists(journal):
+            with open(journal, 'r', encoding='utf-8') as f:
+                self.journaled = sum(1 for line in f if line.strip())
+        self.journaled_since = time.monotonic() if self.journaled else None
+
+    def compact(self, start=0):
+        """Merges the segments from `start` onwards into a single segment, journaled rows are left alone."""
+        with self.lock:
+            self._compact(start)
+
+    def _compact(self, start):
+        merged, kept = self.segments[start:], self.segments[:start]
+        if len(merged) < 2:
+            return
+        texts = [t for s in merged for t in s.texts()]
+        targets = np.concatenate([s.targets() for s in merged])
+        name = self._new_segment(texts, targets)
+        now = time.time()
+        # A training process may have read the old manifest without having opened every segment yet
+        self.retired.update((os.path.basename(s.path), now) for s in merged)
+        self._write_manifest([os.path.basename(s.path) for s in kept] + [name])
+        self.reload()
+        self._collect(now)
+
+    def _collect(self, now):
+        """Deletes merged segments retired for longer than `retain_seconds`."""
+        expired = [name for name, retired in self.retired.items() if now - retired >= self.retain_seconds]
+        if not expired:
+            return
+        for name in expired:
+            del self.retired[name]
+        self._write_manifest([os.path.basename(s.path) for s in self.segments])
+        for name in expired:
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    def texts(self):
+        for s in self.segments:
+            yield from s.texts()
+
+    def text_at(self, i: int):
+        for s in self.segments:
+            if i < len(s):
+                return s.text_at(i)
+            i -= len(s)
+        raise IndexError(i)
+
+    def targets(self):
+        if not self.segments:
+            return np.zeros((0, len(self.labels)))
+        return np.concatenate([s.targets() for s in self.segments])
+
+    def iter_chunks(self, chunksize=10000):
+        """Yields (texts, labels) chunks, labels mapping every label to its column, like `iter_training_data`."""
+        for s in self.segments:
+            for start in range(0, len(s), chunksize):
+                stop = min(start + chunksize, len(s))
+                targets = s.targets(start, stop)
+                yield list(s.texts(start, stop)), {label: targets[:, i] for i, label in enumerate(self.labels)}
+
+    def data_hash(self):
+        """Segments are immutable, so their names and sizes identify the data they contain."""
+        sha = hashlib.sha256()
+        for s in self.segments:
+            sha.update(f'{os.path.basename(s.path)}:{len(s)}:{s.offsets[-1]}\n'.encode('utf-8'))
+        return sha.hexdigest()
+
+    @classmethod
+    def convert(cls, path: str, csv_paths=TRAIN_FILES, labels=LABELS, chunksize=100000):
+        """Builds a store at `path` from the training CSVs, oldest data first."""
+        if cls.exists(path):
+            raise FileExistsError(f'A corpus already exists at {path}')
+        # Nothing reads the store while it is built, merged segments can go right away
+        store = cls(path, labels, retain_seconds=0)
+        for csv_path in reversed(csv_paths):
+            for chunk in iter_training_data([csv_path], chunksize):
+                targets = chunk.reindex(columns=labels).to_numpy(dtype=float)
+                store.append(chunk.comment_text.fillna('').astype(str).tolist(), targets)
+        store.compact()
+        return store
+
+
+if __name__ == '__main__':
+    # python -m model.corpus [corpus path] [csv files ...]
+    target = sys.argv[1] if len(sys.argv) > 1 else './input/corpus'
+    sources = sys.argv[2:] or TRAIN_FILES
+    corpus = CorpusStore.convert(target, sources)
+    print(f'Converted {len(corpus)} rows from {", ".join(sources)} into {target}')
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import copy
+import hashlib
+import os
+from datetime import datetime
+
+import joblib
+import numpy as np
+from scipy.special import expit as sigmoid
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+
+from .artifact import LABELS
+
+
+class OnlineModel:
+    """
+    Incrementally trained classifier for the online learning mode.
+
+    Texts are mapped into a fixed hashed feature space, so new reviews can be folded
+    into the per-label classifiers with `partial_fit` without ever refitting a vocabulary.
+    """
+
+    def __init__(self, labels=LABELS, n_features=2 ** 18, alpha=1e-5):
+        self.labels = list(labels)
+        self.vectorizer = HashingVectorizer(
+            ngram_range=(1, 2),
+            stop_words='english',
+            alternate_sign=False,
+            n_features=n_features
+        )
+        self.classifiers = {label: SGDClassifier(loss='log_loss', alpha=alpha) for label in self.labels}
+        self.rows_seen = 0
+        self.trained_at = datetime.now()
+        self._stack()
+
+    @property
+    def version(self):
+        # Scores are cached by version, models with the same row count may still have different weights
+        return f'online-{self.rows_seen}-{self.weights_hash}'
+
+    def partial_fit(self, texts, labels):
+        """
+        Folds a batch of labelled texts into every classifier.
+
+        Parameters
+        ----------
+        texts : list of str
+            Cleaned message contents.
+        labels : mapping
+            Maps every label to a sequence of 0/1 values aligned with `texts`, missing values may be NaN.
+        """
+        X = self.vectorizer.transform(texts)
+        for label, clf in self.classifiers.items():
+            y = np.asarray(labels[label], dtype=float)
+            mask = ~np.isnan(y)
+            if not mask.any():
+                continue
+            clf.partial_fit(X[mask], y[mask].astype(int), classes=[0, 1])
+
+        self.rows_seen += len(texts)
+        self.trained_at = datetime.now()
+        self._stack()
+
+    def _stack(self):
+        # Labels without any training data yet score 0
+        self.weights = np.zeros((self.vectorizer.n_features, len(self.labels)))
+        self.intercept = np.full(len(self.labels), -np.inf)
+        for i, clf in enumerate(self.classifiers.values()):
+            if hasattr(clf, 'coef_'):
+                self.weights[:, i] = clf.coef_[0]
+                self.intercept[i] = clf.intercept_[0]
+        self.weights_hash = self._hash_weights()
+
+    def _hash_weights(self):
+        sha = hashlib.sha1(self.weights.tobytes())
+        sha.update(self.intercept.tobytes())
+        return sha.hexdigest()[:12]
+
+    def updated(self, texts, labels):
+        """Returns a copy of this model with the batch folded in, leaving the live model untouched."""
+        model = copy.deepcopy(self)
+        model.partial_fit(texts, labels)
+        return model
+
+    def predict_proba(self, texts):
+        """Returns an (n_texts x n_labels) array of probabilities, columns ordered as `labels`."""
+        return self.score_features(self.vectorizer.transform(texts))
+
+    def score_features(self, X):
+        """Scores rows that were already vectorized with `vectorizer`."""
+        return sigmoid(X @ self.weights + self.intercept)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        joblib.dump(self, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        model = joblib.load(path)
+        # Saved before versions included the weights
+        if not hasattr(model, 'weights_hash'):
+            model.weights_hash = model._hash_weights()
+        return model
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import re
+
+
+# Discord markup and contractions are rewritten in a single pass, the named group tells which rule matched
+TOKENS = re.compile(
+    r"(?P<url>https?://(?:[a-zA-Z]|[0-9]|[#-_]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+)"
+    r"|(?P<emoji><a?:\w{2,32}:\d{15,21}>)"
+    r"|(?P<user><@!?\d{15,21}>)"
+    r"|(?P<role><@&\d{15,21}>)"
+    r"|(?P<channel><#\d{15,21}>)"
+    r"|(?P<contraction>what's|can't|i'm|'s|'ve|'re|'d|'ll|')"
+)
+NON_WORD = re.compile(r"\W+")
+
+REPLACEMENTS = {
+    'url': "__url__",
+    'emoji': "",
+    'user': "__user__",
+    'role': "__role__",
+    'channel': "__channel__",
+}
+CONTRACTIONS = {
+    "what's": "what is",
+    "can't": "cannot",
+    "i'm": "i am",
+    "'s": "",
+    "'ve": " have",
+    "'re": " are",
+    "'d": " would",
+    "'ll": " will",
+    "'": "",
+}
+
+
+def _replace(match):
+    kind = match.lastgroup
+    if kind == 'contraction':
+        return CONTRACTIONS[match.group()]
+    return REPLACEMENTS[kind]
+
+
+class TextNormalizer:
+    """
+    Normalizes message contents before they are vectorized.
+
+    All patterns are compiled once. The blacklist is compiled into a single alternation which
+    is only rebuilt when `set_blacklist` is called with a different list of phrases.
+    """
+
+    def __init__(self, blacklist=()):
+        self.blacklist = None
+        self._phrases = None
+        self.set_blacklist(blacklist)
+
+    def set_blacklist(self, phrases):
+        phrases = tuple(phrases)
+        if phrases == self._phrases:
+            return
+        self._phrases = phrases
+        # Phrases are regular expressions, keep them grouped so alternation doesn't change their meaning
+        self.blacklist = re.compile('|'.join(f'(?:{p})' for p in phrases), re.IGNORECASE) if phrases else None
+
+    def clean(self, text: str):
+        if self.blacklist is not None:
+            text = self.blacklist.sub("__name__", text)
+
+        text = TOKENS.sub(_replace, text.lower())
+        text = NON_WORD.sub(' ', text).strip(' ')
+
+        # If text only includes one word, return empty str
+        return text if ' ' in text else ""
+
+    def clean_many(self, texts):
+        """Cleans a batch of texts, repeated texts within the batch are only normalized once."""
+        cleaned = {}
+        results = []
+        for text in texts:
+            if text not in cleaned:
+                cleaned[text] = self.clean(text)
+            results.append(cleaned[text])
+        return results
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+
+import numpy as np
+from sklearn.metrics import f1_score, roc_auc_score
+
+from .artifact import LABELS, TRAIN_FILES, ToxicityModel, load_training_data, training_data_hash
+from .corpus import CorpusStore
+
+
+def evaluate(model: ToxicityModel, texts, targets, threshold=0.5):
+    """Computes per-label ROC AUC and F1 (at `threshold`) on a holdout set."""
+    probabilities = model.predict_proba(texts)
+    metrics = {}
+    for i, label in enumerate(model.labels):
+        y = targets[:, i]
+        mask = ~np.isnan(y)
+        y, p = y[mask].astype(int), probabilities[mask, i]
+        # AUC is undefined when the holdout only contains one class
+        if len(np.unique(y)) < 2:
+            continue
+        metrics[label] = {
+            'auc': round(float(roc_auc_score(y, p)), 4),
+            'f1': round(float(f1_score(y, p > threshold)), 4)
+        }
+    return metrics
+
+
+def train_version(path: str, labels=LABELS, holdout=0.1, n_jobs=1, paths=TRAIN_FILES, corpus_path=None, **model_options):
+    """
+    Trains and saves a new model version, meant to be run in a separate process.
+
+    A random `holdout` fraction of the training data is kept aside to compute the metrics
+    stored in the model registry. The data is read from the corpus store at `corpus_path`
+    when it exists, from the CSV files in `paths` otherwise. Returns the registry row for
+    the new version along with the wall time spent fitting every label. `model_options`
+    are passed on to `ToxicityModel.train`.
+    """
+    start = datetime.now()
+    if corpus_path is not None and CorpusStore.exists(corpus_path):
+        corpus = CorpusStore(corpus_path, labels)
+        data_hash = corpus.data_hash()
+        targets = corpus.targets()
+        text_at = corpus.text_at
+        row_count = len(corpus)
+    else:
+        data_hash = training_data_hash(paths)
+        train_df = load_training_data(paths)
+        targets = train_df.reindex(columns=labels).to_numpy(dtype=float)
+        text_at = train_df.comment_text.to_numpy().__getitem__
+        row_count = len(train_df)
+
+    order = np.random.RandomState(0).permutation(row_count)
+    n_holdout = int(row_count * holdout)
+    test_rows, fit_rows = order[:n_holdout], order[n_holdout:]
+
+    # Texts are decoded lazily, the memory mapped corpus is never copied into one big list
+    model = ToxicityModel.train((text_at(i) for i in fit_rows), targets[fit_rows], labels, data_hash, n_jobs, **model_options)
+    metrics = evaluate(model, [text_at(i) for i in test_rows], targets[test_rows]) if n_holdout > 0 else {}
+    model.save(path)
+
+    return {
+        'data_hash': data_hash,
+        'path': path,
+        'row_count': len(fit_rows),
+        'train_time': (datetime.now() - start).total_seconds(),
+        'metrics': metrics,
+        'label_times': model.label_times
+    }
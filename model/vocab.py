@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfTransformer, TfidfVectorizer
+from sklearn.utils import murmurhash3_32
+
+
+def term_hash(term: str):
+    # Two differently seeded 32 bit hashes, collisions within a vocabulary are practically impossible
+    return (murmurhash3_32(term, 0, True) << 32) | murmurhash3_32(term, 1, True)
+
+
+def term_hashes(terms):
+    return np.fromiter((term_hash(t) for t in terms), dtype=np.uint64, count=len(terms))
+
+
+class HashedVocabulary:
+    """
+    TF-IDF vectorizer over a fixed vocabulary stored as 64 bit term hashes.
+
+    The vocabulary is a sorted array of hashes next to the column every hash maps to, terms
+    are looked up with a binary search instead of a dict of Python strings. Output is float32.
+    """
+
+    def __init__(self, hashes, idf, **params):
+        order = np.argsort(hashes, kind='stable')
+        self.hashes = np.ascontiguousarray(hashes[order])
+        self.columns = order.astype(np.int32)
+        self.analyzer = TfidfVectorizer(**params).build_analyzer()
+        self.transformer = TfidfTransformer(
+            norm='l2',
+            smooth_idf=params.get('smooth_idf', True),
+            sublinear_tf=params.get('sublinear_tf', False)
+        )
+        self.transformer.idf_ = np.asarray(idf, dtype=np.float32)
+
+    @property
+    def nbytes(self):
+        return self.hashes.nbytes + self.columns.nbytes + self.transformer.idf_.nbytes
+
+    def counts(self, texts):
+        indptr = [0]
+        hashes = []
+        # Terms repeat a lot within a batch, each distinct term is only hashed once
+        batch_hashes = {}
+        for text in texts:
+            for term in self.analyzer(text):
+                h = batch_hashes.get(term)
+                if h is None:
+                    h = batch_hashes[term] = term_hash(term)
+                hashes.append(h)
+            indptr.append(len(hashes))
+        hashes = np.array(hashes, dtype=np.uint64)
+        indptr = np.array(indptr, dtype=np.int64)
+
+        # Tokens outside the vocabulary are dropped, the row of every kept token follows from indptr
+        positions = np.minimum(np.searchsorted(self.hashes, hashes), max(len(self.hashes) - 1, 0))
+        known = self.hashes[positions] == hashes if len(self.hashes) else np.zeros(len(hashes), dtype=bool)
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))[known]
+
+        X = sp.csr_matrix(
+            (np.ones(known.sum(), dtype=np.float32), (rows, self.columns[positions[known]])),
+            shape=(len(indptr) - 1, len(self.hashes)),
+            dtype=np.float32
+        )
+        X.sum_duplicates()
+        return X
+
+    def transform(self, texts):
+        return self.transformer.transform(self.counts(texts))
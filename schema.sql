@@ -119,4 +119,4 @@ CREATE TABLE IF NOT EXISTS review_log (
 
     -- Date created
     date_created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
\ No newline at end of file
+);
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import numpy as np
+
+from model.cache import REDIS_PREFIX, ScoreCache
+
+
+class Scorer:
+    """Scores every text with its length in the first column and records what it was asked for."""
+
+    def __init__(self, n_labels=5):
+        self.n_labels = n_labels
+        self.calls = []
+
+    async def __call__(self, texts):
+        self.calls.append(list(texts))
+        scores = np.zeros((len(texts), self.n_labels))
+        scores[:, 0] = [len(t) for t in texts]
+        return scores
+
+
+class Redis:
+    """The part of the aioredis interface the cache uses, backed by a dict."""
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    async def mget(self, *keys):
+        return [self.data.get(k) for k in keys]
+
+    def pipeline(self):
+        return self
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+        self.ttls[key] = ttl
+
+    async def execute(self):
+        pass
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_only_misses_reach_the_scorer():
+    cache, scorer = ScoreCache(), Scorer()
+    run(cache.score('v1', ['a', 'bb'], scorer))
+    scores = run(cache.score('v1', ['bb', 'ccc', 'a'], scorer))
+    assert scorer.calls == [['a', 'bb'], ['ccc']]
+    assert scores[:, 0].tolist() == [2, 3, 1]
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 3
+
+
+def test_repeated_texts_are_scored_once():
+    cache, scorer = ScoreCache(), Scorer()
+    scores = run(cache.score('v1', ['a', 'a', 'bb', 'a'], scorer))
+    assert scorer.calls == [['a', 'bb']]
+    assert scores[:, 0].tolist() == [1, 1, 2, 1]
+
+
+def test_versions_are_kept_apart():
+    cache, scorer = ScoreCache(), Scorer()
+    run(cache.score('v1', ['a'], scorer))
+    run(cache.score('v2', ['a'], scorer))
+    assert scorer.calls == [['a'], ['a']]
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache, scorer = ScoreCache(size=2), Scorer()
+    run(cache.score('v1', ['a', 'bb'], scorer))
+    # Touching a makes bb the least recently used entry
+    run(cache.score('v1', ['a'], scorer))
+    run(cache.score('v1', ['ccc'], scorer))
+    run(cache.score('v1', ['a', 'bb'], scorer))
+    assert scorer.calls[-1] == ['bb']
+    assert len(cache.entries) == 2
+
+
+def test_scores_are_float32():
+    cache, scorer = ScoreCache(), Scorer()
+    assert run(cache.score('v1', ['a'], scorer)).dtype == np.float32
+    assert run(cache.score('v1', ['a'], scorer)).dtype == np.float32
+
+
+def test_no_texts():
+    cache, scorer = ScoreCache(n_labels=5), Scorer()
+    assert run(cache.score('v1', [], scorer)).shape == (0, 5)
+    assert scorer.calls == []
+
+
+def test_entries_are_shared_through_redis():
+    redis = Redis()
+    first, second, scorer = ScoreCache(redis=redis, ttl=60), ScoreCache(redis=redis), Scorer()
+    run(first.score('v1', ['a', 'bb'], scorer))
+    assert all(k.startswith(REDIS_PREFIX) for k in redis.data)
+    assert set(redis.ttls.values()) == {60}
+
+    scores = run(second.score('v1', ['bb', 'a'], scorer))
+    assert scorer.calls == [['a', 'bb']]
+    assert scores[:, 0].tolist() == [2, 1]
+    assert second.stats()['redis_hits'] == 2
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+import pytest
+
+from model.corpus import JOURNAL, CorpusStore
+
+LABELS = ['insult', 'threat']
+
+
+def review(i, insult=1):
+    return {'message': f'message {i}', 'score': {'insult': insult, 'threat': 0}}
+
+
+def segment_names(store):
+    return [os.path.basename(s.path) for s in store.segments]
+
+
+def test_rows_round_trip(tmp_path):
+    store = CorpusStore(str(tmp_path), LABELS)
+    store.append(['first', 'zweite ünicode', ''], [[1, 0], [0, np.nan], [np.nan, np.nan]])
+
+    reopened = CorpusStore(str(tmp_path), LABELS)
+    assert len(reopened) == 3
+    assert list(reopened.texts()) == ['first', 'zweite ünicode', '']
+    assert reopened.text_at(1) == 'zweite ünicode'
+    np.testing.assert_array_equal(reopened.targets(), [[1, 0], [0, np.nan], [np.nan, np.nan]])
+
+
+def test_chunks_map_labels_to_columns(tmp_path):
+    store = CorpusStore(str(tmp_path), LABELS)
+    store.append([f't{i}' for i in range(5)], [[i % 2, 0] for i in range(5)])
+    chunks = list(store.iter_chunks(chunksize=2))
+    assert [texts for texts, _ in chunks] == [['t0', 't1'], ['t2', 't3'], ['t4']]
+    assert chunks[0][1]['insult'].tolist() == [0, 1]
+
+
+def test_labels_must_match(tmp_path):
+    CorpusStore(str(tmp_path), LABELS).append(['text'], [[1, 0]])
+    with pytest.raises(ValueError):
+        CorpusStore(str(tmp_path), ['insult'])
+
+
+def test_reviews_are_journaled_until_flush_rows(tmp_path):
+    store = CorpusStore(str(tmp_path), LABELS, flush_rows=3)
+    store.append_rows([review(0)])
+    store.append_rows([review(1)])
+    assert len(store) == 0
+    assert store.journal_len() == 2
+
+    store.append_rows([review(2)])
+    assert len(store) == 3
+    assert len(store.segments) == 1
+    assert store.journal_len() == 0
+    assert not os.path.exists(tmp_path / JOURNAL)
+
+
+def test_flush_writes_journaled_reviews(tmp_path):
+    store = CorpusStore(str(tmp_path), LABELS, flush_rows=100)
+    store.append_rows([review(0, insult=0), review(1)])
+    store.flush()
+    assert list(store.texts()) == ['message 0', 'message 1']
+    assert store.targets()[:, 0].tolist() == [0, 1]
+    # Nothing left to flush
+    store.flush()
+    assert len(store.segments) == 1
+
+
+def test_journal_survives_a_restart(tmp_path):
+    CorpusStore(str(tmp_path), LABELS, flush_rows=100).append_rows([review(0), review(1)])
+    store = CorpusStore(str(tmp_path), LABELS, flush_rows=3)
+    assert store.journal_len() == 2
+    store.append_rows([review(2)])
+    assert list(store.texts()) == ['message 0', 'message 1', 'message 2']
+
+
+def test_interrupted_flush_before_the_manifest_is_redone(tmp_path):
+    store = CorpusStore(str(tmp_path), LABELS, flush_rows=100)
+    store.append_rows([review(0), review(1)])
+    # Crash right after the journal was renamed for segment 000005
+    os.replace(tmp_path / JOURNAL, tmp_path / f'{JOURNAL}.000005')
+    os.makedirs(tmp_path / '000005')
+
+    store = CorpusStore(str(tmp_path), LABELS)
+    store.flush()
+    assert list(store.texts()) == ['message 0', 'message 1']
+    assert sorted(os.listdir(tmp_path)) == ['000005', 'manifest.json']
+
+
+def test_interrupted_flush_after_the_manifest_isnt_duplicated(tmp_path):
+    store = CorpusStore(str(tmp_path), LABELS, flush_rows=100)
+    store.append_rows([review(0), review(1)])
+    with open(tmp_path / JOURNAL, 'rb') as f:
+        journal = f.read()
+    store.flush()
+    # Crash before the flushed journal was removed
+    with open(tmp_path / f'{JOURNAL}.{segment_names(store)[0]}', 'wb') as f:
+        f.write(journal)
+
+    store = CorpusStore(str(tmp_path), LABELS)
+    store.append_rows([review(2)])
+    store.flush()
+    assert list(store.texts()) == ['message 0', 'message 1', 'message 2']
+
+
+def test_compaction_merges_the_small_tail(tmp_path):
+    store = CorpusStore(str(tmp_path), LABELS, max_segments=4, flush_rows=1)
+    store.append([f'base {i}' for i in range(100)], np.zeros((100, 2)))
+    base = segment_names(store)[0]
+    for i in range(20):
+        store.append_rows([review(i)])
+        assert len(store.segments) <= 4
+        # The large first segment is never rewritten
+        assert segment_names(store)[0] == base
+
+    assert len(store) == 120
+    assert list(store.texts())[100:] == [f'message {i}' for i in range(20)]
+
+
+def test_compaction_rewrites_rows_a_bounded_number_of_times(tmp_path):
+    store = CorpusStore(str(tmp_path), LABELS, max_segments=4, flush_rows=1)
+    store.append(['base'], [[0, 0]])
+    rewritten = 0
+    for i in range(64):
+        before = set(segment_names(store))
+        store.append_rows([review(i)])
+        rewritten += sum(len(s) for s in store.segments if os.path.basename(s.path) not in before) - 1
+    # Merging everything after the first segment on every compaction rewrites about 700 rows here
+    assert rewritten < 64 * 5
+
+
+def test_merged_segments_are_kept_for_readers(tmp_path):
+    store = CorpusStore(str(tmp_path), LABELS, max_segments=2, flush_rows=1, retain_seconds=3600)
+    for i in range(4):
+        store.append_rows([review(i)])
+    assert store.retired
+    # A reader that loaded the manifest before the merge can still open its segments
+    for name in store.retired:
+        assert os.path.exists(tmp_path / name)
+
+    store.retain_seconds = 0
+    store.append_rows([review(4)])
+    assert not store.retired
+    on_disk = {n for n in os.listdir(tmp_path) if n.isdigit()}
+    assert on_disk == set(segment_names(store))
+    assert list(store.texts()) == [f'message {i}' for i in range(5)]
+
+
+def test_convert_removes_merged_segments(tmp_path):
+    csv = tmp_path / 'train.csv'
+    csv.write_text('comment_text,insult\nhello there,0\nyou idiot,1\n', encoding='utf-8')
+    store = CorpusStore.convert(str(tmp_path / 'corpus'), [str(csv)], LABELS, chunksize=1)
+    assert list(store.texts()) == ['hello there', 'you idiot']
+    assert np.isnan(store.targets()[:, 1]).all()
+    assert len(store.segments) == 1
+    assert [n for n in os.listdir(tmp_path / 'corpus') if n.isdigit()] == segment_names(store)
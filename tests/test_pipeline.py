@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from utils.pipeline import Pipeline
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def add(item):
+    return item + 1
+
+
+async def double(item):
+    return item * 2
+
+
+def test_items_go_through_every_stage():
+    async def main():
+        pipeline = Pipeline().add_stage('add', add).add_stage('double', double)
+        pipeline.start()
+        try:
+            futures = [await pipeline.submit(i) for i in range(5)]
+            return await asyncio.gather(*futures)
+        finally:
+            pipeline.stop()
+
+    assert run(main()) == [2, 4, 6, 8, 10]
+
+
+def test_none_ends_an_item_early():
+    seen = []
+
+    async def skip_odd(item):
+        return None if item % 2 else item
+
+    async def record(item):
+        seen.append(item)
+        return item
+
+    async def main():
+        pipeline = Pipeline().add_stage('skip', skip_odd).add_stage('record', record)
+        pipeline.start()
+        try:
+            return await asyncio.gather(*[await pipeline.submit(i) for i in range(4)])
+        finally:
+            pipeline.stop()
+
+    assert run(main()) == [0, None, 2, None]
+    assert seen == [0, 2]
+
+
+def test_failures_resolve_the_future_and_the_stage_keeps_working():
+    async def fail_on_two(item):
+        if item == 2:
+            raise ValueError(item)
+        return item
+
+    async def main():
+        pipeline = Pipeline().add_stage('fail', fail_on_two).add_stage('add', add)
+        pipeline.start()
+        try:
+            futures = [await pipeline.submit(i) for i in range(4)]
+            results = await asyncio.gather(*futures, return_exceptions=True)
+            return results, pipeline.stages[0]
+        finally:
+            pipeline.stop()
+
+    results, stage = run(main())
+    assert results[:2] == [1, 2] and results[3] == 4
+    assert isinstance(results[2], ValueError)
+    assert stage.failed == 1
+    assert stage.processed == 3
+
+
+def test_full_queues_block_submitting():
+    async def main():
+        release = asyncio.Event()
+
+        async def wait(item):
+            await release.wait()
+            return item
+
+        pipeline = Pipeline().add_stage('wait', wait, concurrency=1, queue_size=1)
+        pipeline.start()
+        try:
+            # One item is being handled and one is queued, the third has to wait for room
+            first = await pipeline.submit(1)
+            await asyncio.sleep(0)
+            await pipeline.submit(2)
+            blocked = asyncio.ensure_future(pipeline.submit(3))
+            await asyncio.sleep(0.05)
+            was_blocked = not blocked.done()
+
+            release.set()
+            third = await blocked
+            return was_blocked, await first, await third
+        finally:
+            pipeline.stop()
+
+    assert run(main()) == (True, 1, 3)
+
+
+def test_stages_run_concurrently():
+    async def main():
+        active = 0
+        peak = 0
+
+        async def slow(item):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return item
+
+        pipeline = Pipeline().add_stage('slow', slow, concurrency=3, queue_size=10)
+        pipeline.start()
+        try:
+            await asyncio.gather(*[await pipeline.submit(i) for i in range(6)])
+        finally:
+            pipeline.stop()
+        return peak
+
+    assert run(main()) == 3
+
+
+def test_failures_are_logged(caplog):
+    async def fail(item):
+        raise RuntimeError('boom')
+
+    async def main():
+        pipeline = Pipeline().add_stage('fail', fail)
+        pipeline.start()
+        future = await pipeline.submit(1)
+        with pytest.raises(RuntimeError):
+            await future
+        pipeline.stop()
+
+    run(main())
+    assert 'Pipeline stage fail failed' in caplog.text
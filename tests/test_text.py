@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from model.text import TextNormalizer
+
+
+def test_discord_markup_is_replaced():
+    normalizer = TextNormalizer()
+    text = "I can't see https://example.com/a?b=1 <@123456789012345678> ok <#123456789012345678>"
+    assert normalizer.clean(text) == 'i cannot see __url__ __user__ ok __channel__'
+
+
+def test_custom_emojis_are_removed():
+    assert TextNormalizer().clean('<:pog:123456789012345678> nice one') == 'nice one'
+
+
+def test_contractions_are_expanded():
+    assert TextNormalizer().clean("What's up, he'll go, she'd stay!!") == 'what is up he will go she would stay'
+
+
+def test_single_words_are_dropped():
+    normalizer = TextNormalizer()
+    assert normalizer.clean('word') == ''
+    assert normalizer.clean('  word!!  ') == ''
+
+
+def test_blacklist_is_case_insensitive():
+    assert TextNormalizer(['bob']).clean('BOB is here') == '__name__ is here'
+
+
+def test_blacklist_phrases_are_regular_expressions():
+    normalizer = TextNormalizer([r'bo+b', 'alice|zed'])
+    assert normalizer.clean('Booob met zed') == '__name__ met __name__'
+
+
+def test_blacklist_is_only_recompiled_when_it_changes():
+    normalizer = TextNormalizer(['bob'])
+    pattern = normalizer.blacklist
+    normalizer.set_blacklist(['bob'])
+    assert normalizer.blacklist is pattern
+    normalizer.set_blacklist(['alice'])
+    assert normalizer.blacklist is not pattern
+    normalizer.set_blacklist([])
+    assert normalizer.blacklist is None
+
+
+def test_clean_many_matches_clean():
+    normalizer = TextNormalizer(['bob'])
+    texts = ['Bob is here', 'word', 'Bob is here', "can't stop won't stop"]
+    assert normalizer.clean_many(texts) == [normalizer.clean(t) for t in texts]
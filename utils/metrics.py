@@ -0,0 +1,39 @@
+import math
+from collections import deque
+
+
+class Histogram:
+    """Keeps the most recent samples of a measurement to report counts and percentiles."""
+
+    def __init__(self, size: int = 1000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def percentile(self, q: float):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1)]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': max(self.samples, default=0.0),
+        }
+
+    def format(self, unit: str = 's'):
+        s = self.summary()
+        return (
+            f"n={s['count']} mean={s['mean']:.3f}{unit} p50={s['p50']:.3f}{unit} "
+            f"p95={s['p95']:.3f}{unit} p99={s['p99']:.3f}{unit} max={s['max']:.3f}{unit}"
+        )
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+
+from .metrics import Histogram
+
+
+class Stage:
+    def __init__(self, name: str, handler, concurrency: int = 1, queue_size: int = 2):
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+        self.timings = Histogram()
+        self.queue_depth = Histogram()
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0
+
+    def format(self):
+        return (
+            f"{self.name}: {self.processed} done, {self.failed} failed, {self.busy}/{self.concurrency} busy, "
+            f"queued {self.queue.qsize()}/{self.queue.maxsize} (p95 {self.queue_depth.percentile(95):.0f}), "
+            f"{self.timings.format()}"
+        )
+
+
+class Pipeline:
+    """
+    Chain of asynchronous stages connected by bounded queues.
+
+    Every stage runs `concurrency` workers calling its handler with the item the previous stage
+    returned. A full queue blocks the stage before it, so a slow stage slows down submitting
+    instead of letting work pile up in memory. A handler returning None ends the item early.
+    """
+
+    def __init__(self, logger=None):
+        self.stages = []
+        self.workers = []
+        self.logger = logger or logging.getLogger(__name__)
+
+    def add_stage(self, name: str, handler, concurrency: int = 1, queue_size: int = 2):
+        self.stages.append(Stage(name, handler, concurrency, queue_size))
+        return self
+
+    def start(self):
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.concurrency):
+                self.workers.append(asyncio.create_task(self._work(index)))
+
+    def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+
+    async def submit(self, item):
+        """
+        Queues `item` for the first stage, waiting while that stage's queue is full.
+
+        Returns a future resolved with the output of the last stage, with None when a stage ended
+        the item early, or with the exception a stage raised.
+        """
+        future = asyncio.get_event_loop().create_future()
+        # Failures are logged by the workers, callers don't have to await the future
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        await self.stages[0].queue.put((item, future))
+        return future
+
+    async def _work(self, index: int):
+        stage = self.stages[index]
+        while True:
+            item, future = await stage.queue.get()
+            stage.queue_depth.observe(stage.queue.qsize())
+            stage.busy += 1
+            start = time.perf_counter()
+            try:
+                result = await stage.handler(item)
+            except Exception as e:
+                stage.failed += 1
+                self.logger.exception(f"Pipeline stage {stage.name} failed")
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            finally:
+                stage.busy -= 1
+                stage.queue.task_done()
+            stage.timings.observe(time.perf_counter() - start)
+            stage.processed += 1
+
+            if result is None or index + 1 == len(self.stages):
+                if not future.done():
+                    future.set_result(result)
+                continue
+            await self.stages[index + 1].queue.put((result, future))
+
+    def format(self):
+        return '\n'.join(stage.format() for stage in self.stages)
@@ -0,0 +1,131 @@
+import time
+from collections import defaultdict
+
+from .metrics import Histogram
+
+
+class PoolStats:
+    def __init__(self):
+        self.wait = Histogram()
+        self.held = Histogram()
+        # Connections in use or waited for when a connection was requested, as a fraction of the pool size
+        self.saturation = Histogram()
+
+
+class _Checkout:
+    def __init__(self, pool, site, timeout):
+        self.pool = pool
+        self.site = site
+        self.timeout = timeout
+        self.conn = None
+        self.acquired = None
+
+    async def __aenter__(self):
+        pool = self.pool
+        stats = pool.stats[self.site]
+        stats.saturation.observe((pool.in_use + pool.waiting) / pool.max_size)
+        pool.waiting += 1
+        start = time.perf_counter()
+        try:
+            self.conn = await pool.pool.acquire(timeout=self.timeout)
+        finally:
+            pool.waiting -= 1
+        self.acquired = time.perf_counter()
+        stats.wait.observe(self.acquired - start)
+        pool.in_use += 1
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        pool = self.pool
+        try:
+            await pool.pool.release(self.conn)
+        finally:
+            pool.in_use -= 1
+            pool.stats[self.site].held.observe(time.perf_counter() - self.acquired)
+
+
+class InstrumentedPool:
+    """
+    Wraps an asyncpg pool to measure how connections are used.
+
+    Every `acquire` records how long the caller waited for a connection, how long it kept it and
+    how busy the pool was, keyed by the `site` the caller names. Everything else is passed through
+    to the pool.
+    """
+
+    def __init__(self, pool, max_size: int = 10):
+        self.pool = pool
+        self.max_size = max_size
+        self.in_use = 0
+        self.waiting = 0
+        self.stats = defaultdict(PoolStats)
+
+    def acquire(self, *, timeout=None, site: str = 'unnamed'):
+        return _Checkout(self, site, timeout)
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+    def format(self, limit: int = 10):
+        """Usage of the call sites that waited the longest for connections in total."""
+        sites = sorted(self.stats.items(), key=lambda item: item[1].wait.total, reverse=True)[:limit]
+        lines = [f"{self.in_use}/{self.max_size} connections in use, {self.waiting} callers waiting"]
+        for site, stats in sites:
+            lines.append(
+                f"{site}: {stats.wait.count} checkouts, wait p95 {stats.wait.percentile(95) * 1000:.1f}ms, "
+                f"held p95 {stats.held.percentile(95) * 1000:.1f}ms, saturation p95 {stats.saturation.percentile(95):.0%}"
+            )
+        return '\n'.join(lines)
+
+
+def acquire(pool, site: str):
+    """Acquires a connection from `pool` on behalf of `site`, plain asyncpg pools are supported too."""
+    if isinstance(pool, InstrumentedPool):
+        return pool.acquire(site=site)
+    return pool.acquire()
+
+
+class Borrowed:
+    """Context manager handing out a connection owned by someone else, it is neither acquired nor released."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def __aenter__(self):
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class UnitOfWork:
+    """
+    One connection and transaction shared by several queries.
+
+    Queries given the connection run in the transaction, which commits when the block exits and
+    rolls back if it raises.
+    """
+
+    def __init__(self, pool, site: str):
+        self.checkout = acquire(pool, site)
+        self.transaction = None
+
+    async def __aenter__(self):
+        conn = await self.checkout.__aenter__()
+        try:
+            self.transaction = conn.transaction()
+            await self.transaction.start()
+        except BaseException:
+            await self.checkout.__aexit__(None, None, None)
+            raise
+        return conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                await self.transaction.commit()
+            else:
+                await self.transaction.rollback()
+        finally:
+            await self.checkout.__aexit__(exc_type, exc, tb)
+        return False
@@ -0,0 +1,43 @@
+import time
+
+
+class ScanRecord:
+    """
+    The parts of a `discord.Message` the scanning pipeline needs.
+
+    Buffered messages are kept as these records instead of the messages themselves, so the
+    buffer doesn't hold on to authors, channels, embeds and attachments from discord.py's cache.
+    """
+
+    __slots__ = ('id', 'channel_id', 'guild_id', 'author_id', 'author_name', 'avatar_url', 'content', 'enqueued', 'entry_id')
+
+    def __init__(self, id, channel_id, guild_id, author_id, author_name, avatar_url, content, enqueued=None):
+        self.id = id
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.author_id = author_id
+        self.author_name = author_name
+        self.avatar_url = avatar_url
+        self.content = content
+        self.enqueued = time.monotonic() if enqueued is None else enqueued
+        # Id of the scan stream entry the record was read from
+        self.entry_id = None
+
+    @classmethod
+    def from_message(cls, message):
+        return cls(
+            message.id,
+            message.channel.id,
+            message.guild.id if message.guild is not None else None,
+            message.author.id,
+            str(message.author),
+            str(message.author.avatar_url_as(format='png')),
+            message.content
+        )
+
+    @property
+    def jump_url(self):
+        return f"https://discord.com/channels/{self.guild_id or '@me'}/{self.channel_id}/{self.id}"
+
+    def __repr__(self):
+        return f'<ScanRecord id={self.id} channel_id={self.channel_id} author_id={self.author_id}>'
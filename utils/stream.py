@@ -0,0 +1,133 @@
+import socket
+import time
+
+import aioredis
+
+from .records import ScanRecord
+
+
+def _str(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class ScanStream:
+    """
+    Durable scan buffer backed by a Redis Stream and a consumer group.
+
+    Messages are appended with `add` as soon as they arrive. Every scanning process reads
+    its share of the entries as a consumer of the group, and acknowledges them with `ack`
+    once their scores and infractions are persisted. Entries a consumer read but never
+    acknowledged stay pending: the same consumer reads them again after a restart, and other
+    consumers claim them with `reclaim` once they have been idle for `claim_idle_ms`.
+    """
+
+    def __init__(self, redis, name='flagbot:scan', group='scanner', consumer=None, claim_idle_ms=300000, max_len=100000):
+        self.redis = redis
+        self.name = name
+        self.group = group
+        # A stable name lets a restarted process pick its own pending entries back up
+        self.consumer = consumer or socket.gethostname()
+        self.claim_idle_ms = claim_idle_ms
+        self.max_len = max_len
+
+    async def create_group(self):
+        try:
+            await self.redis.xgroup_create(self.name, self.group, latest_id='0', mkstream=True)
+        except aioredis.errors.ReplyError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    @staticmethod
+    def to_fields(record: ScanRecord):
+        return {
+            'id': record.id,
+            'channel_id': record.channel_id,
+            'guild_id': record.guild_id or 0,
+            'author_id': record.author_id,
+            'author_name': record.author_name,
+            'avatar_url': record.avatar_url,
+            'content': record.content,
+            # Monotonic clocks aren't comparable across processes, the wall clock time is stored instead
+            'time': time.time() - (time.monotonic() - record.enqueued),
+        }
+
+    @staticmethod
+    def from_fields(entry_id, fields):
+        fields = {_str(k): _str(v) for k, v in fields.items()}
+        record = ScanRecord(
+            int(fields['id']),
+            int(fields['channel_id']),
+            int(fields['guild_id']) or None,
+            int(fields['author_id']),
+            fields['author_name'],
+            fields['avatar_url'],
+            fields['content'],
+            time.monotonic() - max(0.0, time.time() - float(fields['time']))
+        )
+        record.entry_id = _str(entry_id)
+        return record
+
+    async def add(self, records):
+        if not records:
+            return
+        tr = self.redis.pipeline()
+        for record in records:
+            tr.xadd(self.name, self.to_fields(record), max_len=self.max_len)
+        await tr.execute()
+
+    async def read(self, count: int, timeout_ms: int = None):
+        """Reads up to `count` entries no consumer has read yet, waiting up to `timeout_ms` for the first one."""
+        # Blocking reads get a connection of their own, pooled connections are shared by concurrent commands
+        with await self.redis as conn:
+            entries = await conn.xread_group(
+                self.group, self.consumer, [self.name], timeout=timeout_ms, count=count, latest_ids=['>']
+            )
+        return [self.from_fields(entry_id, fields) for _, entry_id, fields in entries]
+
+    async def read_pending(self, count: int = 1000):
+        """
+        Reads the entries this consumer read before but never acknowledged, e.g. before a restart.
+
+        Entries trimmed from the stream by `max_len` in the meantime come back without fields, they
+        can't be scanned anymore and are acknowledged so they don't stay pending forever.
+        """
+        records = []
+        last_id = '0'
+        while True:
+            # aioredis drops entries without fields from its parsed reply, the raw reply keeps them
+            reply = await self.redis.execute(
+                b'XREADGROUP', b'GROUP', self.group, self.consumer, b'COUNT', count, b'STREAMS', self.name, last_id
+            )
+            entries = reply[0][1] if reply else []
+            trimmed = [entry_id for entry_id, fields in entries if fields is None]
+            if trimmed:
+                await self.redis.xack(self.name, self.group, *trimmed)
+            records.extend(
+                self.from_fields(entry_id, dict(zip(fields[::2], fields[1::2])))
+                for entry_id, fields in entries if fields is not None
+            )
+            if len(entries) < count:
+                return records
+            last_id = entries[-1][0]
+
+    async def reclaim(self, count: int = 1000):
+        """Claims entries other consumers left pending for longer than `claim_idle_ms`."""
+        pending = await self.redis.xpending(self.name, self.group, '-', '+', count)
+        ids = [
+            entry_id for entry_id, consumer, idle, _ in pending
+            if _str(consumer) != self.consumer and idle >= self.claim_idle_ms
+        ]
+        if not ids:
+            return []
+        entries = await self.redis.xclaim(self.name, self.group, self.consumer, self.claim_idle_ms, *ids)
+        return [self.from_fields(entry_id, fields) for entry_id, fields in entries]
+
+    async def ack(self, records):
+        ids = [r.entry_id for r in records if r.entry_id is not None]
+        if ids:
+            await self.redis.xack(self.name, self.group, *ids)
+
+    async def stats(self):
+        length = await self.redis.xlen(self.name)
+        pending = await self.redis.xpending(self.name, self.group)
+        return {'length': length, 'pending': pending[0] if pending else 0}
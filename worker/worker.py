@@ -19,6 +19,8 @@ import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
 
+from common.migrations import apply_migrations
+from common.queries import queries
 from .db import get_stats,get_total_reviews,get_total_remaining_reviews
 log = logging.getLogger(__name__)
 
@@ -65,7 +67,10 @@ class Worker:
             log.critical("Cannot connect to db, no credentials!")
             await self.logout()
         
-        self.db = await asyncpg.create_pool(**credentials)
+        self.db = await asyncpg.create_pool(**credentials, **queries.pool_options())
+        if await apply_migrations(self.db):
+            # Statements were prepared against the old schema
+            await self.db.expire_connections()
         self.db_available.set()
 
     @classmethod